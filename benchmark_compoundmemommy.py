@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+CompoundMeMommy Benchmarks v1.2.4
+
+Timing and allocation benchmarks for the calculation hot paths.
+
+Run: python benchmark_compoundmemommy.py
+"""
+
+import sys
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from compoundmemommy_calculator import CompoundMeMommyCalculator
+
+def standard_config(calculator: CompoundMeMommyCalculator) -> dict:
+    return {
+        'formulation_type': 'injectable',
+        'ester_key': 'testosterone_cypionate',
+        'ester': calculator.esters['testosterone_cypionate'],
+        'total_volume': 10.0,
+        'loss_modifier': 10.0,
+        'concentration': 200.0,
+        'oil_key': 'mct_oil',
+        'oil': calculator.carrier_oils['mct_oil'],
+        'ba_percent': 2.0,
+        'bb_percent': 10.0
+    }
+
+def measure(func, iterations: int):
+    """Per-call time (µs) plus bytes and blocks retained per kept result"""
+    func()  # warm caches
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_call_us = (time.perf_counter() - start) / iterations * 1e6
+
+    kept = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(1000):
+        kept.append(func())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    return per_call_us, size / len(kept), blocks / len(kept)
+
+def bench_lean_mode(iterations: int = 20000):
+    calculator = CompoundMeMommyCalculator()
+    config = standard_config(calculator)
+
+    print("calculate_formulation: full vs lean result")
+    print("-" * 60)
+    print(f"{'Mode':10} {'Time (µs)':>12} {'Bytes/result':>15} {'Blocks/result':>15}")
+    print("-" * 60)
+    results = {}
+    for mode, lean in (('full', False), ('lean', True)):
+        results[mode] = measure(lambda: calculator.calculate_formulation(config, lean=lean), iterations)
+        per_call_us, size, blocks = results[mode]
+        print(f"{mode:10} {per_call_us:12.2f} {size:15.0f} {blocks:15.1f}")
+    print("-" * 60)
+    full, lean = results['full'], results['lean']
+    print(f"Reduction: {1 - lean[0] / full[0]:.0%} time, {1 - lean[1] / full[1]:.0%} bytes, "
+          f"{1 - lean[2] / full[2]:.0%} blocks per call")
+    print()
+
+def bench_parallel_sweep(chunk_size: int = 65536):
+    calculator = CompoundMeMommyCalculator()
+    axes = (np.arange(10.0, 500.0, 0.5), list(calculator.esters), list(calculator.carrier_oils),
+            np.arange(0.0, 5.5, 0.5), np.arange(0.0, 31.0, 2.0))
+    n_cores = os.cpu_count() or 1
+
+    print(f"parallel_sweep scaling (chunk size {chunk_size}, {n_cores} cores available)")
+    print("-" * 60)
+    print(f"{'Workers':10} {'Rows':>12} {'Time (s)':>12} {'Rows/s':>12} {'Speedup':>9}")
+    print("-" * 60)
+    baseline = None
+    for workers in sorted({1, 2, 4, n_cores}):
+        start = time.perf_counter()
+        rows = sum(len(chunk['concentration'])
+                   for chunk in calculator.parallel_sweep(*axes, workers=workers, chunk_size=chunk_size))
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:<10} {rows:12d} {elapsed:12.2f} {rows / elapsed:12.0f} {baseline / elapsed:8.2f}x")
+    print("-" * 60)
+    print()
+
+def bench_pk_curves(iterations: int = 50):
+    calculator = CompoundMeMommyCalculator()
+    injectable = [key for key, ester in calculator.esters.items() if ester.get('half_life_days')]
+
+    print("simulate_serum_levels: 365 days at hourly resolution")
+    print("-" * 60)
+    print(f"{'Schedules':10} {'Points':>12} {'Time (ms)':>12}")
+    print("-" * 60)
+    for n_schedules in (1, 10, 100):
+        keys = [injectable[i % len(injectable)] for i in range(n_schedules)]
+        calculator.simulate_serum_levels(keys, 5.0, 7.0)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            result = calculator.simulate_serum_levels(keys, 5.0, 7.0)
+        elapsed_ms = (time.perf_counter() - start) / iterations * 1e3
+        print(f"{n_schedules:<10} {result['levels'].size:12d} {elapsed_ms:12.2f}")
+    print("-" * 60)
+    print()
+
+def bench_level_plots(n_curves: int = 50, renders: int = 5):
+    import matplotlib.pyplot as plt
+    calculator = CompoundMeMommyCalculator()
+    curves = calculator.simulate_serum_levels(['estradiol_valerate'] * n_curves, np.linspace(2, 8, n_curves), 7.0)
+
+    print(f"Rendering {n_curves} year-long hourly curves ({renders} renders)")
+    print("-" * 60)
+    start = time.perf_counter()
+    for _ in range(renders):
+        fig, ax = plt.subplots(figsize=(11, 8.5))
+        for row in curves['levels']:
+            ax.plot(curves['time_days'], row)
+        fig.canvas.draw()
+        plt.close(fig)
+    naive = (time.perf_counter() - start) / renders
+
+    calculator.plot_level_curves(curves)
+    start = time.perf_counter()
+    for _ in range(renders):
+        calculator.plot_level_curves(curves)
+    reused = (time.perf_counter() - start) / renders
+    print(f"{'New figure, per-line plot':35} {naive * 1e3:10.1f} ms")
+    print(f"{'Reused canvas, LineCollection':35} {reused * 1e3:10.1f} ms")
+    print("-" * 60)
+    print()
+
+def bench_recipe_index(n_recipes: int = 50000):
+    import json
+    import shutil
+    import tempfile
+    calculator = CompoundMeMommyCalculator()
+    base_dir = tempfile.mkdtemp(prefix="compoundmemommy_bench_")
+    try:
+        recipes_dir = os.path.join(base_dir, "recipes")
+        os.makedirs(recipes_dir)
+        document = json.dumps(calculator.calculate_formulation(standard_config(calculator)), indent=2)
+        for i in range(n_recipes):
+            with open(os.path.join(recipes_dir, f"recipe_{i:06d}.json"), 'w') as f:
+                f.write(document)
+        past = time.time_ns() - 10 * 10**9
+        os.utime(recipes_dir, ns=(past, past))
+
+        print(f"Recipe listing + summaries ({n_recipes} recipes)")
+        print("-" * 60)
+        for label in ("first run (parse all)", "new process (index file)", "warm (in memory)"):
+            if label.startswith("new"):
+                calculator = CompoundMeMommyCalculator()
+            calculator.cache_dir, calculator.recipes_dir = base_dir, recipes_dir
+            start = time.perf_counter()
+            calculator.list_recipes()
+            calculator.recipe_summaries()
+            print(f"{label:35} {(time.perf_counter() - start) * 1e3:10.1f} ms")
+
+        formulation = calculator.calculate_formulation(standard_config(calculator))
+        n_saves = 200
+        start = time.perf_counter()
+        for i in range(n_saves):
+            calculator.save_recipe(formulation, f"saved_{i:04d}")
+        per_save = (time.perf_counter() - start) / n_saves
+        start = time.perf_counter()
+        calculator.recipe_index().flush()
+        print(f"{'save_recipe (per save)':35} {per_save * 1e3:10.2f} ms")
+        print(f"{'index flush after saves':35} {(time.perf_counter() - start) * 1e3:10.1f} ms")
+        print("-" * 60)
+        print()
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    bench_lean_mode()
+    bench_parallel_sweep()
+    bench_pk_curves()
+    bench_level_plots()
+    bench_recipe_index()
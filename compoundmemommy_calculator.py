@@ -16,9 +16,19 @@ ALL PHARMACEUTICAL DATA VERIFIED + API DISPLAYED AS GRAMS FOR WEIGHING:
 import sys
 import os
 import subprocess
+import time
 import platform
 import json
 import random
+import sqlite3
+import functools
+import copy
+import atexit
+import bisect
+import hashlib
+import math
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional, Union
 from enum import Enum
@@ -31,6 +41,10 @@ try:
     import matplotlib.pyplot as plt
     import matplotlib.patches as patches
     from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+    from matplotlib.lines import Line2D
     import matplotlib
     matplotlib.use('Agg')
     PDF_AVAILABLE = True
@@ -38,6 +52,13 @@ except ImportError:
     PDF_AVAILABLE = False
     logger.warning("matplotlib not available - PDF export disabled")
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logger.warning("numpy not available - batch calculations disabled")
+
 class ConfigStep(Enum):
     LOSS_MODIFIER = "loss_modifier"
     NUM_VIALS = "num_vials"
@@ -54,6 +75,1268 @@ class ConfigStep(Enum):
 class ValidationError(Exception):
     pass
 
+# USP pharmaceutical grade excipient densities (g/mL)
+BENZYL_ALCOHOL_DENSITY = 1.045
+BENZYL_BENZOATE_DENSITY = 1.118
+
+# Solubility status codes: index into SOLUBILITY_STATUS_LABELS
+SOLUBILITY_STATUS_LABELS = ("Excellent", "Good", "Marginal", "High Risk", "Unknown")
+SOLUBILITY_STATUS_THRESHOLDS = (0.7, 0.85, 1.0)
+SOLUBILITY_STATUS_UNKNOWN = 4
+
+# Benzyl benzoate range offered when BB is used (%)
+BB_PERCENT_MIN = 5.0
+BB_PERCENT_MAX = 25.0
+# Solubility gain per % benzyl benzoate: max = oil max * (1 + BB% / 100 * BB_SOLUBILITY_GAIN)
+BB_SOLUBILITY_GAIN = 2.5
+
+# Ingredient compatibility limits (%): above *_SAFE_LIMIT is invalid, above *_WARN warns
+BB_PERCENT_SAFE_LIMIT = 30
+BB_PERCENT_WARN = 20
+BA_PERCENT_SAFE_LIMIT = 5
+BA_PERCENT_WARN = 3
+
+# Monte Carlo default tolerances: relative standard deviations of weighing,
+# pipetting and literature density values
+MONTE_CARLO_TOLERANCES = {
+    'api_mass': 0.005,
+    'ba_volume': 0.01,
+    'bb_volume': 0.01,
+    'oil_volume': 0.01,
+    'ester_density': 0.01,
+    'oil_density': 0.005
+}
+
+# Pharmacokinetic model: first-order release from the oil depot at the ester's
+# half_life_days, first-order elimination of the released hormone at this rate
+PK_ELIMINATION_HALF_LIFE_DAYS = 0.1
+
+# Batch error codes (0 = row calculated successfully)
+BATCH_OK = 0
+BATCH_INVALID_INPUT = 1
+BATCH_UNKNOWN_KEY = 2
+BATCH_NEGATIVE_OIL_VOLUME = 3
+
+def _require_numpy(feature: str):
+    if not NUMPY_AVAILABLE:
+        raise ValidationError(f"{feature} requires numpy. Install with: pip install numpy")
+
+def solubility_status_codes(concentration, estimated_max):
+    """Vectorized assess_solubility_status returning integer status codes"""
+    concentration = np.asarray(concentration, dtype=float)
+    estimated_max = np.asarray(estimated_max, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = concentration / estimated_max
+    codes = np.searchsorted(np.asarray(SOLUBILITY_STATUS_THRESHOLDS), ratio, side='left')
+    return np.where((estimated_max > 0) & ~np.isnan(ratio), codes, SOLUBILITY_STATUS_UNKNOWN).astype(np.int8)
+
+# COMPREHENSIVE PHARMACEUTICAL CORRECTIONS: Complete ester database with verified data
+ESTER_DATABASE = {
+    "estradiol_valerate": {
+        "name": "Estradiol Valerate", "molecular_weight": 356.50, "base_molecular_weight": 272.38,
+        "density": 1.102, "ester_efficiency": 0.7640, "typical_concentrations": [20, 30, 40, 50],
+        "max_safe_concentration": 80, "common_doses": [3, 4, 5, 6],
+        "base_solubility": {"sesame_oil": 65, "mct_oil": 75, "cottonseed_oil": 65, "grapeseed_oil": 70, 
+                          "castor_oil": 85, "olive_oil": 60, "sunflower_oil": 67, "safflower_oil": 67, "custom": 67},
+        "category": "estradiol", "route": "injectable", "half_life_days": 3.5, "typical_injection_interval": "14 days"
+    },
+    "estradiol_cypionate": {
+        "name": "Estradiol Cypionate", "molecular_weight": 396.57, "base_molecular_weight": 272.38,
+        "density": 1.083, "ester_efficiency": 0.6868, "typical_concentrations": [20, 30, 40, 50],
+        "max_safe_concentration": 75, "common_doses": [3, 4, 5, 6],
+        "base_solubility": {"sesame_oil": 55, "mct_oil": 65, "cottonseed_oil": 55, "grapeseed_oil": 60,
+                          "castor_oil": 75, "olive_oil": 50, "sunflower_oil": 57, "safflower_oil": 57, "custom": 57},
+        "category": "estradiol", "route": "injectable", "half_life_days": 11.0, "typical_injection_interval": "14-21 days"
+    },
+    "estradiol_enanthate": {
+        "name": "Estradiol Enanthate", "molecular_weight": 384.55, "base_molecular_weight": 272.38,
+        "density": 1.110, "ester_efficiency": 0.7083, "typical_concentrations": [20, 30, 40, 50],
+        "max_safe_concentration": 85, "common_doses": [3, 4, 5, 6],
+        "base_solubility": {"sesame_oil": 70, "mct_oil": 80, "cottonseed_oil": 70, "grapeseed_oil": 75,
+                          "castor_oil": 90, "olive_oil": 65, "sunflower_oil": 72, "safflower_oil": 72, "custom": 72},
+        "category": "estradiol", "route": "injectable", "half_life_days": 8.0, "typical_injection_interval": "7 days"
+    },
+    "estradiol_undecylate": {
+        "name": "Estradiol Undecylate", "molecular_weight": 440.66, "base_molecular_weight": 272.38,
+        "density": 1.070, "ester_efficiency": 0.6181, "typical_concentrations": [20, 30, 40, 50],
+        "max_safe_concentration": 70, "common_doses": [3, 4, 5, 6],
+        "base_solubility": {"sesame_oil": 60, "mct_oil": 70, "cottonseed_oil": 60, "grapeseed_oil": 65,
+                          "castor_oil": 80, "olive_oil": 55, "sunflower_oil": 62, "safflower_oil": 62, "custom": 62},
+        "category": "estradiol", "route": "injectable", "half_life_days": 29.0, "typical_injection_interval": "28-42 days"
+    },
+    "estradiol_spray": {
+        "name": "17beta-Estradiol Transdermal Spray", "molecular_weight": 272.38, "base_molecular_weight": 272.38,
+        "density": 1.27, "ester_efficiency": 1.0, "fixed_concentration": 58.33, "max_safe_concentration": 100,
+        "common_doses": [0.5, 0.75, 1.0, 1.25], "category": "estradiol", "route": "transdermal_spray", "absorption_rate": 0.12,
+        "spray_components": {"isopropyl_myristate": {"percentage": 40.0, "density": 0.922},
+                           "isopropyl_alcohol_91": {"percentage": 40.0, "density": 0.785},
+                           "propylene_glycol": {"percentage": 10.0, "density": 1.036},
+                           "polysorbate_80": {"percentage": 10.0, "density": 1.064}}
+    },
+    "testosterone_enanthate": {
+        "name": "Testosterone Enanthate", "molecular_weight": 400.59, "base_molecular_weight": 288.42,
+        "density": 1.056, "ester_efficiency": 0.7200, "typical_concentrations": [150, 200, 250, 300, 400],
+        "max_safe_concentration": 500, "common_doses": [50, 75, 100, 125, 150],
+        "base_solubility": {"sesame_oil": 280, "mct_oil": 320, "cottonseed_oil": 280, "grapeseed_oil": 290,
+                          "castor_oil": 350, "olive_oil": 270, "sunflower_oil": 285, "safflower_oil": 285, "custom": 285},
+        "category": "testosterone", "route": "injectable", "half_life_days": 4.5, "typical_injection_interval": "7-14 days"
+    },
+    "testosterone_cypionate": {
+        "name": "Testosterone Cypionate", "molecular_weight": 412.61, "base_molecular_weight": 288.42,
+        "density": 1.080, "ester_efficiency": 0.6990, "typical_concentrations": [150, 200, 250, 300],
+        "max_safe_concentration": 400, "common_doses": [50, 75, 100, 125, 150],
+        "base_solubility": {"sesame_oil": 220, "mct_oil": 250, "cottonseed_oil": 220, "grapeseed_oil": 230,
+                          "castor_oil": 270, "olive_oil": 210, "sunflower_oil": 225, "safflower_oil": 225, "custom": 225},
+        "category": "testosterone", "route": "injectable", "half_life_days": 8.0, "typical_injection_interval": "7-14 days"
+    },
+    "testosterone_propionate": {
+        "name": "Testosterone Propionate", "molecular_weight": 344.49, "base_molecular_weight": 288.42,
+        "density": 1.091, "ester_efficiency": 0.8372, "typical_concentrations": [50, 75, 100, 125, 150],
+        "max_safe_concentration": 200, "common_doses": [25, 50, 75, 100],
+        "base_solubility": {"sesame_oil": 120, "mct_oil": 135, "cottonseed_oil": 120, "grapeseed_oil": 125,
+                          "castor_oil": 145, "olive_oil": 115, "sunflower_oil": 122, "safflower_oil": 122, "custom": 122},
+        "category": "testosterone", "route": "injectable", "half_life_days": 0.8, "typical_injection_interval": "1-3 days"
+    },
+    "testosterone_decanoate": {
+        "name": "Testosterone Decanoate", "molecular_weight": 442.67, "base_molecular_weight": 288.42,
+        "density": 1.040, "ester_efficiency": 0.6515, "typical_concentrations": [200, 250, 300, 400, 500],
+        "max_safe_concentration": 600, "common_doses": [75, 100, 125, 150, 200],
+        "base_solubility": {"sesame_oil": 380, "mct_oil": 420, "cottonseed_oil": 380, "grapeseed_oil": 395,
+                          "castor_oil": 450, "olive_oil": 370, "sunflower_oil": 385, "safflower_oil": 385, "custom": 385},
+        "category": "testosterone", "route": "injectable", "half_life_days": 7.0, "typical_injection_interval": "14-21 days"
+    }
+}
+
+# CORRECTED: Carrier oil densities from pharmaceutical/food science literature
+CARRIER_OIL_DATABASE = {
+    "mct_oil": {"name": "MCT Oil", "density": 0.95, "solubility_factor": 1.1},
+    "cottonseed_oil": {"name": "Cottonseed Oil", "density": 0.92, "solubility_factor": 1.0},
+    "sesame_oil": {"name": "Sesame Oil", "density": 0.919, "solubility_factor": 1.0},
+    "grapeseed_oil": {"name": "Grapeseed Oil", "density": 0.92, "solubility_factor": 1.05},
+    "castor_oil": {"name": "Castor Oil", "density": 0.955, "solubility_factor": 1.25},
+    "olive_oil": {"name": "Olive Oil", "density": 0.90, "solubility_factor": 0.95},
+    "sunflower_oil": {"name": "Sunflower Oil", "density": 0.92, "solubility_factor": 1.02},
+    "safflower_oil": {"name": "Safflower Oil", "density": 0.92, "solubility_factor": 1.02},
+    "custom": {"name": "Custom Oil", "density": 0.92, "solubility_factor": 1.0}
+}
+
+class CompiledDatabase:
+    """Read-only struct-of-arrays view of the ester and carrier oil tables.
+
+    Esters and oils are addressed by integer index (see ester_index/oil_index).
+    Esters without solubility data (the spray) have has_solubility False and a
+    NaN base_solubility row. Views compiled from identical tables compare
+    equal, so caches keyed on the view are shared between calculators.
+    """
+
+    def __init__(self, esters: Dict, carrier_oils: Dict):
+        self.ester_keys = tuple(esters)
+        self.oil_keys = tuple(carrier_oils)
+        self.ester_index = {k: i for i, k in enumerate(self.ester_keys)}
+        self.oil_index = {k: i for i, k in enumerate(self.oil_keys)}
+        self.version = database_version_hash(esters, carrier_oils)
+        self.ester_hash = ester_table_hash(esters)
+
+        # Holding the source dicts keeps their ids stable for find_ester()
+        self._ester_refs = tuple(esters.values())
+        self._ester_ids = {id(e): i for i, e in enumerate(self._ester_refs)}
+        self._oil_refs = carrier_oils
+
+        def column(field, default=float('nan')):
+            return self._frozen([e.get(field, default) for e in self._ester_refs])
+
+        self.molecular_weight = column('molecular_weight')
+        self.density = column('density', 1.05)
+        self.ester_efficiency = column('ester_efficiency')
+        self.max_safe_concentration = column('max_safe_concentration', 1000)
+        self.half_life_days = column('half_life_days')
+
+        self.has_solubility = self._frozen([bool(e.get('base_solubility')) for e in self._ester_refs], dtype=bool)
+        self.base_solubility = self._frozen([
+            [e['base_solubility'].get(o, 250) for o in self.oil_keys] if e.get('base_solubility')
+            else [float('nan')] * len(self.oil_keys)
+            for e in self._ester_refs])
+
+        self.oil_density = self._frozen([carrier_oils[o].get('density', 0.92) for o in self.oil_keys])
+        self.oil_solubility_factor = self._frozen([carrier_oils[o].get('solubility_factor', 1.0) for o in self.oil_keys])
+
+    def _identity(self) -> Tuple:
+        return self.version, self.ester_keys, self.oil_keys
+
+    def __eq__(self, other):
+        return isinstance(other, CompiledDatabase) and self._identity() == other._identity()
+
+    def __hash__(self):
+        return hash(self._identity())
+
+    @staticmethod
+    def _frozen(values, dtype=float):
+        array = np.array(values, dtype=dtype)
+        array.setflags(write=False)
+        return array
+
+    def find_ester(self, ester: Dict) -> Optional[int]:
+        """Index of an ester dict taken from the compiled table, None for copies"""
+        return self._ester_ids.get(id(ester))
+
+    def ester_indices(self, keys):
+        """Map ester keys (or integer indices) to an index array, -1 for unknown keys"""
+        return self._lookup(keys, self.ester_index)
+
+    def oil_indices(self, keys):
+        """Map oil keys (or integer indices) to an index array, -1 for unknown keys"""
+        return self._lookup(keys, self.oil_index)
+
+    @staticmethod
+    def _lookup(keys, index):
+        keys = np.asarray(keys)
+        if np.issubdtype(keys.dtype, np.integer):
+            return np.where((keys >= 0) & (keys < len(index)), keys, -1)
+        unique_keys, inverse = np.unique(keys.astype(str), return_inverse=True)
+        mapped = np.array([index.get(k, -1) for k in unique_keys], dtype=np.intp)
+        return mapped[inverse].reshape(keys.shape)
+
+def invalidate_database_caches():
+    """Drop every process-wide cache derived from compiled ester/oil tables.
+
+    The caches are keyed on the compiled view, so this only frees memory;
+    calculators pick up edits to their own tables via invalidate_caches().
+    """
+    _cached_solubility_limit.cache_clear()
+    _SOLUBILITY_GRIDS.clear()
+    _STEADY_STATE_TABLES.clear()
+    _RESPONSE_CURVES.clear()
+
+SOLUBILITY_CACHE_SIZE = 1024
+
+def _solubility_factors(ester: Dict, oil_key: str, db: Optional[CompiledDatabase],
+                        carrier_oils: Dict) -> Optional[Tuple[float, float]]:
+    """(database solubility, oil factor) for an ester/oil pair, None without solubility data"""
+    if db is not None:
+        ester_idx = db.find_ester(ester)
+        oil_idx = db.oil_index.get(oil_key)
+        if ester_idx is not None and oil_idx is not None:
+            if not db.has_solubility[ester_idx]:
+                return None
+            return float(db.base_solubility[ester_idx, oil_idx]), float(db.oil_solubility_factor[oil_idx])
+
+    base_solubility = ester.get("base_solubility", {})
+    if not base_solubility:
+        return None
+    oil_factor = carrier_oils.get(oil_key, {"solubility_factor": 1.0})["solubility_factor"]
+    return base_solubility.get(oil_key, 250), oil_factor
+
+def _solubility_limit(ester: Dict, oil_key: str, bb_percent: float, db: Optional[CompiledDatabase],
+                      carrier_oils: Dict) -> float:
+    factors = _solubility_factors(ester, oil_key, db, carrier_oils)
+    if factors is None:
+        return 1000.0
+    database_max_solubility, oil_factor = factors
+    oil_enhanced_max = database_max_solubility * oil_factor
+    if bb_percent > 0:
+        bb_multiplier = 1 + (bb_percent / 100) * BB_SOLUBILITY_GAIN
+        return oil_enhanced_max * bb_multiplier
+    return oil_enhanced_max
+
+@functools.lru_cache(maxsize=SOLUBILITY_CACHE_SIZE)
+def _cached_solubility_limit(db: CompiledDatabase, ester_key: str, oil_key: str, bb_percent: float) -> float:
+    return _solubility_limit(db._ester_refs[db.ester_index[ester_key]], oil_key, bb_percent, db, db._oil_refs)
+
+class SolubilityGrid:
+    """Precomputed ester x oil x BB% maximum solubility table.
+
+    Rows and columns follow the compiled database's ester/oil indices. Lookups
+    between BB% grid points are linearly interpolated; BB% outside the grid is
+    clamped to its edges.
+    """
+
+    def __init__(self, db: CompiledDatabase, bb_max: float = 30.0, bb_step: float = 0.1):
+        if bb_max <= 0 or bb_step <= 0:
+            raise ValidationError("Solubility grid range and step must be positive")
+        self.bb_step = bb_step
+        self.bb_values = np.linspace(0.0, bb_max, int(round(bb_max / bb_step)) + 1)
+        self.bb_values.setflags(write=False)
+
+        # Same operation order as _solubility_limit so grid points match it exactly
+        oil_enhanced_max = db.base_solubility * db.oil_solubility_factor
+        bb_multiplier = 1 + (self.bb_values / 100) * BB_SOLUBILITY_GAIN
+        table = np.where(self.bb_values > 0, oil_enhanced_max[:, :, None] * bb_multiplier,
+                         oil_enhanced_max[:, :, None])
+        self.table = np.where(db.has_solubility[:, None, None], table, 1000.0)
+        self.table.setflags(write=False)
+
+    def max_solubility(self, ester_idx, oil_idx, bb_percent):
+        """Interpolated maximum solubility (mg/mL) for index and BB% arrays; NaN where an index is -1 (unknown key)"""
+        ester_idx, oil_idx, bb_percent = np.broadcast_arrays(ester_idx, oil_idx, np.asarray(bb_percent, dtype=float))
+        known = (ester_idx >= 0) & (oil_idx >= 0)
+        ester_idx, oil_idx = np.where(known, ester_idx, 0), np.where(known, oil_idx, 0)
+        position = np.clip(bb_percent / self.bb_step, 0, len(self.bb_values) - 1)
+        nearest = np.rint(position)
+        position = np.where(np.abs(position - nearest) < 1e-9, nearest, position)
+        lower = np.minimum(position.astype(np.intp), len(self.bb_values) - 2)
+        fraction = position - lower
+        below = self.table[ester_idx, oil_idx, lower]
+        above = self.table[ester_idx, oil_idx, lower + 1]
+        return np.where(known, np.where(fraction == 0, below, below + (above - below) * fraction), np.nan)
+
+    def status_code(self, ester_idx, oil_idx, bb_percent, concentration):
+        """Solubility status codes (see SOLUBILITY_STATUS_LABELS) for the given concentrations"""
+        return solubility_status_codes(concentration, self.max_solubility(ester_idx, oil_idx, bb_percent))
+
+_SOLUBILITY_GRIDS = {}
+
+class _LazyFields(dict):
+    """dict whose derived entries are computed and cached on first access.
+
+    Subclasses name their keys in serialization order in FIELDS (or override
+    _field_names() when the set depends on the instance) and compute missing
+    ones in _compute(). Iteration, len(), equality and JSON
+    encoding materialize every field in that order, so the object serializes
+    exactly like the equivalent eagerly built dict.
+    """
+    __slots__ = ('_complete',)
+
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, eager_fields: Dict):
+        dict.__init__(self, eager_fields)
+        self._complete = False
+
+    def _field_names(self) -> Tuple[str, ...]:
+        return self.FIELDS
+
+    def _compute(self, key: str):
+        raise KeyError(key)
+
+    def __missing__(self, key):
+        if self._complete:
+            raise KeyError(key)
+        value = self._compute(key)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def _materialize(self):
+        if self._complete:
+            return
+        names = self._field_names()
+        values = {name: self[name] for name in names}
+        values.update((k, v) for k, v in dict.items(self) if k not in values)
+        dict.clear(self)
+        dict.update(self, values)
+        self._complete = True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (not self._complete and key in self._field_names())
+
+    def __iter__(self):
+        self._materialize()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._materialize()
+        return dict.__len__(self)
+
+    def keys(self):
+        self._materialize()
+        return dict.keys(self)
+
+    def values(self):
+        self._materialize()
+        return dict.values(self)
+
+    def items(self):
+        self._materialize()
+        return dict.items(self)
+
+    def copy(self) -> Dict:
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, _LazyFields):
+            other._materialize()
+        self._materialize()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._materialize()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        return dict, (self.copy(),)
+
+class InjectableCalculations(_LazyFields):
+    """calculate_formulation numbers; masses and solubility fields are computed on first access"""
+    __slots__ = ('_calculator', '_ester', '_oil', '_oil_key', '_concentration', '_bb_percent')
+
+    FIELDS = ('adjusted_volume_ml', 'api_mass_g', 'api_volume_displaced_ml', 'ba_volume_ml', 'ba_mass_g',
+              'bb_volume_ml', 'bb_mass_g', 'oil_volume_ml', 'oil_mass_g', 'estimated_max_solubility',
+              'solubility_explanation', 'solubility_status', 'solubility_ascii')
+
+    def __init__(self, calculator, ester: Dict, oil: Dict, oil_key: str, concentration: float, bb_percent: float,
+                 eager_fields: Dict):
+        super().__init__(eager_fields)
+        self._calculator = calculator
+        self._ester = ester
+        self._oil = oil
+        self._oil_key = oil_key
+        self._concentration = concentration
+        self._bb_percent = bb_percent
+
+    def _compute(self, key: str):
+        calculator = self._calculator
+        if key == 'ba_mass_g':
+            return self['ba_volume_ml'] * BENZYL_ALCOHOL_DENSITY
+        if key == 'bb_mass_g':
+            return self['bb_volume_ml'] * BENZYL_BENZOATE_DENSITY
+        if key == 'oil_mass_g':
+            return self['oil_volume_ml'] * self._oil.get('density', 0.92)
+        if key == 'estimated_max_solubility':
+            return calculator.solubility_limit(self._ester, self._oil_key, self._bb_percent)
+        if key == 'solubility_status':
+            return calculator.assess_solubility_status(self._concentration, self['estimated_max_solubility'])
+        if key == 'solubility_explanation':
+            return calculator.format_solubility_explanation(self._ester, self._oil_key, self._bb_percent, self._concentration)
+        if key == 'solubility_ascii':
+            return calculator.generate_solubility_ascii(self._concentration, self['estimated_max_solubility'])
+        raise KeyError(key)
+
+# Metered spray pump output per actuation (mL)
+SPRAY_ACTUATION_ML = 0.1
+
+SPRAY_EXPOSURE_FIELDS = ('daily_spray_volume_ml', 'daily_applied_mg', 'daily_absorbed_mg', 'bottle_duration_days')
+
+def _spray_exposure(sprays_per_day, ml_per_actuation, concentration, absorption_rate, bottle_volume_ml) -> Dict:
+    """Daily applied/absorbed estradiol and bottle duration; works on floats or numpy arrays"""
+    daily_volume = sprays_per_day * ml_per_actuation
+    daily_applied = daily_volume * concentration
+    return {'daily_spray_volume_ml': daily_volume, 'daily_applied_mg': daily_applied,
+            'daily_absorbed_mg': daily_applied * absorption_rate,
+            'bottle_duration_days': bottle_volume_ml / daily_volume}
+
+class SprayCalculations(_LazyFields):
+    """calculate_spray_formulation numbers; excipient volumes and masses are computed on first access.
+
+    When the config carries a spray_regimen, SPRAY_EXPOSURE_FIELDS are added.
+    """
+    __slots__ = ('_ester', '_regimen')
+
+    FIELDS = ('base_volume_ml', 'adjusted_volume_ml', 'loss_modifier_percent', 'fixed_concentration_mg_per_ml',
+              'total_estradiol_mass_g', 'estradiol_volume_displaced_ml', 'bioavailable_per_ml')
+
+    def __init__(self, ester: Dict, eager_fields: Dict, regimen: Optional[Dict] = None):
+        super().__init__(eager_fields)
+        self._ester = ester
+        self._regimen = regimen
+
+    def _field_names(self) -> Tuple[str, ...]:
+        components = tuple(self._ester.get('spray_components', {}))
+        exposure = SPRAY_EXPOSURE_FIELDS if self._regimen else ()
+        return self.FIELDS + tuple(f"{c}_ml" for c in components) + tuple(f"{c}_g" for c in components) + exposure
+
+    def _compute(self, key: str):
+        if key == 'bioavailable_per_ml':
+            return self['fixed_concentration_mg_per_ml'] * self._ester.get('absorption_rate', 0.12)
+        if self._regimen and key in SPRAY_EXPOSURE_FIELDS:
+            return _spray_exposure(self._regimen['sprays_per_day'],
+                                   self._regimen.get('ml_per_actuation', SPRAY_ACTUATION_ML),
+                                   self['fixed_concentration_mg_per_ml'], self._ester.get('absorption_rate', 0.12),
+                                   self['base_volume_ml'])[key]
+
+        spray_components = self._ester.get('spray_components', {})
+        component, _, unit = key.rpartition('_')
+        if component not in spray_components or unit not in ('ml', 'g'):
+            raise KeyError(key)
+        specs = spray_components[component]
+        if unit == 'g':
+            return self[f"{component}_ml"] * specs['density']
+        volume_ml = self['adjusted_volume_ml'] * (specs['percentage'] / 100)
+        if component == 'isopropyl_alcohol_91':
+            volume_ml -= self['estradiol_volume_displaced_ml']
+        return volume_ml
+
+class FormulationResult(dict):
+    """Result of calculate_formulation / calculate_spray_formulation.
+
+    A dict of 'config', 'calculations' (or 'spray_calculations') and
+    'metadata' whose calculations fill in lazily; json.dumps() produces the
+    same document as before.
+    """
+    __slots__ = ()
+
+    @property
+    def config(self) -> Dict:
+        return self['config']
+
+    @property
+    def calculations(self) -> Dict:
+        return self['spray_calculations'] if 'spray_calculations' in self else self['calculations']
+
+    @property
+    def metadata(self) -> Dict:
+        return self['metadata']
+
+    def to_dict(self) -> Dict:
+        """Plain (fully materialized) dict copy"""
+        return {key: value.copy() if isinstance(value, _LazyFields) else value for key, value in self.items()}
+
+SWEEP_FIELDS = ('concentration', 'ester_key', 'oil_key', 'ba_percent', 'bb_percent', 'total_volume', 'loss_modifier',
+                'adjusted_volume_ml', 'api_mass_g', 'api_volume_displaced_ml', 'ba_volume_ml', 'ba_mass_g',
+                'bb_volume_ml', 'bb_mass_g', 'oil_volume_ml', 'oil_mass_g', 'estimated_max_solubility',
+                'solubility_status', 'compatible', 'compatibility_warning', 'negative_oil_volume', 'error_code')
+
+def _sweep_tuples(items):
+    """Flatten sweep output (records or column chunks) into value tuples in SWEEP_FIELDS order"""
+    for item in items:
+        if NUMPY_AVAILABLE and isinstance(item.get('concentration'), np.ndarray):
+            if 'solubility_status' not in item:
+                item = dict(item, solubility_status=np.asarray(SOLUBILITY_STATUS_LABELS)[item['solubility_status_code']])
+            yield from zip(*[item[field].tolist() for field in SWEEP_FIELDS])
+        else:
+            yield tuple(item[field] for field in SWEEP_FIELDS)
+
+def _sweep_rows(items):
+    for values in _sweep_tuples(items):
+        yield dict(zip(SWEEP_FIELDS, values))
+
+def write_sweep(items, path: str) -> int:
+    """Stream sweep records or chunks to a .csv or .jsonl file; returns the row count"""
+    import csv
+    fmt = os.path.splitext(path)[1].lower()
+    if fmt not in ('.csv', '.jsonl'):
+        raise ValidationError(f"Unsupported sweep output format: {fmt or path}")
+
+    count = 0
+    with open(path, 'w', newline='') as f:
+        if fmt == '.csv':
+            writer = csv.writer(f)
+            writer.writerow(SWEEP_FIELDS)
+            for values in _sweep_tuples(items):
+                writer.writerow(values)
+                count += 1
+        else:
+            for row in _sweep_rows(items):
+                f.write(json.dumps(row) + "\n")
+                count += 1
+    return count
+
+# Supply planning: volume lost per draw (needle hub + syringe tip) and days
+# before a batch runs out that the next one should be compounded
+SYRINGE_DEAD_SPACE_ML = 0.07
+COMPOUNDING_LEAD_DAYS = 14.0
+
+# Syringe graduations for draw tables: smallest marked step and capacity (mL)
+SYRINGE_GRADUATIONS = {
+    "u100_insulin": {"name": "U-100 insulin (1 mL, 2-unit marks)", "step_ml": 0.02, "capacity_ml": 1.0},
+    "1ml": {"name": "1 mL tuberculin", "step_ml": 0.01, "capacity_ml": 1.0},
+    "3ml": {"name": "3 mL luer", "step_ml": 0.1, "capacity_ml": 3.0}
+}
+
+SUPPLY_PLAN_FIELDS = ('patient_id', 'num_vials', 'vial_size', 'concentration', 'dose_mg', 'interval_days',
+                      'draw_volume_ml', 'doses_per_vial', 'total_doses', 'leftover_per_vial_ml',
+                      'batch_duration_days', 'compound_next_day', 'runout_date', 'compound_next_date')
+
+def write_supply_plan(plan: Dict, path: str) -> int:
+    """Write a plan_batch_supply() table to CSV; returns the row count"""
+    import csv
+    columns = [np.asarray(plan[field]).tolist() for field in SUPPLY_PLAN_FIELDS]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUPPLY_PLAN_FIELDS)
+        writer.writerows(zip(*columns))
+    return len(columns[0])
+
+def _pk_rate_constants(half_life_days, elimination_half_life_days: float):
+    """Depot release (ka) and elimination (ke) rate constants per day"""
+    ka = np.log(2) / np.asarray(half_life_days, dtype=float)
+    ke = np.log(2) / elimination_half_life_days
+    # The Bateman solution is singular at ka == ke; nudge ka off the diagonal
+    ka = np.where(np.isclose(ka, ke, rtol=1e-9, atol=0), ka * (1 + 1e-6), ka)
+    return ka, np.broadcast_to(ke, ka.shape)
+
+def _unit_response(t, ka, ke, efficiency):
+    """Level (mg/day base hormone cleared) after a single 1mg ester dose at t=0"""
+    t = np.asarray(t, dtype=float)
+    with np.errstate(over='ignore', invalid='ignore'):
+        response = efficiency * ka * ke / (ka - ke) * (np.exp(-ke * np.maximum(t, 0)) - np.exp(-ka * np.maximum(t, 0)))
+    return np.where(t >= 0, response, 0.0)
+
+def _typical_interval_days(ester: Dict) -> Optional[float]:
+    """Lower bound of typical_injection_interval ("14-21 days" -> 14.0)"""
+    interval = ester.get('typical_injection_interval')
+    if not interval:
+        return None
+    try:
+        return float(interval.split()[0].split('-')[0])
+    except ValueError:
+        return None
+
+# Memory budget of the process-wide unit response curve cache
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Dose log simulations request response curves over a power-of-two horizon of at
+# least this many days and slice them, so logs of similar length share one curve
+RESPONSE_MIN_HORIZON_DAYS = 32.0
+
+def _response_horizon_days(duration_days: float) -> float:
+    return max(RESPONSE_MIN_HORIZON_DAYS, 2.0 ** math.ceil(math.log2(max(duration_days, 1.0))))
+
+class ResponseCurveCache:
+    """LRU cache of read-only single-dose response curves under a memory budget.
+
+    Keys are (database version, ester_key, step_hours, horizon_days,
+    elimination_half_life_days); see CompiledDatabase.version. With spill_dir
+    set, computed curves are also saved as .npy files and reloaded
+    memory-mapped after eviction.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, spill_dir: Optional[str] = None):
+        if max_bytes < 0:
+            raise ValidationError("Response cache budget must be non-negative")
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._curves = OrderedDict()
+        self.current_bytes = 0
+        self.hits = self.misses = self.spill_hits = self.evictions = 0
+
+    def get(self, key: Tuple, compute) -> 'np.ndarray':
+        """Cached curve for key, calling compute() on a miss"""
+        curve = self._curves.get(key)
+        if curve is not None:
+            self._curves.move_to_end(key)
+            self.hits += 1
+            return curve
+
+        self.misses += 1
+        spill_path = self._spill_path(key)
+        curve = None
+        if spill_path and os.path.exists(spill_path):
+            try:
+                curve = np.load(spill_path, mmap_mode='r')
+                self.spill_hits += 1
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable response curve {spill_path}: {e}")
+        if curve is None:
+            curve = np.asarray(compute(), dtype=float)
+            curve.setflags(write=False)
+            if spill_path:
+                try:
+                    os.makedirs(self.spill_dir, exist_ok=True)
+                    temp_path = f"{spill_path}.{os.getpid()}.tmp.npy"
+                    np.save(temp_path, curve)
+                    os.replace(temp_path, spill_path)
+                except OSError as e:
+                    logger.warning(f"Could not spill response curve {spill_path}: {e}")
+
+        if curve.nbytes <= self.max_bytes:
+            self._curves[key] = curve
+            self.current_bytes += curve.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._curves.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+        return curve
+
+    def _spill_path(self, key: Tuple) -> Optional[str]:
+        if not self.spill_dir:
+            return None
+        version, ester_key, step_hours, horizon_days, elimination = key
+        name = f"{ester_key}_{step_hours!r}h_{horizon_days!r}d_{elimination!r}_{version[:16]}.npy"
+        return os.path.join(self.spill_dir, name)
+
+    def stats(self) -> Dict:
+        """Hit/miss/eviction counts and current memory use"""
+        return {'hits': self.hits, 'misses': self.misses, 'spill_hits': self.spill_hits,
+                'evictions': self.evictions, 'entries': len(self._curves),
+                'current_bytes': self.current_bytes, 'max_bytes': self.max_bytes}
+
+    def clear(self):
+        """Drop in-memory curves (spilled files are kept) and reset statistics"""
+        self._curves.clear()
+        self.current_bytes = 0
+        self.hits = self.misses = self.spill_hits = self.evictions = 0
+
+_RESPONSE_CURVES = ResponseCurveCache()
+
+def decimate_min_max(time_days, levels, buckets: int):
+    """Reduce (curves x T) levels to two points (min and max, in time order) per bucket.
+
+    The envelope of every curve is preserved at display resolution; inputs
+    with no more than 2 x buckets points are returned unchanged.
+    """
+    time_days = np.asarray(time_days, dtype=float)
+    levels = np.atleast_2d(np.asarray(levels, dtype=float))
+    n_points = levels.shape[1]
+    if n_points <= 2 * buckets:
+        return time_days, levels
+
+    size = -(-n_points // buckets)
+    buckets = -(-n_points // size)
+    padded = np.pad(levels, ((0, 0), (0, size * buckets - n_points)), mode='edge').reshape(len(levels), buckets, size)
+    low_at, high_at = padded.argmin(axis=2), padded.argmax(axis=2)
+    low = np.take_along_axis(padded, low_at[:, :, None], axis=2)[:, :, 0]
+    high = np.take_along_axis(padded, high_at[:, :, None], axis=2)[:, :, 0]
+    min_first = low_at <= high_at
+    values = np.stack([np.where(min_first, low, high), np.where(min_first, high, low)], axis=2).reshape(len(levels), -1)
+
+    starts = np.arange(buckets) * size
+    ends = np.minimum(starts + size, n_points) - 1
+    times = np.stack([time_days[starts], time_days[ends]], axis=1).ravel()
+    return times, values
+
+class LevelCurvePlotter:
+    """Draws many level curves into a single reused Agg figure.
+
+    All curves go into one LineCollection after min/max decimation to the
+    figure's pixel width; the figure, canvas and collection are reused
+    across render() calls.
+    """
+
+    def __init__(self, figsize: Tuple[float, float] = (11, 8.5), dpi: int = 100):
+        if not PDF_AVAILABLE:
+            raise ValidationError("Plotting requires matplotlib. Install with: pip install matplotlib")
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot(111)
+        self.collection = LineCollection([], linewidths=1.0)
+        self.ax.add_collection(self.collection)
+        self._extras = []
+
+    @property
+    def width_px(self) -> int:
+        return int(self.figure.get_figwidth() * self.figure.dpi)
+
+    def render(self, time_days, levels, labels: Optional[List[str]] = None, title: str = "Expected levels",
+               band: Optional[Tuple[float, float]] = None, ylabel: str = "Level (mg/day cleared)") -> 'Figure':
+        """Draw every row of levels against time_days, replacing the previous render"""
+        times, values = decimate_min_max(time_days, levels, self.width_px)
+        for artist in self._extras:
+            artist.remove()
+        self._extras = []
+
+        colors = matplotlib.colormaps['viridis'](np.linspace(0, 0.9, len(values)))
+        self.collection.set_segments(np.stack(np.broadcast_arrays(times[None, :], values), axis=2))
+        self.collection.set_color(colors)
+        if band is not None:
+            self._extras.append(self.ax.axhspan(band[0], band[1], color='green', alpha=0.1))
+        if labels and len(labels) <= 12:
+            handles = [Line2D([], [], color=color) for color in colors]
+            self._extras.append(self.ax.legend(handles, labels, fontsize=8, loc='upper right'))
+
+        self.ax.set_xlim(times[0], times[-1] if times[-1] > times[0] else times[0] + 1)
+        self.ax.set_ylim(0, max(float(np.nanmax(values)) if values.size else 0, band[1] if band else 0) * 1.05 or 1)
+        self.ax.set_title(title)
+        self.ax.set_xlabel("Day")
+        self.ax.set_ylabel(ylabel)
+        self.canvas.draw()
+        return self.figure
+
+_LEVEL_PLOTTER = None
+
+def get_level_plotter() -> LevelCurvePlotter:
+    """Process-wide plotter, so the figure and canvas are reused between renders"""
+    global _LEVEL_PLOTTER
+    if _LEVEL_PLOTTER is None:
+        _LEVEL_PLOTTER = LevelCurvePlotter()
+    return _LEVEL_PLOTTER
+
+def ester_table_hash(esters: Optional[Dict] = None) -> str:
+    """Content hash of the ester table; changes whenever any ester field does"""
+    payload = json.dumps(ESTER_DATABASE if esters is None else esters, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# Persisted steady-state table: every injectable ester x 1..N day intervals
+STEADY_STATE_MAX_INTERVAL_DAYS = 42
+STEADY_STATE_CACHE_FILE = "steady_state.npz"
+
+_STEADY_STATE_TABLES = {}
+
+_SWEEP_WORKER = None
+
+def _parallel_sweep_init(esters: Dict, carrier_oils: Dict, axes, total_volume: float, loss_modifier: float):
+    """Process pool initializer: receives the tables and sweep axes once per worker"""
+    global _SWEEP_WORKER
+    calculator = CompoundMeMommyCalculator()
+    calculator.esters, calculator.carrier_oils = esters, carrier_oils
+    _SWEEP_WORKER = (calculator, axes, total_volume, loss_modifier)
+
+def _parallel_sweep_task(start: int, stop: int) -> Dict:
+    calculator, axes, total_volume, loss_modifier = _SWEEP_WORKER
+    return calculator._sweep_chunk(axes, total_volume, loss_modifier, start, stop, with_inputs=False)
+
+RECIPE_DB_FILE = "recipes.sqlite3"
+
+# Indexed query columns of the SQLite recipe store
+RECIPE_INDEX_COLUMNS = ('ester_key', 'oil_key', 'concentration', 'total_volume', 'ba_percent', 'bb_percent',
+                        'created_date')
+
+# Content-addressed recipe storage: full documents live once in recipes/.blobs/<hash>.json
+# and each named recipe file is a small alias pointing at its blob
+RECIPE_BLOB_DIR = ".blobs"
+
+def _hash_normalized(value):
+    """Numbers as floats rounded to 9 places (so 40 and 40.0 agree), recursively"""
+    if isinstance(value, dict):
+        return {key: _hash_normalized(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_hash_normalized(item) for item in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return round(float(value), 9)
+    return value
+
+def recipe_content_hash(formulation: Dict, esters: Optional[Dict] = None, carrier_oils: Optional[Dict] = None) -> str:
+    """SHA-256 of the normalized config (every calculation input); ester/oil entries that are
+    looked up by key at load time (see _normalize_recipe) are left out"""
+    config = formulation.get('config', {})
+    dropped = _database_entries(config, esters, carrier_oils)
+    config = {key: value for key, value in config.items() if key not in dropped}
+    return hashlib.sha256(json.dumps(_hash_normalized(config), sort_keys=True).encode()).hexdigest()
+
+def _recipe_alias(formulation: Dict, digest: str) -> Dict:
+    """Alias document: blob hash plus this recipe's own metadata and config (minus the ester/oil tables)"""
+    config = {key: value for key, value in formulation.get('config', {}).items() if key not in ('ester', 'oil')}
+    return {'recipe_alias': digest, 'config': config, 'metadata': formulation.get('metadata', {})}
+
+def _resolve_recipe(document, recipes_dir: str):
+    """Full formulation for a recipe document, following a blob alias if it is one"""
+    if not isinstance(document, dict) or 'recipe_alias' not in document:
+        return document
+    with open(os.path.join(recipes_dir, RECIPE_BLOB_DIR, f"{document['recipe_alias']}.json")) as f:
+        formulation = json.load(f)
+    formulation.setdefault('config', {}).update(document.get('config', {}))
+    if 'metadata' in document:
+        formulation['metadata'] = document['metadata']
+    return formulation
+
+def _write_atomic(path: str, text: str):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+# Recipe schema v2: config keeps ester_key/oil_key but not copies of their database entries,
+# which are looked up again at load time; database_version records the tables it was saved against.
+# Documents without 'recipe_format' are v1 and load as stored.
+RECIPE_FORMAT_VERSION = 2
+# database_version of recipes whose embedded entries did not match the database when converted;
+# it never equals a real hash, so their calculations are redone on load
+RECIPE_UNVERIFIED_DATABASE_VERSION = 'v1'
+
+def database_version_hash(esters: Optional[Dict] = None, carrier_oils: Optional[Dict] = None) -> str:
+    """Content hash of the ester and carrier oil tables"""
+    payload = json.dumps({'esters': ESTER_DATABASE if esters is None else esters,
+                          'carrier_oils': CARRIER_OIL_DATABASE if carrier_oils is None else carrier_oils},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _database_entries(config: Dict, esters: Optional[Dict] = None,
+                      carrier_oils: Optional[Dict] = None) -> Tuple[str, ...]:
+    """'ester'/'oil' when their key is in the database, i.e. the entry is resolved at load time"""
+    dropped = ()
+    if config.get('ester_key') in (ESTER_DATABASE if esters is None else esters):
+        dropped += ('ester',)
+    if config.get('oil_key') in (CARRIER_OIL_DATABASE if carrier_oils is None else carrier_oils):
+        dropped += ('oil',)
+    return dropped
+
+def _normalize_recipe(formulation: Dict, database_version: str, esters: Optional[Dict] = None,
+                      carrier_oils: Optional[Dict] = None) -> Dict:
+    """v2 document for a formulation; ester/oil entries whose key is not in the database stay embedded.
+
+    database_version is recorded only if the dropped entries match the database;
+    otherwise the calculations are stale and the document gets
+    RECIPE_UNVERIFIED_DATABASE_VERSION.
+    """
+    if formulation.get('recipe_format') == RECIPE_FORMAT_VERSION:
+        return formulation
+    esters = ESTER_DATABASE if esters is None else esters
+    carrier_oils = CARRIER_OIL_DATABASE if carrier_oils is None else carrier_oils
+    config = formulation.get('config', {})
+    dropped = _database_entries(config, esters, carrier_oils)
+    tables = {'ester': (esters, 'ester_key'), 'oil': (carrier_oils, 'oil_key')}
+    for field in dropped:
+        table, key_field = tables[field]
+        if field in config and config[field] != table[config[key_field]]:
+            database_version = RECIPE_UNVERIFIED_DATABASE_VERSION
+    document = {'recipe_format': RECIPE_FORMAT_VERSION, 'database_version': database_version,
+                'config': {key: value for key, value in config.items() if key not in dropped}}
+    document.update((key, value) for key, value in formulation.items() if key != 'config')
+    return document
+
+def _expand_recipe(document, esters: Optional[Dict] = None, carrier_oils: Optional[Dict] = None):
+    """Full formulation for a v2 document, with ester/oil entries from the current database"""
+    if not isinstance(document, dict) or document.get('recipe_format') != RECIPE_FORMAT_VERSION:
+        return document
+    esters = ESTER_DATABASE if esters is None else esters
+    carrier_oils = CARRIER_OIL_DATABASE if carrier_oils is None else carrier_oils
+    stored = document.get('config', {})
+    ester_key = stored.get('ester_key')
+    if 'ester' not in stored and ester_key not in esters:
+        raise ValidationError(f"Recipe references unknown ester: {ester_key}")
+    config = {}
+    for key, value in stored.items():
+        config[key] = value
+        if key == 'ester_key' and 'ester' not in stored:
+            config['ester'] = dict(esters[value])
+        elif key == 'oil_key' and 'oil' not in stored and value in carrier_oils:
+            config['oil'] = dict(carrier_oils[value])
+    formulation = {key: value for key, value in document.items() if key not in ('recipe_format', 'database_version')}
+    formulation['config'] = config
+    return formulation
+
+RECIPE_INDEX_FILE = "recipe_index.json"
+RECIPE_INDEX_VERSION = 2
+
+# Per-recipe summary kept by RecipeIndex, taken from the config and metadata sections
+RECIPE_SUMMARY_COLUMNS = ('filename', 'mtime_ns', 'size', 'ester_key', 'oil_key', 'concentration', 'total_volume',
+                          'ba_percent', 'bb_percent', 'created_date', 'formulation_type')
+
+# Summary columns stored against the index's shared string table
+_RECIPE_STRING_COLUMNS = ('ester_key', 'oil_key', 'formulation_type')
+
+# Directory mtimes this recent may still change within the same timestamp tick
+_MTIME_SETTLE_NS = 2_000_000_000
+
+def _recipe_columns(formulation: Dict) -> Dict:
+    """Indexed column values for a saved formulation (sprays use their fixed concentration)"""
+    config = formulation.get('config', {})
+    metadata = formulation.get('metadata', {})
+    concentration = config.get('concentration')
+    if concentration is None:
+        concentration = formulation.get('spray_calculations', {}).get('fixed_concentration_mg_per_ml')
+    return {'formulation_type': metadata.get('formulation_type', config.get('formulation_type')),
+            'ester_key': config.get('ester_key'), 'oil_key': config.get('oil_key'), 'concentration': concentration,
+            'total_volume': config.get('total_volume'), 'ba_percent': config.get('ba_percent'),
+            'bb_percent': config.get('bb_percent'), 'created_date': metadata.get('created_date')}
+
+def _comparable(value, bound) -> bool:
+    return isinstance(value, str) == isinstance(bound, str)
+
+class RecipeIndex:
+    """Persisted summary of a recipes directory, refreshed incrementally.
+
+    The index holds RECIPE_SUMMARY_COLUMNS as parallel lists sorted by file
+    name, and is stored outside the directory so writing it does not touch
+    the directory mtime. When the directory mtime is unchanged the cached
+    columns are used as is; otherwise every file is stat'ed and only new or
+    changed files are parsed. save_recipe() updates the index directly,
+    since overwriting a file in place does not change the directory mtime;
+    those updates are written out by the next refresh() or at exit (flush()).
+    """
+
+    def __init__(self, recipes_dir: str, index_path: str):
+        self.recipes_dir = recipes_dir
+        self.index_path = index_path
+        self.columns = None
+        self.dir_mtime_ns = None
+        self.dirty = False
+        self._flush_registered = False
+
+    @staticmethod
+    def _empty() -> Dict[str, List]:
+        return {column: [] for column in RECIPE_SUMMARY_COLUMNS}
+
+    def _load(self):
+        self.columns, self.dir_mtime_ns = self._empty(), None
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+            if data.get('version') != RECIPE_INDEX_VERSION or data.get('recipes_dir') != self.recipes_dir:
+                return
+            # Repeated ester/oil keys are stored as indices into a shared string table
+            strings = data['strings']
+            columns = {column: data[column] for column in RECIPE_SUMMARY_COLUMNS}
+            for column in _RECIPE_STRING_COLUMNS:
+                columns[column] = [strings[i] if i >= 0 else None for i in columns[column]]
+            if len({len(values) for values in columns.values()}) == 1:
+                self.columns, self.dir_mtime_ns = columns, data['dir_mtime_ns']
+        except (OSError, ValueError, KeyError, TypeError, IndexError, AttributeError):
+            pass
+
+    def _save(self):
+        strings = sorted({value for column in _RECIPE_STRING_COLUMNS for value in self.columns[column]
+                          if value is not None})
+        codes = {value: i for i, value in enumerate(strings)}
+        data = dict(self.columns, version=RECIPE_INDEX_VERSION, recipes_dir=self.recipes_dir,
+                    dir_mtime_ns=self.dir_mtime_ns, strings=strings)
+        for column in _RECIPE_STRING_COLUMNS:
+            data[column] = [codes.get(value, -1) for value in self.columns[column]]
+        try:
+            temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"Could not write recipe index {self.index_path}: {e}")
+        self.dirty = False
+
+    def _mark_dirty(self):
+        if self.dirty:
+            return
+        self.dirty = True
+        # Until flushed the file no longer describes the directory; without it the next process rescans
+        try:
+            os.remove(self.index_path)
+        except OSError:
+            pass
+        if not self._flush_registered:
+            atexit.register(self.flush)
+            self._flush_registered = True
+
+    def flush(self):
+        """Write pending update() changes to the index file"""
+        if self.dirty:
+            self._save()
+
+    @staticmethod
+    def _row(filename: str, stat_result, formulation: Optional[Dict]) -> Tuple:
+        values = _recipe_columns(formulation) if isinstance(formulation, dict) else {}
+        return (filename, stat_result.st_mtime_ns, stat_result.st_size) + \
+            tuple(values.get(column) for column in RECIPE_SUMMARY_COLUMNS[3:])
+
+    def _parse(self, entry) -> Tuple:
+        stat_result = entry.stat()
+        try:
+            with open(entry.path) as f:
+                formulation = _resolve_recipe(json.load(f), self.recipes_dir)
+        except (OSError, ValueError, AttributeError):
+            formulation = None
+        return self._row(entry.name, stat_result, formulation)
+
+    def _set_rows(self, rows: List[Tuple]):
+        rows.sort(key=lambda row: row[0])
+        self.columns = {column: [row[i] for row in rows] for i, column in enumerate(RECIPE_SUMMARY_COLUMNS)}
+
+    def _rows(self) -> List[Tuple]:
+        return list(zip(*(self.columns[column] for column in RECIPE_SUMMARY_COLUMNS)))
+
+    def refresh(self, full: bool = False) -> Dict[str, List]:
+        """Bring the index up to date; returns the columns (lists sorted by file name)"""
+        if self.columns is None:
+            self._load()
+        try:
+            dir_mtime_ns = os.stat(self.recipes_dir).st_mtime_ns
+        except OSError:
+            self.columns = self._empty()
+            return self.columns
+        settled = time.time_ns() - dir_mtime_ns > _MTIME_SETTLE_NS
+        if not full and settled and dir_mtime_ns == self.dir_mtime_ns:
+            self.flush()
+            return self.columns
+
+        cached = {row[0]: row for row in self._rows()}
+        rows, changed = [], False
+        with os.scandir(self.recipes_dir) as scan:
+            for entry in scan:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat_result = entry.stat()
+                    row = cached.get(entry.name)
+                    if row is None or row[1] != stat_result.st_mtime_ns or row[2] != stat_result.st_size:
+                        row = self._parse(entry)
+                        changed = True
+                except OSError:
+                    continue
+                rows.append(row)
+        changed = changed or len(rows) != len(cached)
+
+        # An unsettled directory mtime is not recorded, so the next call rescans
+        new_mtime = dir_mtime_ns if settled else None
+        if changed or new_mtime != self.dir_mtime_ns or self.dirty:
+            if changed:
+                self._set_rows(rows)
+            self.dir_mtime_ns = new_mtime
+            self._save()
+        return self.columns
+
+    def update(self, filename: str, formulation: Dict):
+        """Record a recipe that was just written to recipes_dir/filename (inserted in place, saved lazily)"""
+        if self.columns is None:
+            self._load()
+        try:
+            stat_result = os.stat(os.path.join(self.recipes_dir, filename))
+        except OSError:
+            return
+        row = self._row(filename, stat_result, formulation)
+        names = self.columns['filename']
+        position = bisect.bisect_left(names, filename)
+        if position < len(names) and names[position] == filename:
+            for column, value in zip(RECIPE_SUMMARY_COLUMNS, row):
+                self.columns[column][position] = value
+        else:
+            for column, value in zip(RECIPE_SUMMARY_COLUMNS, row):
+                self.columns[column].insert(position, value)
+        self._mark_dirty()
+
+    def names(self) -> List[str]:
+        """Sorted recipe file names"""
+        return self.refresh()['filename']
+
+    def find(self, **filters) -> List[int]:
+        """Row positions matching every filter (see CompoundMeMommyCalculator.find_recipes)"""
+        columns = self.refresh()
+        rows = range(len(columns['filename']))
+        for column, value in filters.items():
+            if column not in RECIPE_SUMMARY_COLUMNS:
+                raise ValidationError(f"Unknown recipe column: {column}")
+            if value is None:
+                continue
+            values = columns[column]
+            if isinstance(value, (tuple, list)):
+                low, high = value
+                # String upper bounds match by prefix, so '2024-05-31' includes that whole day
+                rows = [i for i in rows if values[i] is not None and not isinstance(values[i], bool) and
+                        (low is None or _comparable(values[i], low) and values[i] >= low) and
+                        (high is None or _comparable(values[i], high) and
+                         (values[i][:len(high)] if isinstance(high, str) else values[i]) <= high)]
+            elif column == 'created_date':
+                rows = [i for i in rows if isinstance(values[i], str) and values[i].startswith(value)]
+            else:
+                rows = [i for i in rows if values[i] == value]
+        return list(rows)
+
+class RecipeStore:
+    """Optional SQLite recipe library.
+
+    Each recipe is stored under a unique name as its JSON document (in the
+    same v2 format as the recipes directory, normalized and expanded by the
+    owning calculator) plus indexed RECIPE_INDEX_COLUMNS for paged listing
+    and range queries.
+    """
+
+    def __init__(self, path: str, calculator: 'CompoundMeMommyCalculator'):
+        try:
+            self.path = path
+            self.calculator = calculator
+            self.connection = sqlite3.connect(path)
+            self.connection.row_factory = sqlite3.Row
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS recipes (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, "
+                    "formulation_type TEXT, ester_key TEXT, oil_key TEXT, concentration REAL, total_volume REAL, "
+                    "ba_percent REAL, bb_percent REAL, created_date TEXT, data TEXT NOT NULL)")
+                for column in RECIPE_INDEX_COLUMNS:
+                    self.connection.execute(f"CREATE INDEX IF NOT EXISTS idx_recipes_{column} ON recipes ({column})")
+        except sqlite3.Error as e:
+            raise ValidationError(f"Could not open recipe store {path}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def _upsert(self, rows):
+        self.connection.executemany(
+            "INSERT INTO recipes (name, formulation_type, ester_key, oil_key, concentration, total_volume, "
+            "ba_percent, bb_percent, created_date, data) VALUES (:name, :formulation_type, :ester_key, :oil_key, "
+            ":concentration, :total_volume, :ba_percent, :bb_percent, :created_date, :data) "
+            "ON CONFLICT(name) DO UPDATE SET formulation_type=excluded.formulation_type, "
+            "ester_key=excluded.ester_key, oil_key=excluded.oil_key, concentration=excluded.concentration, "
+            "total_volume=excluded.total_volume, ba_percent=excluded.ba_percent, bb_percent=excluded.bb_percent, "
+            "created_date=excluded.created_date, data=excluded.data", rows)
+
+    def save(self, name: str, formulation: Dict):
+        """Insert or replace a recipe by name"""
+        try:
+            with self.connection:
+                self._upsert([dict(_recipe_columns(formulation), name=name,
+                                   data=json.dumps(self.calculator._stored_recipe(formulation)))])
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            raise ValidationError(f"Could not save recipe {name}: {e}")
+
+    def load(self, name: str) -> Dict:
+        row = self.connection.execute("SELECT data FROM recipes WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise ValidationError(f"Recipe not found: {name}")
+        return self.calculator._loaded_recipe(json.loads(row['data']))
+
+    def delete(self, name: str) -> bool:
+        with self.connection:
+            return self.connection.execute("DELETE FROM recipes WHERE name = ?", (name,)).rowcount > 0
+
+    @staticmethod
+    def _where(filters: Dict) -> Tuple[str, List]:
+        """SQL WHERE clause for equality (str) or inclusive (low, high) range filters; None bounds are open"""
+        clauses, params = [], []
+        for column, value in filters.items():
+            if column not in RECIPE_INDEX_COLUMNS:
+                raise ValidationError(f"Unknown recipe column: {column}")
+            if value is None:
+                continue
+            if isinstance(value, (tuple, list)):
+                low, high = value
+                if low is not None:
+                    clauses.append(f"{column} >= ?")
+                    params.append(low)
+                if high is not None:
+                    clauses.append(f"{column} <= ?")
+                    params.append(high)
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, **filters) -> int:
+        where, params = self._where(filters)
+        return self.connection.execute(f"SELECT COUNT(*) FROM recipes{where}", params).fetchone()[0]
+
+    def query(self, limit: int = 50, offset: int = 0, order_by: str = 'name', descending: bool = False,
+              **filters) -> List[Dict]:
+        """Summary rows (name + indexed columns, no JSON) matching the filters.
+
+        Filters are column=value or column=(low, high), e.g.
+        query(ester_key='testosterone_cypionate', concentration=(150, 250)).
+        """
+        if order_by not in RECIPE_INDEX_COLUMNS + ('name',):
+            raise ValidationError(f"Cannot order recipes by {order_by}")
+        where, params = self._where(filters)
+        direction = "DESC" if descending else "ASC"
+        rows = self.connection.execute(
+            f"SELECT name, formulation_type, {', '.join(RECIPE_INDEX_COLUMNS)} FROM recipes{where} "
+            f"ORDER BY {order_by} {direction}, id {direction} LIMIT ? OFFSET ?", params + [limit, offset])
+        return [dict(row) for row in rows]
+
+    def list_page(self, page: int = 0, page_size: int = 50, order_by: str = 'name', descending: bool = False) -> List[Dict]:
+        """One page of all recipes"""
+        return self.query(limit=page_size, offset=page * page_size, order_by=order_by, descending=descending)
+
+    def import_json_directory(self, directory: str, overwrite: bool = True) -> int:
+        """Import every *.json recipe in a directory (name = file name without .json); returns the count"""
+        rows = []
+        database_version = self.calculator.database_version()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        formulation = _resolve_recipe(json.load(f), directory)
+                    document = self.calculator._stored_recipe(formulation, database_version)
+                    rows.append(dict(_recipe_columns(formulation), name=entry.name[:-5], data=json.dumps(document)))
+                except (OSError, ValueError, AttributeError) as e:
+                    logger.warning(f"Skipping recipe {entry.path}: {e}")
+        if not overwrite:
+            existing = {row[0] for row in self.connection.execute("SELECT name FROM recipes")}
+            rows = [row for row in rows if row['name'] not in existing]
+        with self.connection:
+            self._upsert(rows)
+        return len(rows)
+
 class CompoundMeMommyCalculator:
     def __init__(self):
         self.config_state = {}
@@ -62,6 +1345,7 @@ class CompoundMeMommyCalculator:
 
         try:
             base_dir = os.path.expanduser("~/.compoundmemommy")
+            self.cache_dir = base_dir
             self.recipes_dir = os.path.join(base_dir, "recipes")
             self.pdfs_dir = os.path.join(base_dir, "pdf")
 
@@ -71,97 +1355,51 @@ class CompoundMeMommyCalculator:
             logger.error(f"Failed to create directories: {e}")
             import tempfile
             temp_dir = tempfile.mkdtemp(prefix="compoundmemommy_")
-            self.recipes_dir = self.pdfs_dir = temp_dir
-
-        # COMPREHENSIVE PHARMACEUTICAL CORRECTIONS: Complete ester database with verified data
-        self.esters = {
-            "estradiol_valerate": {
-                "name": "Estradiol Valerate", "molecular_weight": 356.50, "base_molecular_weight": 272.38,
-                "density": 1.102, "ester_efficiency": 0.7640, "typical_concentrations": [20, 30, 40, 50],
-                "max_safe_concentration": 80, "common_doses": [3, 4, 5, 6],
-                "base_solubility": {"sesame_oil": 65, "mct_oil": 75, "cottonseed_oil": 65, "grapeseed_oil": 70, 
-                                  "castor_oil": 85, "olive_oil": 60, "sunflower_oil": 67, "safflower_oil": 67, "custom": 67},
-                "category": "estradiol", "route": "injectable", "half_life_days": 3.5, "typical_injection_interval": "14 days"
-            },
-            "estradiol_cypionate": {
-                "name": "Estradiol Cypionate", "molecular_weight": 396.57, "base_molecular_weight": 272.38,
-                "density": 1.083, "ester_efficiency": 0.6868, "typical_concentrations": [20, 30, 40, 50],
-                "max_safe_concentration": 75, "common_doses": [3, 4, 5, 6],
-                "base_solubility": {"sesame_oil": 55, "mct_oil": 65, "cottonseed_oil": 55, "grapeseed_oil": 60,
-                                  "castor_oil": 75, "olive_oil": 50, "sunflower_oil": 57, "safflower_oil": 57, "custom": 57},
-                "category": "estradiol", "route": "injectable", "half_life_days": 11.0, "typical_injection_interval": "14-21 days"
-            },
-            "estradiol_enanthate": {
-                "name": "Estradiol Enanthate", "molecular_weight": 384.55, "base_molecular_weight": 272.38,
-                "density": 1.110, "ester_efficiency": 0.7083, "typical_concentrations": [20, 30, 40, 50],
-                "max_safe_concentration": 85, "common_doses": [3, 4, 5, 6],
-                "base_solubility": {"sesame_oil": 70, "mct_oil": 80, "cottonseed_oil": 70, "grapeseed_oil": 75,
-                                  "castor_oil": 90, "olive_oil": 65, "sunflower_oil": 72, "safflower_oil": 72, "custom": 72},
-                "category": "estradiol", "route": "injectable", "half_life_days": 8.0, "typical_injection_interval": "7 days"
-            },
-            "estradiol_undecylate": {
-                "name": "Estradiol Undecylate", "molecular_weight": 440.66, "base_molecular_weight": 272.38,
-                "density": 1.070, "ester_efficiency": 0.6181, "typical_concentrations": [20, 30, 40, 50],
-                "max_safe_concentration": 70, "common_doses": [3, 4, 5, 6],
-                "base_solubility": {"sesame_oil": 60, "mct_oil": 70, "cottonseed_oil": 60, "grapeseed_oil": 65,
-                                  "castor_oil": 80, "olive_oil": 55, "sunflower_oil": 62, "safflower_oil": 62, "custom": 62},
-                "category": "estradiol", "route": "injectable", "half_life_days": 29.0, "typical_injection_interval": "28-42 days"
-            },
-            "estradiol_spray": {
-                "name": "17beta-Estradiol Transdermal Spray", "molecular_weight": 272.38, "base_molecular_weight": 272.38,
-                "density": 1.27, "ester_efficiency": 1.0, "fixed_concentration": 58.33, "max_safe_concentration": 100,
-                "common_doses": [0.5, 0.75, 1.0, 1.25], "category": "estradiol", "route": "transdermal_spray", "absorption_rate": 0.12,
-                "spray_components": {"isopropyl_myristate": {"percentage": 40.0, "density": 0.922},
-                                   "isopropyl_alcohol_91": {"percentage": 40.0, "density": 0.785},
-                                   "propylene_glycol": {"percentage": 10.0, "density": 1.036},
-                                   "polysorbate_80": {"percentage": 10.0, "density": 1.064}}
-            },
-            "testosterone_enanthate": {
-                "name": "Testosterone Enanthate", "molecular_weight": 400.59, "base_molecular_weight": 288.42,
-                "density": 1.056, "ester_efficiency": 0.7200, "typical_concentrations": [150, 200, 250, 300, 400],
-                "max_safe_concentration": 500, "common_doses": [50, 75, 100, 125, 150],
-                "base_solubility": {"sesame_oil": 280, "mct_oil": 320, "cottonseed_oil": 280, "grapeseed_oil": 290,
-                                  "castor_oil": 350, "olive_oil": 270, "sunflower_oil": 285, "safflower_oil": 285, "custom": 285},
-                "category": "testosterone", "route": "injectable", "half_life_days": 4.5, "typical_injection_interval": "7-14 days"
-            },
-            "testosterone_cypionate": {
-                "name": "Testosterone Cypionate", "molecular_weight": 412.61, "base_molecular_weight": 288.42,
-                "density": 1.080, "ester_efficiency": 0.6990, "typical_concentrations": [150, 200, 250, 300],
-                "max_safe_concentration": 400, "common_doses": [50, 75, 100, 125, 150],
-                "base_solubility": {"sesame_oil": 220, "mct_oil": 250, "cottonseed_oil": 220, "grapeseed_oil": 230,
-                                  "castor_oil": 270, "olive_oil": 210, "sunflower_oil": 225, "safflower_oil": 225, "custom": 225},
-                "category": "testosterone", "route": "injectable", "half_life_days": 8.0, "typical_injection_interval": "7-14 days"
-            },
-            "testosterone_propionate": {
-                "name": "Testosterone Propionate", "molecular_weight": 344.49, "base_molecular_weight": 288.42,
-                "density": 1.091, "ester_efficiency": 0.8372, "typical_concentrations": [50, 75, 100, 125, 150],
-                "max_safe_concentration": 200, "common_doses": [25, 50, 75, 100],
-                "base_solubility": {"sesame_oil": 120, "mct_oil": 135, "cottonseed_oil": 120, "grapeseed_oil": 125,
-                                  "castor_oil": 145, "olive_oil": 115, "sunflower_oil": 122, "safflower_oil": 122, "custom": 122},
-                "category": "testosterone", "route": "injectable", "half_life_days": 0.8, "typical_injection_interval": "1-3 days"
-            },
-            "testosterone_decanoate": {
-                "name": "Testosterone Decanoate", "molecular_weight": 442.67, "base_molecular_weight": 288.42,
-                "density": 1.040, "ester_efficiency": 0.6515, "typical_concentrations": [200, 250, 300, 400, 500],
-                "max_safe_concentration": 600, "common_doses": [75, 100, 125, 150, 200],
-                "base_solubility": {"sesame_oil": 380, "mct_oil": 420, "cottonseed_oil": 380, "grapeseed_oil": 395,
-                                  "castor_oil": 450, "olive_oil": 370, "sunflower_oil": 385, "safflower_oil": 385, "custom": 385},
-                "category": "testosterone", "route": "injectable", "half_life_days": 7.0, "typical_injection_interval": "14-21 days"
-            }
-        }
-
-        # CORRECTED: Carrier oil densities from pharmaceutical/food science literature
-        self.carrier_oils = {
-            "mct_oil": {"name": "MCT Oil", "density": 0.95, "solubility_factor": 1.1},
-            "cottonseed_oil": {"name": "Cottonseed Oil", "density": 0.92, "solubility_factor": 1.0},
-            "sesame_oil": {"name": "Sesame Oil", "density": 0.919, "solubility_factor": 1.0},
-            "grapeseed_oil": {"name": "Grapeseed Oil", "density": 0.92, "solubility_factor": 1.05},
-            "castor_oil": {"name": "Castor Oil", "density": 0.955, "solubility_factor": 1.25},
-            "olive_oil": {"name": "Olive Oil", "density": 0.90, "solubility_factor": 0.95},
-            "sunflower_oil": {"name": "Sunflower Oil", "density": 0.92, "solubility_factor": 1.02},
-            "safflower_oil": {"name": "Safflower Oil", "density": 0.92, "solubility_factor": 1.02},
-            "custom": {"name": "Custom Oil", "density": 0.92, "solubility_factor": 1.0}
-        }
+            self.recipes_dir = self.pdfs_dir = self.cache_dir = temp_dir
+
+        # Per-instance copies of the tables; call invalidate_caches() after editing them
+        self._esters = copy.deepcopy(ESTER_DATABASE)
+        self._carrier_oils = copy.deepcopy(CARRIER_OIL_DATABASE)
+        self._database = None
+
+    @property
+    def esters(self) -> Dict:
+        return self._esters
+
+    @esters.setter
+    def esters(self, esters: Dict):
+        self._esters = esters
+        self._database = None
+
+    @property
+    def carrier_oils(self) -> Dict:
+        return self._carrier_oils
+
+    @carrier_oils.setter
+    def carrier_oils(self, carrier_oils: Dict):
+        self._carrier_oils = carrier_oils
+        self._database = None
+
+    @property
+    def database(self) -> CompiledDatabase:
+        """Read-only array view of this calculator's tables, compiled on first use"""
+        if self._database is None:
+            _require_numpy("The compiled ester database")
+            self._database = CompiledDatabase(self._esters, self._carrier_oils)
+        return self._database
+
+    def invalidate_caches(self):
+        """Recompile the array view after editing esters/carrier_oils in place"""
+        self._database = None
+        invalidate_database_caches()
+
+    def _solubility_factors(self, ester: Dict, oil_key: str) -> Optional[Tuple[float, float]]:
+        return _solubility_factors(ester, oil_key, self.database if NUMPY_AVAILABLE else None, self.carrier_oils)
+
+    def _canonical_ester_index(self, ester: Dict) -> Optional[int]:
+        if not NUMPY_AVAILABLE:
+            return None
+        return self.database.find_ester(ester)
 
     def validate_concentration(self, concentration: float, ester_key: str) -> bool:
         try:
@@ -180,15 +1418,15 @@ class CompoundMeMommyCalculator:
 
     def validate_ingredient_compatibility(self, ester_key: str, oil_key: str, bb_percent: float, ba_percent: float) -> Dict:
         result = {"valid": True, "warnings": [], "error": None}
-        if bb_percent > 30:
+        if bb_percent > BB_PERCENT_SAFE_LIMIT:
             result["valid"] = False
-            result["error"] = f"Benzyl benzoate {bb_percent}% exceeds safe limit (30%)"
-        elif bb_percent > 20:
+            result["error"] = f"Benzyl benzoate {bb_percent}% exceeds safe limit ({BB_PERCENT_SAFE_LIMIT}%)"
+        elif bb_percent > BB_PERCENT_WARN:
             result["warnings"].append(f"High benzyl benzoate {bb_percent}% - may cause irritation")
-        if ba_percent > 5:
+        if ba_percent > BA_PERCENT_SAFE_LIMIT:
             result["valid"] = False 
-            result["error"] = f"Benzyl alcohol {ba_percent}% exceeds safe limit (5%)"
-        elif ba_percent > 3:
+            result["error"] = f"Benzyl alcohol {ba_percent}% exceeds safe limit ({BA_PERCENT_SAFE_LIMIT}%)"
+        elif ba_percent > BA_PERCENT_WARN:
             result["warnings"].append(f"High benzyl alcohol {ba_percent}% - monitor effects")
         return result
 
@@ -200,6 +1438,10 @@ class CompoundMeMommyCalculator:
             base_volume = config.get('total_volume', 120.0)
             loss_modifier = config.get('loss_modifier', 0.0)
             ester = config.get('ester', {})
+            regimen = config.get('spray_regimen')
+            if regimen is not None and not (regimen.get('sprays_per_day', 0) > 0 and
+                                            regimen.get('ml_per_actuation', SPRAY_ACTUATION_ML) > 0):
+                raise ValidationError("Spray regimen needs positive sprays_per_day and ml_per_actuation")
 
             fixed_concentration = 58.33
 
@@ -213,35 +1455,25 @@ class CompoundMeMommyCalculator:
             estradiol_density = ester.get('density', 1.27)
             estradiol_volume_displaced = estradiol_mass_g / estradiol_density
 
-            spray_components = ester.get('spray_components', {})
-            component_volumes = {}
-            component_masses = {}
-
-            for component, specs in spray_components.items():
-                volume_ml = adjusted_volume * (specs['percentage'] / 100)
-                if component == 'isopropyl_alcohol_91':
-                    volume_ml -= estradiol_volume_displaced
-                mass_g = volume_ml * specs['density']
-                component_volumes[f"{component}_ml"] = volume_ml
-                component_masses[f"{component}_g"] = mass_g
-
-            absorption_rate = ester.get('absorption_rate', 0.12)
-            bioavailable_per_ml = fixed_concentration * absorption_rate
-
-            return {
+            return FormulationResult({
                 'config': config,
-                'spray_calculations': {
+                'spray_calculations': SprayCalculations(ester, {
                     'base_volume_ml': base_volume, 'adjusted_volume_ml': adjusted_volume,
                     'loss_modifier_percent': loss_modifier, 'fixed_concentration_mg_per_ml': fixed_concentration,
-                    'total_estradiol_mass_g': estradiol_mass_g, 'estradiol_volume_displaced_ml': estradiol_volume_displaced,
-                    'bioavailable_per_ml': bioavailable_per_ml, **component_volumes, **component_masses
-                },
+                    'total_estradiol_mass_g': estradiol_mass_g, 'estradiol_volume_displaced_ml': estradiol_volume_displaced
+                }, regimen),
                 'metadata': {'created_date': datetime.now().isoformat(), 'version': '1.2.4', 'formulation_type': 'transdermal_spray'}
-            }
+            })
         except Exception as e:
             raise ValidationError(f"Spray calculation failed: {str(e)}")
 
-    def calculate_formulation(self, config: Dict) -> Dict:
+    def calculate_formulation(self, config: Dict, lean: bool = False) -> Dict:
+        """Calculate an injectable formulation.
+
+        With lean=True only the numeric calculations are returned, with the
+        solubility status as 'solubility_status_code'; the explanation and
+        ASCII bar are left to the display layer (see _solubility_presentation).
+        """
         try:
             self._validate_formulation_config(config)
 
@@ -257,45 +1489,741 @@ class CompoundMeMommyCalculator:
             adjusted_volume = total_volume * (1 + loss_modifier / 100)
             api_mass_mg = concentration * adjusted_volume
             api_mass_g = api_mass_mg / 1000
-            api_density = ester.get('density', 1.05)
+            ester_idx = self._canonical_ester_index(ester)
+            if ester_idx is not None:
+                api_density = float(self.database.density[ester_idx])
+            else:
+                api_density = ester.get('density', 1.05)
             api_volume_displaced = api_mass_g / api_density
 
-            # CORRECTED: Use pharmaceutical-grade excipient densities
             ba_volume = (ba_percent / 100) * adjusted_volume
-            ba_mass_g = ba_volume * 1.045  # USP pharmaceutical grade BA density
             bb_volume = (bb_percent / 100) * adjusted_volume
-            bb_mass_g = bb_volume * 1.118  # USP pharmaceutical grade BB density
             oil_volume = adjusted_volume - api_volume_displaced - ba_volume - bb_volume
 
             if oil_volume <= 0:
                 raise ValidationError(f"Negative oil volume ({oil_volume:.3f}mL)")
 
-            oil_density = oil.get('density', 0.92)
-            oil_mass_g = oil_volume * oil_density
-
-            try:
-                estimated_max, solubility_explanation = self.calculate_dynamic_solubility_limit(ester, oil_key, bb_percent, concentration)
-                solubility_status = self.assess_solubility_status(concentration, estimated_max)
-                solubility_ascii = self.generate_solubility_ascii(concentration, estimated_max)
-            except Exception as e:
-                estimated_max = 1000.0
-                solubility_explanation = "Solubility data unavailable"
-                solubility_status = "Unknown"
-                solubility_ascii = ""
-
-            return {
+            if lean:
+                estimated_max = self.solubility_limit(ester, oil_key, bb_percent)
+                return {
+                    'adjusted_volume_ml': adjusted_volume, 'api_mass_g': api_mass_g, 'api_volume_displaced_ml': api_volume_displaced,
+                    'ba_volume_ml': ba_volume, 'ba_mass_g': ba_volume * BENZYL_ALCOHOL_DENSITY,
+                    'bb_volume_ml': bb_volume, 'bb_mass_g': bb_volume * BENZYL_BENZOATE_DENSITY,
+                    'oil_volume_ml': oil_volume, 'oil_mass_g': oil_volume * oil.get('density', 0.92),
+                    'estimated_max_solubility': estimated_max,
+                    'solubility_status_code': SOLUBILITY_STATUS_LABELS.index(self.assess_solubility_status(concentration, estimated_max))
+                }
+
+            return FormulationResult({
                 'config': config,
-                'calculations': {
+                'calculations': InjectableCalculations(self, ester, oil, oil_key, concentration, bb_percent, {
                     'adjusted_volume_ml': adjusted_volume, 'api_mass_g': api_mass_g, 'api_volume_displaced_ml': api_volume_displaced,
-                    'ba_volume_ml': ba_volume, 'ba_mass_g': ba_mass_g, 'bb_volume_ml': bb_volume, 'bb_mass_g': bb_mass_g,
-                    'oil_volume_ml': oil_volume, 'oil_mass_g': oil_mass_g, 'estimated_max_solubility': estimated_max,
-                    'solubility_explanation': solubility_explanation, 'solubility_status': solubility_status, 'solubility_ascii': solubility_ascii
-                },
+                    'ba_volume_ml': ba_volume, 'bb_volume_ml': bb_volume, 'oil_volume_ml': oil_volume
+                }),
                 'metadata': {'created_date': datetime.now().isoformat(), 'version': '1.2.4', 'formulation_type': 'injectable'}
-            }
+            })
         except Exception as e:
             raise ValidationError(f"Calculation failed: {str(e)}")
 
+    def calculate_formulation_batch(self, concentration, total_volume, loss_modifier, ba_percent, bb_percent,
+                                    ester_key, oil_key) -> Dict:
+        """Vectorized calculate_formulation over columnar inputs.
+
+        Every argument may be a scalar or an array; they are broadcast together.
+        Rows that would raise in calculate_formulation are flagged in
+        'error_mask' (with the reason in 'error_code') instead of raising.
+        """
+        _require_numpy("Batch calculations")
+
+        concentration, total_volume, loss_modifier, ba_percent, bb_percent = np.broadcast_arrays(
+            *[np.asarray(v, dtype=float) for v in (concentration, total_volume, loss_modifier, ba_percent, bb_percent)])
+        shape = concentration.shape
+        ester_key = np.broadcast_to(np.asarray(ester_key), shape)
+        oil_key = np.broadcast_to(np.asarray(oil_key), shape)
+
+        db = self.database
+        ester_idx = db.ester_indices(ester_key)
+        oil_idx = db.oil_indices(oil_key)
+        known = (ester_idx >= 0) & (oil_idx >= 0)
+        ester_idx = np.where(ester_idx >= 0, ester_idx, 0)
+        oil_idx = np.where(oil_idx >= 0, oil_idx, 0)
+
+        adjusted_volume = total_volume * (1 + loss_modifier / 100)
+        api_mass_g = concentration * adjusted_volume / 1000
+        api_volume_displaced = api_mass_g / db.density[ester_idx]
+        ba_volume = (ba_percent / 100) * adjusted_volume
+        ba_mass_g = ba_volume * BENZYL_ALCOHOL_DENSITY
+        bb_volume = (bb_percent / 100) * adjusted_volume
+        bb_mass_g = bb_volume * BENZYL_BENZOATE_DENSITY
+        oil_volume = adjusted_volume - api_volume_displaced - ba_volume - bb_volume
+        oil_mass_g = oil_volume * db.oil_density[oil_idx]
+
+        oil_enhanced_max = db.base_solubility[ester_idx, oil_idx] * db.oil_solubility_factor[oil_idx]
+        bb_multiplier = 1 + (bb_percent / 100) * BB_SOLUBILITY_GAIN
+        estimated_max = np.where(bb_percent > 0, oil_enhanced_max * bb_multiplier, oil_enhanced_max)
+        estimated_max = np.where(db.has_solubility[ester_idx], estimated_max, 1000.0)
+        status_code = solubility_status_codes(concentration, estimated_max)
+
+        error_code = np.full(shape, BATCH_OK, dtype=np.int8)
+        error_code[oil_volume <= 0] = BATCH_NEGATIVE_OIL_VOLUME
+        error_code[~known] = BATCH_UNKNOWN_KEY
+        error_code[(concentration <= 0) | (total_volume <= 0)] = BATCH_INVALID_INPUT
+
+        return {
+            'adjusted_volume_ml': adjusted_volume, 'api_mass_g': api_mass_g, 'api_volume_displaced_ml': api_volume_displaced,
+            'ba_volume_ml': ba_volume, 'ba_mass_g': ba_mass_g, 'bb_volume_ml': bb_volume, 'bb_mass_g': bb_mass_g,
+            'oil_volume_ml': oil_volume, 'oil_mass_g': oil_mass_g, 'estimated_max_solubility': estimated_max,
+            'solubility_status_code': status_code, 'error_code': error_code, 'error_mask': error_code != BATCH_OK
+        }
+
+    def sweep(self, concentrations, ester_keys, oil_keys, ba_percents, bb_percents, total_volume: float = 10.0,
+              loss_modifier: float = 10.0, chunk_size: Optional[int] = None):
+        """Lazily enumerate the cartesian product of formulation parameters.
+
+        Yields one record dict per combination, or with chunk_size a dict of
+        column arrays per chunk_size combinations, so memory stays bounded
+        regardless of the product size. Combinations are ordered with bb_percents
+        varying fastest. Incompatible BA/BB levels and negative oil volumes are
+        reported as flags, not exceptions. Pass the output to write_sweep().
+        """
+        _require_numpy("Formulation sweeps")
+        axes = [np.atleast_1d(np.asarray(concentrations, dtype=float)), np.atleast_1d(np.asarray(ester_keys, dtype=str)),
+                np.atleast_1d(np.asarray(oil_keys, dtype=str)), np.atleast_1d(np.asarray(ba_percents, dtype=float)),
+                np.atleast_1d(np.asarray(bb_percents, dtype=float))]
+        if chunk_size is not None and chunk_size < 1:
+            raise ValidationError("Sweep chunk size must be at least 1")
+        return self._sweep_chunks(axes, total_volume, loss_modifier, chunk_size or 4096, chunk_size is None)
+
+    def parallel_sweep(self, concentrations, ester_keys, oil_keys, ba_percents, bb_percents, total_volume: float = 10.0,
+                       loss_modifier: float = 10.0, workers: Optional[int] = None, chunk_size: int = 65536):
+        """sweep() sharded across a process pool; yields column chunks in sweep order.
+
+        The ester/oil tables and sweep axes are sent to each worker once, tasks
+        are just index ranges. At most two chunks per worker are in flight, so
+        memory stays bounded. workers=1 runs in-process.
+        """
+        _require_numpy("Formulation sweeps")
+        workers = workers or os.cpu_count() or 1
+        if workers < 1 or chunk_size < 1:
+            raise ValidationError("Sweep workers and chunk size must be at least 1")
+        axes = [np.atleast_1d(np.asarray(concentrations, dtype=float)), np.atleast_1d(np.asarray(ester_keys, dtype=str)),
+                np.atleast_1d(np.asarray(oil_keys, dtype=str)), np.atleast_1d(np.asarray(ba_percents, dtype=float)),
+                np.atleast_1d(np.asarray(bb_percents, dtype=float))]
+        if workers == 1:
+            return self._sweep_chunks(axes, total_volume, loss_modifier, chunk_size, False)
+        return self._parallel_sweep_chunks(axes, total_volume, loss_modifier, workers, chunk_size)
+
+    def _parallel_sweep_chunks(self, axes, total_volume, loss_modifier, workers, chunk_size):
+        ranges = ((start, start + chunk_size) for start in range(0, self._sweep_size(axes), chunk_size))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_parallel_sweep_init,
+                                 initargs=(self.esters, self.carrier_oils, axes, total_volume, loss_modifier)) as executor:
+            pending = deque()
+            for start, stop in ranges:
+                pending.append((start, stop, executor.submit(_parallel_sweep_task, start, stop)))
+                if len(pending) >= 2 * workers:
+                    yield self._merge_sweep_chunk(axes, total_volume, loss_modifier, *pending.popleft())
+            while pending:
+                yield self._merge_sweep_chunk(axes, total_volume, loss_modifier, *pending.popleft())
+
+    def _merge_sweep_chunk(self, axes, total_volume, loss_modifier, start, stop, future) -> Dict:
+        # Workers only send computed columns back; the inputs are cheap to rebuild here
+        _, chunk = self._sweep_inputs(axes, total_volume, loss_modifier, start, stop)
+        chunk.update(future.result())
+        return chunk
+
+    def _sweep_chunks(self, axes, total_volume, loss_modifier, chunk_size, as_records):
+        for start in range(0, self._sweep_size(axes), chunk_size):
+            chunk = self._sweep_chunk(axes, total_volume, loss_modifier, start, start + chunk_size)
+            if as_records:
+                yield from _sweep_rows([chunk])
+            else:
+                yield chunk
+
+    @staticmethod
+    def _sweep_size(axes) -> int:
+        return int(np.prod([len(axis) for axis in axes]))
+
+    def _sweep_inputs(self, axes, total_volume, loss_modifier, start, stop) -> Tuple[tuple, Dict]:
+        shape = tuple(len(axis) for axis in axes)
+        flat = np.arange(start, min(stop, int(np.prod(shape))))
+        coords = np.unravel_index(flat, shape)
+        concentration, ester_key, oil_key, ba_percent, bb_percent = (axis[index] for axis, index in zip(axes, coords))
+        return coords, {'concentration': concentration, 'ester_key': ester_key, 'oil_key': oil_key,
+                        'ba_percent': ba_percent, 'bb_percent': bb_percent,
+                        'total_volume': np.full(len(flat), float(total_volume)),
+                        'loss_modifier': np.full(len(flat), float(loss_modifier))}
+
+    def _sweep_chunk(self, axes, total_volume, loss_modifier, start, stop, with_inputs: bool = True) -> Dict:
+        coords, inputs = self._sweep_inputs(axes, total_volume, loss_modifier, start, stop)
+        ba_percent, bb_percent = inputs['ba_percent'], inputs['bb_percent']
+
+        # Integer indices skip the per-chunk string key resolution
+        db = self.database
+        ester_idx = db.ester_indices(axes[1])[coords[1]]
+        oil_idx = db.oil_indices(axes[2])[coords[2]]
+
+        outputs = self.calculate_formulation_batch(inputs['concentration'], inputs['total_volume'], inputs['loss_modifier'],
+                                                   ba_percent, bb_percent, ester_idx, oil_idx)
+        outputs['compatible'] = (bb_percent <= BB_PERCENT_SAFE_LIMIT) & (ba_percent <= BA_PERCENT_SAFE_LIMIT)
+        outputs['compatibility_warning'] = outputs['compatible'] & ((bb_percent > BB_PERCENT_WARN) | (ba_percent > BA_PERCENT_WARN))
+        outputs['negative_oil_volume'] = outputs['error_code'] == BATCH_NEGATIVE_OIL_VOLUME
+        if not with_inputs:
+            return outputs
+        inputs.update(outputs)
+        return inputs
+
+    def monte_carlo_formulation(self, config: Dict, n_samples: int = 1_000_000, seed: Optional[int] = None,
+                                tolerances: Optional[Dict] = None, oil_by_mass: bool = False) -> Dict:
+        """Propagate weighing/pipetting tolerances and density uncertainty through a formulation.
+
+        Draws n_samples normally perturbed batches around the calculate_formulation
+        quantities (relative standard deviations from MONTE_CARLO_TOLERANCES,
+        overridable per key) and reports the achieved concentration and
+        solubility ratio distributions. With oil_by_mass the oil is weighed to
+        oil_mass_g, so oil density uncertainty changes the dispensed volume.
+        """
+        _require_numpy("Monte Carlo analysis")
+        tolerances = dict(MONTE_CARLO_TOLERANCES, **(tolerances or {}))
+        unknown = set(tolerances) - set(MONTE_CARLO_TOLERANCES)
+        if unknown:
+            raise ValidationError(f"Unknown tolerance keys: {sorted(unknown)}")
+        if n_samples < 1:
+            raise ValidationError("Monte Carlo needs at least one sample")
+
+        nominal = self.calculate_formulation(config, lean=True)
+        ester = config['ester']
+        oil = config.get('oil', {'density': 0.92})
+        oil_key = config.get('oil_key', 'sesame_oil')
+        ester_idx = self._canonical_ester_index(ester)
+        ester_density = float(self.database.density[ester_idx]) if ester_idx is not None else ester.get('density', 1.05)
+
+        rng = np.random.default_rng(seed)
+
+        def perturbed(value, key):
+            return value * (1 + tolerances[key] * rng.standard_normal(n_samples))
+
+        api_mass_g = perturbed(nominal['api_mass_g'], 'api_mass')
+        api_volume = api_mass_g / perturbed(ester_density, 'ester_density')
+        ba_volume = perturbed(nominal['ba_volume_ml'], 'ba_volume')
+        bb_volume = perturbed(nominal['bb_volume_ml'], 'bb_volume')
+        if oil_by_mass:
+            oil_volume = perturbed(nominal['oil_mass_g'], 'oil_volume') / perturbed(oil.get('density', 0.92), 'oil_density')
+        else:
+            oil_volume = perturbed(nominal['oil_volume_ml'], 'oil_volume')
+
+        final_volume = api_volume + ba_volume + bb_volume + oil_volume
+        achieved_concentration = api_mass_g * 1000 / final_volume
+        bb_percent = bb_volume / final_volume * 100
+
+        base_max = self.solubility_limit(ester, oil_key, 0.0)
+        if self._solubility_factors(ester, oil_key) is not None:
+            max_solubility = np.where(bb_percent > 0, base_max * (1 + (bb_percent / 100) * BB_SOLUBILITY_GAIN), base_max)
+        else:
+            max_solubility = np.full(n_samples, base_max)
+        solubility_ratio = achieved_concentration / max_solubility
+
+        def summary(values):
+            p5, p50, p95 = np.percentile(values, [5, 50, 95])
+            return {'mean': float(values.mean()), 'std': float(values.std()), 'p5': float(p5), 'p50': float(p50), 'p95': float(p95)}
+
+        status_counts = np.bincount(solubility_status_codes(achieved_concentration, max_solubility),
+                                    minlength=len(SOLUBILITY_STATUS_LABELS))
+        return {
+            'n_samples': n_samples, 'seed': seed, 'tolerances': tolerances,
+            'nominal_concentration': config['concentration'],
+            'achieved_concentration': summary(achieved_concentration),
+            'solubility_ratio': summary(solubility_ratio),
+            'probability_over_solubility': float((solubility_ratio > 1.0).mean()),
+            'status_probabilities': {label: float(count) / n_samples
+                                     for label, count in zip(SOLUBILITY_STATUS_LABELS, status_counts)}
+        }
+
+    def _pk_parameters(self, ester_keys, elimination_half_life_days: float):
+        """Rate constants and ester efficiency for injectable ester keys"""
+        db = self.database
+        ester_idx = db.ester_indices(ester_keys)
+        if np.any(ester_idx < 0):
+            raise ValidationError(f"Unknown ester in {np.unique(np.asarray(ester_keys)[ester_idx < 0]).tolist()}")
+        half_life = db.half_life_days[ester_idx]
+        if np.any(np.isnan(half_life)):
+            raise ValidationError("Pharmacokinetic simulation requires injectable esters with half_life_days")
+        ka, ke = _pk_rate_constants(half_life, elimination_half_life_days)
+        return ka, ke, db.ester_efficiency[ester_idx]
+
+    def steady_state_levels(self, ester_keys, doses_mg, intervals_days,
+                            elimination_half_life_days: float = PK_ELIMINATION_HALF_LIFE_DAYS) -> Dict:
+        """Analytic steady-state peak, trough and average level for repeated dosing.
+
+        Levels are the rate of base hormone cleared (mg/day); the average equals
+        dose x ester efficiency / interval. Inputs broadcast together.
+        """
+        _require_numpy("Pharmacokinetic simulation")
+        ester_keys, doses_mg, intervals_days = np.broadcast_arrays(
+            np.asarray(ester_keys), np.asarray(doses_mg, dtype=float), np.asarray(intervals_days, dtype=float))
+        if np.any(intervals_days <= 0):
+            raise ValidationError("Injection intervals must be positive")
+        ka, ke, efficiency = self._pk_parameters(ester_keys, elimination_half_life_days)
+
+        amplitude = doses_mg * efficiency * ka * ke / (ka - ke)
+        ke_tail = 1 - np.exp(-ke * intervals_days)
+        ka_tail = 1 - np.exp(-ka * intervals_days)
+        t_peak = np.clip(np.log((ka * ke_tail) / (ke * ka_tail)) / (ka - ke), 0, intervals_days)
+
+        def level_at(t):
+            return amplitude * (np.exp(-ke * t) / ke_tail - np.exp(-ka * t) / ka_tail)
+
+        return {'peak': level_at(t_peak), 'trough': level_at(intervals_days),
+                'average': doses_mg * efficiency / intervals_days, 'time_to_peak_days': t_peak}
+
+    def simulate_serum_levels(self, ester_keys, doses_mg, intervals_days=None, duration_days: float = 365.0,
+                              step_hours: float = 1.0, n_doses: Optional[int] = None,
+                              elimination_half_life_days: float = PK_ELIMINATION_HALF_LIFE_DAYS) -> Dict:
+        """Level curves for regular injection schedules, one row per schedule.
+
+        Each schedule injects doses_mg of the ester every intervals_days
+        (default: the ester's typical_injection_interval) starting at day 0,
+        n_doses times or for the whole duration. Doses are superposed in closed
+        form (geometric series), so the cost is independent of the dose count.
+        Returns the time grid, the (schedules x times) level matrix in mg/day
+        and the analytic steady-state peak/trough/average.
+        """
+        _require_numpy("Pharmacokinetic simulation")
+        ester_keys = np.atleast_1d(np.asarray(ester_keys))
+        if intervals_days is None:
+            intervals_days = [_typical_interval_days(self.esters.get(str(k), {})) or np.nan for k in ester_keys]
+        ester_keys, doses_mg, intervals_days = np.broadcast_arrays(
+            ester_keys, np.atleast_1d(np.asarray(doses_mg, dtype=float)), np.atleast_1d(np.asarray(intervals_days, dtype=float)))
+        if np.any(~(intervals_days > 0)):
+            raise ValidationError("Injection intervals must be positive")
+        if duration_days <= 0 or step_hours <= 0:
+            raise ValidationError("Simulation duration and step must be positive")
+
+        ka, ke, efficiency = (p[:, None] for p in self._pk_parameters(ester_keys, elimination_half_life_days))
+        time_days = np.arange(0.0, duration_days + 1e-9, step_hours / 24)
+        interval = intervals_days[:, None]
+
+        doses_given = np.floor(time_days / interval + 1e-9)
+        if n_doses is not None:
+            doses_given = np.minimum(doses_given, n_doses - 1)
+        since_last = time_days - doses_given * interval
+
+        def dose_train(k):
+            return np.exp(-k * since_last) * (1 - np.exp(-k * interval * (doses_given + 1))) / (1 - np.exp(-k * interval))
+
+        levels = (doses_mg[:, None] * efficiency * ka * ke / (ka - ke)) * (dose_train(ke) - dose_train(ka))
+        return {'time_days': time_days, 'levels': levels,
+                'steady_state': self.steady_state_levels(ester_keys, doses_mg, intervals_days, elimination_half_life_days)}
+
+    def simulate_ester_switch(self, old_ester_key: str, old_dose_mg: float, old_interval_days: float,
+                              new_ester_key: str, new_dose_mg: float, new_interval_days: float, switch_day: float,
+                              offsets_days=0.0, duration_days: Optional[float] = None, step_hours: float = 1.0,
+                              elimination_half_life_days: float = PK_ELIMINATION_HALF_LIFE_DAYS) -> Dict:
+        """Overlap curve of an old depot washing out while a new ester loads.
+
+        The old schedule is at steady state at day 0 and its last dose is the
+        last one before switch_day; the new schedule's first dose is at
+        switch_day + offset for each value of offsets_days, so one call sweeps
+        the offset (levels has one row per offset). Transitions are scored by
+        how far the combined curve dips below the lower of the two steady-state
+        troughs or overshoots the higher of the two peaks (relative to the mean
+        of the two steady-state averages), plus deviation: the mean distance
+        of the level averaged over one dosing cycle from the old steady-state
+        average before switch_day and the new one after it, which ranks
+        transitions that stay inside the band. best_offset_days is the offset
+        with the smallest total, the one nearest the switch day on ties.
+        """
+        _require_numpy("Pharmacokinetic simulation")
+        offsets = np.atleast_1d(np.asarray(offsets_days, dtype=float))
+        if old_interval_days <= 0 or new_interval_days <= 0 or step_hours <= 0:
+            raise ValidationError("Intervals and step must be positive")
+        if switch_day <= 0 or np.any(switch_day + offsets < 0):
+            raise ValidationError("Switch day must be positive and the first new dose not before day 0")
+        ka, ke, efficiency = self._pk_parameters([old_ester_key, new_ester_key], elimination_half_life_days)
+        if duration_days is None:
+            half_lives = np.log(2) / ka
+            duration_days = switch_day + max(offsets.max(), 0) + 6 * half_lives.max() + 2 * new_interval_days
+        time_days = np.arange(0.0, duration_days + 1e-9, step_hours / 24)
+
+        def amplitude(i, dose):
+            return dose * efficiency[i] * ka[i] * ke[i] / (ka[i] - ke[i])
+
+        # Old schedule: doses at n * interval for every n with n * interval < switch_day (infinite past)
+        last_old = np.ceil(switch_day / old_interval_days - 1e-9) - 1
+        since_old = time_days - np.minimum(np.floor(time_days / old_interval_days + 1e-9), last_old) * old_interval_days
+        old_levels = amplitude(0, old_dose_mg) * sum(
+            sign * np.exp(-k * since_old) / (1 - np.exp(-k * old_interval_days)) for sign, k in ((1, ke[0]), (-1, ka[0])))
+
+        # New schedule: one row per offset, doses at switch_day + offset + m * interval
+        since_first = time_days[None, :] - (switch_day + offsets)[:, None]
+        started = since_first >= 0
+        doses_given = np.floor(np.where(started, since_first, 0) / new_interval_days + 1e-9)
+        since_new = np.where(started, since_first, 0) - doses_given * new_interval_days
+
+        def dose_train(k):
+            return np.exp(-k * since_new) * (1 - np.exp(-k * new_interval_days * (doses_given + 1))) / \
+                (1 - np.exp(-k * new_interval_days))
+
+        new_levels = np.where(started, amplitude(1, new_dose_mg) * (dose_train(ke[1]) - dose_train(ka[1])), 0.0)
+        levels = old_levels[None, :] + new_levels
+
+        steady = self.steady_state_levels([old_ester_key, new_ester_key], [old_dose_mg, new_dose_mg],
+                                          [old_interval_days, new_interval_days], elimination_half_life_days)
+        reference = steady['average'].mean()
+        undershoot = np.maximum(steady['trough'].min() - levels.min(axis=1), 0) / reference
+        overshoot = np.maximum(levels.max(axis=1) - steady['peak'].max(), 0) / reference
+
+        # Cycle-averaged level (moving mean over the longer interval, at the window's end) vs. the target average
+        window = max(int(round(max(old_interval_days, new_interval_days) * 24 / step_hours)), 1)
+        window = min(window, len(time_days))
+        cumulative = np.concatenate([np.zeros((len(offsets), 1)), np.cumsum(levels, axis=1)], axis=1)
+        cycle_mean = (cumulative[:, window:] - cumulative[:, :-window]) / window
+        target = np.where(time_days[window - 1:] < switch_day, steady['average'][0], steady['average'][1])
+        deviation = np.abs(cycle_mean - target).mean(axis=1) / reference
+
+        score = np.round(undershoot + overshoot + deviation, 12)
+        best = int(np.lexsort((np.abs(offsets), score))[0])
+        return {'time_days': time_days, 'offsets_days': offsets, 'levels': levels, 'old_levels': old_levels,
+                'new_levels': new_levels, 'undershoot': undershoot, 'overshoot': overshoot, 'deviation': deviation,
+                'best_offset_days': float(offsets[best]), 'steady_state': steady}
+
+    def steady_state_table(self) -> Dict:
+        """Steady-state levels per mg for every injectable ester and 1-42 day interval.
+
+        Levels scale linearly with dose, so the table stores per-mg peak, trough
+        and average (rows follow ester_keys, columns interval_days) together
+        with the dose-independent peak/trough ratio and time to peak. It is
+        loaded lazily from cache_dir and rebuilt when the ester table hash or
+        the elimination half-life no longer match the file; edits to esters
+        are picked up on the next call.
+        """
+        _require_numpy("Pharmacokinetic simulation")
+        path = os.path.join(self.cache_dir, STEADY_STATE_CACHE_FILE)
+        table_hash = ester_table_hash(self.esters)
+        table = _STEADY_STATE_TABLES.get((path, table_hash))
+        if table is not None:
+            return table
+        if self.database.ester_hash != table_hash:
+            self._database = None
+        try:
+            with np.load(path, allow_pickle=False) as cached:
+                if (str(cached['ester_hash']) == table_hash and
+                        float(cached['elimination_half_life_days']) == PK_ELIMINATION_HALF_LIFE_DAYS):
+                    table = {name: cached[name] for name in cached.files}
+        except (OSError, KeyError, ValueError) as e:
+            if os.path.exists(path):
+                logger.warning(f"Rebuilding steady-state cache {path}: {e}")
+
+        if table is None:
+            table = self._build_steady_state_table(table_hash)
+            try:
+                temp_path = f"{path}.{os.getpid()}.tmp.npz"
+                np.savez(temp_path, **table)
+                os.replace(temp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not persist steady-state cache {path}: {e}")
+
+        for array in table.values():
+            array.setflags(write=False)
+        _STEADY_STATE_TABLES[(path, table_hash)] = table
+        return table
+
+    def _build_steady_state_table(self, table_hash: str) -> Dict:
+        db = self.database
+        ester_keys = [key for key, index in db.ester_index.items() if not np.isnan(db.half_life_days[index])]
+        interval_days = np.arange(1, STEADY_STATE_MAX_INTERVAL_DAYS + 1, dtype=float)
+        levels = self.steady_state_levels(np.array(ester_keys)[:, None], 1.0, interval_days[None, :])
+        return {'ester_keys': np.array(ester_keys), 'interval_days': interval_days,
+                'peak_per_mg': levels['peak'], 'trough_per_mg': levels['trough'],
+                'average_per_mg': levels['average'], 'peak_trough_ratio': levels['peak'] / levels['trough'],
+                'time_to_peak_days': levels['time_to_peak_days'],
+                'ester_hash': np.array(table_hash), 'elimination_half_life_days': np.array(PK_ELIMINATION_HALF_LIFE_DAYS)}
+
+    def steady_state_lookup(self, ester_keys, intervals_days, doses_mg=1.0) -> Dict:
+        """Steady-state peak/trough/average from the cached table.
+
+        Whole-day intervals within the table are looked up; anything else falls
+        back to the analytic solution. Inputs broadcast together.
+        """
+        table = self.steady_state_table()
+        ester_keys, intervals_days, doses_mg = np.broadcast_arrays(
+            np.asarray(ester_keys), np.asarray(intervals_days, dtype=float), np.asarray(doses_mg, dtype=float))
+        row_index = {key: i for i, key in enumerate(table['ester_keys'].tolist())}
+        unique_keys, inverse = np.unique(ester_keys.astype(str), return_inverse=True)
+        rows = np.array([row_index.get(k, -1) for k in unique_keys], dtype=np.intp)[inverse].reshape(ester_keys.shape)
+        columns = intervals_days.astype(np.intp) - 1
+        tabulated = (rows >= 0) & (intervals_days == np.round(intervals_days)) & \
+                    (intervals_days >= 1) & (intervals_days <= STEADY_STATE_MAX_INTERVAL_DAYS)
+
+        result = {}
+        for field in ('peak', 'trough', 'average'):
+            per_mg = table[f'{field}_per_mg'][np.where(tabulated, rows, 0), np.where(tabulated, columns, 0)]
+            result[field] = per_mg * doses_mg
+        if not np.all(tabulated):
+            missing = ~tabulated
+            analytic = self.steady_state_levels(ester_keys[missing], doses_mg[missing], intervals_days[missing])
+            for field in result:
+                result[field][missing] = analytic[field]
+        return result
+
+    def optimize_injection_schedule(self, target_trough: float, target_peak: float, concentration,
+                                    ester_keys: Optional[List[str]] = None, doses_mg=None, intervals_days=None,
+                                    volume_weight: float = 1.0, max_results: int = 10) -> List[Dict]:
+        """Rank ester x dose x interval schedules whose steady state stays in a level window.
+
+        Levels are in the units of steady_state_levels (mg/day). Doses default
+        to each ester's common_doses, or doses_mg applies one range to every
+        ester; intervals default to 1-42 days. concentration (mg/mL) is a number
+        or a dict per ester. Candidates with trough >= target_trough and
+        peak <= target_peak are ranked by fluctuation ((peak - trough) /
+        average) plus volume_weight x injected volume. easy_draw is the
+        calculate_easy_draw_dosages entry for exactly that dose, or None when
+        the dose is not an easy-draw volume at that concentration.
+        """
+        _require_numpy("Schedule optimization")
+        if not 0 <= target_trough < target_peak:
+            raise ValidationError("Target window needs 0 <= trough < peak")
+        if ester_keys is None:
+            ester_keys = [key for key, ester in self.esters.items() if ester.get('half_life_days')]
+        unknown = sorted(set(key for key in ester_keys if key not in self.esters))
+        if unknown:
+            raise ValidationError(f"Unknown ester in {unknown}")
+        concentrations = np.array([concentration.get(key, np.nan) if isinstance(concentration, dict) else concentration
+                                   for key in ester_keys], dtype=float)
+        if not np.all(concentrations > 0):
+            raise ValidationError("Concentration must be positive for every ester")
+
+        # Grid axes: esters x doses x intervals; unequal common_doses lists are NaN-padded
+        if doses_mg is None:
+            dose_lists = [self.esters[key].get('common_doses', []) for key in ester_keys]
+            width = max(map(len, dose_lists), default=0)
+            doses = np.array([list(d) + [np.nan] * (width - len(d)) for d in dose_lists], dtype=float)
+        else:
+            doses = np.broadcast_to(np.asarray(doses_mg, dtype=float), (len(ester_keys), np.size(doses_mg)))
+        intervals = np.arange(1.0, STEADY_STATE_MAX_INTERVAL_DAYS + 1) if intervals_days is None \
+            else np.asarray(intervals_days, dtype=float)
+
+        keys = np.asarray(ester_keys)[:, None, None]
+        levels = self.steady_state_lookup(keys, intervals[None, None, :], doses[:, :, None])
+        peak, trough, average = np.broadcast_arrays(levels['peak'], levels['trough'], levels['average'])
+        volume = np.broadcast_to((doses / concentrations[:, None])[:, :, None], peak.shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fluctuation = (peak - trough) / average
+        score = fluctuation + volume_weight * volume
+
+        feasible = (trough >= target_trough) & (peak <= target_peak) & ~np.isnan(score)
+        index = np.flatnonzero(feasible)
+        index = index[np.argsort(score.ravel()[index], kind='stable')][:max_results]
+
+        candidates = []
+        for e, d, i in zip(*np.unravel_index(index, peak.shape)):
+            dose = float(doses[e, d])
+            easy_draw = self.calculate_easy_draw_dosages(float(concentrations[e]))
+            candidates.append({
+                'ester_key': ester_keys[e], 'ester_name': self.esters[ester_keys[e]]['name'],
+                'dose_mg': dose, 'interval_days': float(intervals[i]), 'volume_ml': float(volume[e, d, i]),
+                'peak': float(peak[e, d, i]), 'trough': float(trough[e, d, i]), 'average': float(average[e, d, i]),
+                'fluctuation': float(fluctuation[e, d, i]), 'score': float(score[e, d, i]),
+                'easy_draw': next((entry for entry in easy_draw if math.isclose(entry['dose_mg'], dose, rel_tol=1e-9)),
+                                  None)
+            })
+        return candidates
+
+    def plan_batch_supply(self, formulations, doses_mg, intervals_days, dead_space_ml: float = SYRINGE_DEAD_SPACE_ML,
+                          lead_time_days: float = COMPOUNDING_LEAD_DAYS, start_date: Optional[str] = None,
+                          patient_ids=None) -> Dict:
+        """How long compounded batches last for a roster of dosing schedules.
+
+        formulations is one calculate_formulation() result or config, a list of
+        them (one per patient), or a dict of num_vials/vial_size/concentration
+        arrays. Each draw loses dead_space_ml; a vial yields whole doses only
+        and leftovers are not pooled across vials. All inputs broadcast, and
+        the result is a dict of SUPPLY_PLAN_FIELDS columns (see
+        write_supply_plan). Dates are filled in when start_date (ISO) is given.
+        """
+        _require_numpy("Supply planning")
+        if isinstance(formulations, dict):
+            formulations = formulations.get('config', formulations)
+            configs = None
+        else:
+            configs = [f.get('config', f) for f in formulations]
+
+        def column(field, default):
+            if configs is None:
+                value = formulations.get(field)
+                return np.asarray(default(formulations) if value is None else value, dtype=float)
+            return np.array([c.get(field) if c.get(field) is not None else default(c) for c in configs], dtype=float)
+
+        num_vials = column('num_vials', lambda c: 1)
+        vial_size = column('vial_size', lambda c: np.asarray(c.get('total_volume', 10.0)) / np.asarray(c.get('num_vials', 1)))
+        concentration = column('concentration', lambda c: np.nan)
+        num_vials, vial_size, concentration, doses_mg, intervals_days = np.broadcast_arrays(
+            num_vials, vial_size, concentration, np.asarray(doses_mg, dtype=float), np.asarray(intervals_days, dtype=float))
+        if not (np.all(concentration > 0) and np.all(doses_mg > 0) and np.all(intervals_days > 0)):
+            raise ValidationError("Concentration, dose and interval must be positive for every schedule")
+        if dead_space_ml < 0 or np.any(vial_size <= 0) or np.any(num_vials < 1):
+            raise ValidationError("Invalid vial configuration or dead space")
+
+        draw_volume = doses_mg / concentration
+        per_draw = draw_volume + dead_space_ml
+        doses_per_vial = np.floor(vial_size / per_draw + 1e-9).astype(np.int64)
+        total_doses = doses_per_vial * num_vials.astype(np.int64)
+        batch_duration = total_doses * intervals_days
+        compound_next = np.maximum(batch_duration - lead_time_days, 0.0)
+
+        if patient_ids is None:
+            patient_ids = np.arange(1, draw_volume.size + 1).reshape(draw_volume.shape)
+        plan = {
+            'patient_id': np.broadcast_to(np.asarray(patient_ids), draw_volume.shape),
+            'num_vials': num_vials.astype(np.int64), 'vial_size': vial_size, 'concentration': concentration,
+            'dose_mg': doses_mg, 'interval_days': intervals_days, 'draw_volume_ml': draw_volume,
+            'doses_per_vial': doses_per_vial, 'total_doses': total_doses,
+            'leftover_per_vial_ml': vial_size - doses_per_vial * per_draw,
+            'batch_duration_days': batch_duration, 'compound_next_day': compound_next
+        }
+        if start_date is None:
+            plan['runout_date'] = plan['compound_next_date'] = np.full(draw_volume.shape, '')
+        else:
+            start = np.datetime64(datetime.fromisoformat(start_date).date(), 'D')
+            plan['runout_date'] = np.datetime_as_string(start + np.floor(batch_duration).astype('timedelta64[D]'))
+            plan['compound_next_date'] = np.datetime_as_string(start + np.floor(compound_next).astype('timedelta64[D]'))
+        return plan
+
+    def unit_response_curve(self, ester_key: str, step_hours: float, horizon_days: float,
+                            elimination_half_life_days: float = PK_ELIMINATION_HALF_LIFE_DAYS) -> 'np.ndarray':
+        """Read-only level curve for a single 1mg dose, sampled every step_hours up to horizon_days (cached)"""
+        _require_numpy("Pharmacokinetic simulation")
+
+        def compute():
+            ka, ke, efficiency = self._pk_parameters([ester_key], elimination_half_life_days)
+            time_days = np.arange(0.0, horizon_days + 1e-9, step_hours / 24)
+            return _unit_response(time_days, ka[0], ke[0], efficiency[0])
+
+        key = (self.database.version, str(ester_key), float(step_hours), float(horizon_days),
+               float(elimination_half_life_days))
+        return _RESPONSE_CURVES.get(key, compute)
+
+    def response_cache_info(self) -> Dict:
+        """Hit/miss statistics of the unit response curve cache"""
+        return _RESPONSE_CURVES.stats()
+
+    def configure_response_cache(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, spill_dir: Optional[str] = None):
+        """Replace the process-wide response curve cache (e.g. to resize it or enable .npy spill)"""
+        global _RESPONSE_CURVES
+        _RESPONSE_CURVES = ResponseCurveCache(max_bytes, spill_dir)
+
+    def calculate_spray_exposure(self, sprays_per_day, ml_per_actuation=SPRAY_ACTUATION_ML, absorption_rate=None,
+                                 bottle_volume_ml=120.0, concentration=None) -> Dict:
+        """Daily absorbed estradiol and bottle duration for many spray regimens at once.
+
+        Inputs broadcast; absorption_rate and concentration default to the
+        estradiol_spray entry. Returns SPRAY_EXPOSURE_FIELDS as arrays.
+        """
+        _require_numpy("Spray exposure modelling")
+        spray = self.esters['estradiol_spray']
+        sprays_per_day, ml_per_actuation, absorption_rate, bottle_volume_ml, concentration = np.broadcast_arrays(
+            *(np.asarray(value, dtype=float) for value in (
+                sprays_per_day, ml_per_actuation,
+                spray.get('absorption_rate', 0.12) if absorption_rate is None else absorption_rate,
+                bottle_volume_ml, spray.get('fixed_concentration', 58.33) if concentration is None else concentration)))
+        if np.any(sprays_per_day <= 0) or np.any(ml_per_actuation <= 0):
+            raise ValidationError("Sprays per day and mL per actuation must be positive")
+        if np.any((absorption_rate < 0) | (absorption_rate > 1)):
+            raise ValidationError("Absorption rate must be between 0 and 1")
+        return _spray_exposure(sprays_per_day, ml_per_actuation, concentration, absorption_rate, bottle_volume_ml)
+
+    def load_dose_log(self, path: str) -> Dict:
+        """Read an injection log CSV with dose_mg and either day or date columns.
+
+        day is days since the start of the log; date is ISO (YYYY-MM-DD[THH:MM])
+        and is converted to days since the earliest entry. An optional
+        ester_key column allows logs that change ester.
+        """
+        import csv
+        days, doses, esters = [], [], []
+        try:
+            with open(path, newline='') as f:
+                reader = csv.DictReader(f)
+                fields = set(reader.fieldnames or ())
+                if 'dose_mg' not in fields or not fields & {'day', 'date'}:
+                    raise ValidationError("Dose log needs a dose_mg column and a day or date column")
+                use_dates = 'day' not in fields
+                for line, row in enumerate(reader, start=2):
+                    try:
+                        if use_dates:
+                            stamp = datetime.fromisoformat(row['date'].strip())
+                            days.append(stamp.toordinal() + (stamp.hour * 3600 + stamp.minute * 60 + stamp.second) / 86400)
+                        else:
+                            days.append(float(row['day']))
+                        doses.append(float(row['dose_mg']))
+                    except (TypeError, ValueError, AttributeError):
+                        raise ValidationError(f"Invalid dose log entry on line {line} of {path}")
+                    esters.append((row.get('ester_key') or '').strip() or None)
+        except OSError as e:
+            raise ValidationError(f"Cannot read dose log {path}: {e}")
+        if not days:
+            raise ValidationError(f"Dose log {path} is empty")
+
+        day = np.asarray(days)
+        if use_dates:
+            day = day - day.min()
+        log = {'day': day, 'dose_mg': np.asarray(doses)}
+        if any(esters):
+            log['ester_key'] = esters
+        return log
+
+    def simulate_dose_log(self, dose_log, ester_key: Optional[str] = None, duration_days: Optional[float] = None,
+                          step_hours: float = 1.0,
+                          elimination_half_life_days: float = PK_ELIMINATION_HALF_LIFE_DAYS) -> Dict:
+        """Level curve for an irregular dose log by FFT convolution.
+
+        dose_log is a CSV path or a dict with day and dose_mg arrays (and an
+        optional per-dose ester_key list, falling back to ester_key). Doses are
+        spread onto the time grid as an impulse train (linear split between the
+        two nearest grid points) and convolved with each ester's unit response,
+        so cost is O(T log T) regardless of how many doses the log contains.
+        duration_days defaults to the last dose plus three absorption half-lives
+        of the slowest ester in the log.
+        """
+        _require_numpy("Pharmacokinetic simulation")
+        if isinstance(dose_log, (str, os.PathLike)):
+            dose_log = self.load_dose_log(dose_log)
+        day = np.asarray(dose_log['day'], dtype=float)
+        dose_mg = np.asarray(dose_log['dose_mg'], dtype=float)
+        ester_keys = [key or ester_key for key in dose_log.get('ester_key') or [None] * len(day)]
+        if None in ester_keys:
+            raise ValidationError("Dose log entries need an ester_key")
+        if day.shape != dose_mg.shape or len(ester_keys) != len(day):
+            raise ValidationError("Dose log columns must have equal length")
+        if np.any(day < 0) or step_hours <= 0:
+            raise ValidationError("Dose days must be non-negative and the step positive")
+
+        step = step_hours / 24
+        log_esters = list(dict.fromkeys(ester_keys))
+        if duration_days is None:
+            if len(day):
+                ka, _, _ = self._pk_parameters(log_esters, elimination_half_life_days)
+                duration_days = day.max() + 3 * float(np.log(2) / ka.min())
+            else:
+                duration_days = 0.0
+        time_days = np.arange(0.0, duration_days + 1e-9, step)
+        n_points = len(time_days)
+        n_fft = 1 << (2 * n_points - 1).bit_length()
+        levels = np.zeros(n_points)
+
+        horizon_days = _response_horizon_days(duration_days)
+        for key in log_esters:
+            mask = np.array([k == key for k in ester_keys])
+            position = day[mask] / step
+            lower = np.floor(position).astype(np.int64)
+            upper_weight = position - lower
+            impulses = np.bincount(lower, dose_mg[mask] * (1 - upper_weight), minlength=n_points + 1)
+            impulses += np.bincount(lower + 1, dose_mg[mask] * upper_weight, minlength=n_points + 1)
+            response = self.unit_response_curve(key, step_hours, horizon_days, elimination_half_life_days)[:n_points]
+            spectrum = np.fft.rfft(impulses[:n_points], n_fft) * np.fft.rfft(response, n_fft)
+            levels += np.fft.irfft(spectrum, n_fft)[:n_points]
+
+        return {'time_days': time_days, 'levels': np.maximum(levels, 0.0)}
+
     def _validate_formulation_config(self, config: Dict):
         required_fields = ['concentration', 'total_volume', 'ester']
         missing = [f for f in required_fields if f not in config]
@@ -435,27 +2363,117 @@ class CompoundMeMommyCalculator:
             ax.axis('off')
             return fig
 
-    def calculate_dynamic_solubility_limit(self, ester: Dict, oil_key: str, bb_percent: float, user_concentration: float) -> Tuple[float, str]:
+    def solubility_limit(self, ester: Dict, oil_key: str, bb_percent: float) -> float:
+        """Maximum solubility (mg/mL), memoized for entries of this calculator's ester table"""
         try:
-            base_solubility = ester.get("base_solubility", {})
-            if not base_solubility:
-                return 1000.0, "No solubility data available"
-
-            database_max_solubility = base_solubility.get(oil_key, 250)
-            oil_factor = self.carrier_oils.get(oil_key, {"solubility_factor": 1.0})["solubility_factor"]
-            oil_enhanced_max = database_max_solubility * oil_factor
+            if NUMPY_AVAILABLE:
+                db = self.database
+                ester_idx = db.find_ester(ester)
+                if ester_idx is not None:
+                    return _cached_solubility_limit(db, db.ester_keys[ester_idx], oil_key, float(bb_percent))
+                return _solubility_limit(ester, oil_key, bb_percent, db, self.carrier_oils)
+            return _solubility_limit(ester, oil_key, bb_percent, None, self.carrier_oils)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return 1000.0
+
+    def solubility_cache_info(self):
+        """Hit/miss statistics of the solubility limit cache"""
+        return _cached_solubility_limit.cache_info()
+
+    def invalidate_solubility_cache(self):
+        """Invalidation hook for when the ester/oil tables change"""
+        self.invalidate_caches()
+
+    def minimum_bb_percent(self, ester: Dict, oil_key: str, concentration: float, target_status: str = "Good",
+                           resolution: float = 0.1) -> Optional[float]:
+        """Smallest benzyl benzoate % that brings the solubility status to target_status or better.
+
+        Solved directly from the BB multiplier model and rounded up to
+        `resolution`. Returns 0.0 when no BB is needed, BB_PERCENT_MIN when
+        less than that would do, and None when even BB_PERCENT_MAX falls short.
+        """
+        target = self._target_status_code(target_status)
+        threshold = SOLUBILITY_STATUS_THRESHOLDS[target]
+        base_max = self.solubility_limit(ester, oil_key, 0.0)
+        if concentration / base_max <= threshold:
+            return 0.0
+        if self._solubility_factors(ester, oil_key) is None:
+            return None  # BB does not change the fallback limit
+
+        bb_percent = max((concentration / (threshold * base_max) - 1) * 100 / BB_SOLUBILITY_GAIN, BB_PERCENT_MIN)
+        if resolution > 0:
+            bb_percent = round(math.ceil(bb_percent / resolution - 1e-9) * resolution, 10)
+            # Guard against the boundary landing one rounding error on the wrong side
+            if concentration / self.solubility_limit(ester, oil_key, bb_percent) > threshold:
+                bb_percent = round(bb_percent + resolution, 10)
+        if bb_percent > BB_PERCENT_MAX + 1e-9:
+            return None
+        return bb_percent
+
+    def minimum_bb_percent_batch(self, ester_key, oil_key, concentration, target_status: str = "Good",
+                                 resolution: float = 0.1):
+        """Vectorized minimum_bb_percent; NaN where the target is out of reach"""
+        _require_numpy("Batch benzyl benzoate solving")
+        target = self._target_status_code(target_status)
+        threshold = SOLUBILITY_STATUS_THRESHOLDS[target]
+
+        db = self.database
+        concentration = np.asarray(concentration, dtype=float)
+        ester_idx, oil_idx, concentration = np.broadcast_arrays(
+            db.ester_indices(ester_key), db.oil_indices(oil_key), concentration)
+        known = (ester_idx >= 0) & (oil_idx >= 0)
+        ester_idx = np.where(known, ester_idx, 0)
+        oil_idx = np.where(known, oil_idx, 0)
+
+        has_solubility = db.has_solubility[ester_idx]
+        base_max = np.where(has_solubility, db.base_solubility[ester_idx, oil_idx] * db.oil_solubility_factor[oil_idx], 1000.0)
+        bb_percent = np.maximum((concentration / (threshold * base_max) - 1) * 100 / BB_SOLUBILITY_GAIN, BB_PERCENT_MIN)
+        if resolution > 0:
+            bb_percent = np.round(np.ceil(bb_percent / resolution - 1e-9) * resolution, 10)
+            achieved = base_max * (1 + (bb_percent / 100) * BB_SOLUBILITY_GAIN)
+            bb_percent = np.where(concentration / achieved > threshold, np.round(bb_percent + resolution, 10), bb_percent)
+
+        bb_percent = np.where(bb_percent > BB_PERCENT_MAX + 1e-9, np.nan, bb_percent)
+        bb_percent = np.where(has_solubility, bb_percent, np.nan)
+        bb_percent = np.where(concentration / base_max <= threshold, 0.0, bb_percent)
+        return np.where(known, bb_percent, np.nan)
+
+    @staticmethod
+    def _target_status_code(target_status: str) -> int:
+        if target_status not in SOLUBILITY_STATUS_LABELS[:len(SOLUBILITY_STATUS_THRESHOLDS)]:
+            raise ValidationError(f"Target status must be one of {SOLUBILITY_STATUS_LABELS[:3]}, got {target_status!r}")
+        return SOLUBILITY_STATUS_LABELS.index(target_status)
+
+    def solubility_grid(self, bb_max: float = 30.0, bb_step: float = 0.1) -> SolubilityGrid:
+        """Process-wide precomputed solubility grid for sweeps and repeated lookups"""
+        key = (self.database, float(bb_max), float(bb_step))
+        if key not in _SOLUBILITY_GRIDS:
+            _SOLUBILITY_GRIDS[key] = SolubilityGrid(self.database, bb_max, bb_step)
+        return _SOLUBILITY_GRIDS[key]
+
+    def format_solubility_explanation(self, ester: Dict, oil_key: str, bb_percent: float, user_concentration: float) -> str:
+        try:
+            factors = self._solubility_factors(ester, oil_key)
+            if factors is None:
+                return "No solubility data available"
+            database_max_solubility, oil_factor = factors
+            final_max_solubility = self.solubility_limit(ester, oil_key, bb_percent)
 
             if bb_percent > 0:
-                bb_multiplier = 1 + (bb_percent / 100) * 2.5
-                final_max_solubility = oil_enhanced_max * bb_multiplier
-                explanation = f"Current: {user_concentration}mg/mL | Maximum: {final_max_solubility:.0f}mg/mL\nEnhancement: Database {database_max_solubility}mg/mL -> Oil {oil_factor:.2f}x -> BB {bb_multiplier:.2f}x"
-            else:
-                final_max_solubility = oil_enhanced_max
-                explanation = f"Current: {user_concentration}mg/mL | Maximum: {final_max_solubility:.0f}mg/mL\nEnhancement: Database {database_max_solubility}mg/mL -> Oil {oil_factor:.2f}x (No BB)"
-
-            return final_max_solubility, explanation
+                bb_multiplier = 1 + (bb_percent / 100) * BB_SOLUBILITY_GAIN
+                return f"Current: {user_concentration}mg/mL | Maximum: {final_max_solubility:.0f}mg/mL\nEnhancement: Database {database_max_solubility:g}mg/mL -> Oil {oil_factor:.2f}x -> BB {bb_multiplier:.2f}x"
+            return f"Current: {user_concentration}mg/mL | Maximum: {final_max_solubility:.0f}mg/mL\nEnhancement: Database {database_max_solubility:g}mg/mL -> Oil {oil_factor:.2f}x (No BB)"
         except:
-            return 1000.0, "Solubility calculation error"
+            return "Solubility calculation error"
+
+    def calculate_dynamic_solubility_limit(self, ester: Dict, oil_key: str, bb_percent: float, user_concentration: float) -> Tuple[float, str]:
+        """Maximum solubility together with its rendered explanation.
+
+        Callers that only need the number should use solubility_limit() and
+        render the explanation with format_solubility_explanation() when shown.
+        """
+        return (self.solubility_limit(ester, oil_key, bb_percent),
+                self.format_solubility_explanation(ester, oil_key, bb_percent, user_concentration))
 
     def assess_solubility_status(self, concentration: float, estimated_max: float) -> str:
         try:
@@ -474,43 +2492,269 @@ class CompoundMeMommyCalculator:
             return "Unknown"
 
     def save_recipe(self, formulation: Dict, filename: str):
-        """Save recipe as JSON (plaintext)"""
+        """Save recipe as a JSON alias of its content-addressed blob (see recipe_content_hash)"""
         try:
-            formulation_json = json.dumps(formulation, indent=2)
-            filepath = os.path.join(self.recipes_dir, f"{filename}.json")
+            digest = recipe_content_hash(formulation, self.esters, self.carrier_oils)
+            blobs_dir = os.path.join(self.recipes_dir, RECIPE_BLOB_DIR)
+            blob_path = os.path.join(blobs_dir, f"{digest}.json")
+            if not os.path.exists(blob_path):
+                os.makedirs(blobs_dir, exist_ok=True)
+                _write_atomic(blob_path, json.dumps(self._stored_recipe(formulation), indent=2))
 
+            filepath = os.path.join(self.recipes_dir, f"{filename}.json")
             with open(filepath, 'w') as f:
-                f.write(formulation_json)
+                f.write(json.dumps(_recipe_alias(formulation, digest), indent=2))
 
+            self.recipe_index().update(f"{filename}.json", formulation)
             return filepath
         except Exception as e:
             raise ValidationError(f"Could not save recipe: {str(e)}")
 
     def load_recipe(self, filepath: str):
-        """Load JSON recipe"""
+        """Load JSON recipe, resolving blob aliases and v2 ester/oil keys"""
         try:
             if not os.path.exists(filepath):
                 raise ValidationError(f"Recipe not found: {filepath}")
 
             with open(filepath, 'r') as f:
-                formulation = json.load(f)
-
-            return formulation
+                return self._loaded_recipe(_resolve_recipe(json.load(f), os.path.dirname(filepath)))
         except json.JSONDecodeError:
             raise ValidationError("Invalid recipe data - file may be corrupted")
         except Exception as e:
             raise ValidationError(f"Could not load recipe: {str(e)}")
 
+    def database_version(self) -> str:
+        """database_version_hash of this calculator's ester and carrier oil tables"""
+        return database_version_hash(self.esters, self.carrier_oils)
+
+    def _stored_recipe(self, formulation: Dict, database_version: Optional[str] = None) -> Dict:
+        """v2 document for storing a formulation (recipes directory and SQLite store)"""
+        return _normalize_recipe(formulation, database_version or self.database_version(), self.esters,
+                                 self.carrier_oils)
+
+    def _loaded_recipe(self, document) -> Dict:
+        """Formulation for a stored document: v1 as stored, v2 expanded and recalculated if the tables changed"""
+        formulation = _expand_recipe(document, self.esters, self.carrier_oils)
+        if formulation is not document and document.get('database_version') != self.database_version():
+            formulation = self._recalculate_recipe(formulation)
+        return formulation
+
+    def _recalculate_recipe(self, formulation: Dict) -> Dict:
+        """Redo the calculations of a v2 recipe saved against a different ester/oil database"""
+        try:
+            if 'spray_calculations' in formulation:
+                result = self.calculate_spray_formulation(formulation['config']).to_dict()
+            else:
+                result = self.calculate_formulation(formulation['config']).to_dict()
+        except ValidationError as e:
+            logger.warning(f"Recipe was saved against another database version; keeping its calculations ({e})")
+            return formulation
+        for key in ('calculations', 'spray_calculations'):
+            if key in result:
+                formulation[key] = result[key]
+        return formulation
+
+    def dedupe_recipes(self, dry_run: bool = False) -> Dict:
+        """Convert full-copy recipe files into aliases of shared blobs.
+
+        Returns counts and the bytes used by recipe files and new blobs before
+        and after; with dry_run nothing is written.
+        """
+        blobs_dir = os.path.join(self.recipes_dir, RECIPE_BLOB_DIR)
+        report = {'recipes': 0, 'converted': 0, 'blobs_created': 0, 'bytes_before': 0, 'bytes_after': 0}
+        new_blobs = set()
+        database_version = self.database_version()
+        with os.scandir(self.recipes_dir) as scan:
+            entries = sorted((entry for entry in scan if entry.name.endswith('.json') and entry.is_file()),
+                             key=lambda entry: entry.name)
+        for entry in entries:
+            report['recipes'] += 1
+            size = entry.stat().st_size
+            report['bytes_before'] += size
+            try:
+                with open(entry.path) as f:
+                    text = f.read()
+                formulation = json.loads(text)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping recipe {entry.path}: {e}")
+                report['bytes_after'] += size
+                continue
+            if not isinstance(formulation, dict) or 'recipe_alias' in formulation or 'config' not in formulation:
+                report['bytes_after'] += size
+                continue
+
+            digest = recipe_content_hash(formulation, self.esters, self.carrier_oils)
+            blob_path = os.path.join(blobs_dir, f"{digest}.json")
+            alias_text = json.dumps(_recipe_alias(formulation, digest), indent=2)
+            if digest not in new_blobs and not os.path.exists(blob_path):
+                new_blobs.add(digest)
+                blob_text = json.dumps(self._stored_recipe(formulation, database_version), indent=2)
+                report['blobs_created'] += 1
+                report['bytes_after'] += len(blob_text.encode())
+                if not dry_run:
+                    os.makedirs(blobs_dir, exist_ok=True)
+                    _write_atomic(blob_path, blob_text)
+            if not dry_run:
+                _write_atomic(entry.path, alias_text)
+            report['converted'] += 1
+            report['bytes_after'] += len(alias_text.encode())
+
+        report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+        return report
+
+    def migrate_recipes(self, directory: Optional[str] = None, dry_run: bool = False) -> Dict:
+        """Rewrite v1 recipe files (and blobs) in place as v2, one file at a time.
+
+        Aliases and v2 files are left alone. The directory listing is taken
+        first (replacing entries during a scan may skip or repeat them); files
+        are then read, converted and atomically replaced one at a time, so
+        only the listing is held in memory. With dry_run nothing is written.
+        """
+        directory = directory or self.recipes_dir
+        report = {'files': 0, 'migrated': 0, 'errors': 0, 'bytes_before': 0, 'bytes_after': 0}
+        database_version = self.database_version()
+        for scan_dir in (directory, os.path.join(directory, RECIPE_BLOB_DIR)):
+            if not os.path.isdir(scan_dir):
+                continue
+            with os.scandir(scan_dir) as scan:
+                entries = [entry for entry in scan if entry.name.endswith('.json') and entry.is_file()]
+            for entry in entries:
+                report['files'] += 1
+                try:
+                    with open(entry.path) as f:
+                        text = f.read()
+                    document = json.loads(text)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping recipe {entry.path}: {e}")
+                    report['errors'] += 1
+                    continue
+                if (not isinstance(document, dict) or 'config' not in document or 'recipe_alias' in document
+                        or document.get('recipe_format') == RECIPE_FORMAT_VERSION):
+                    continue
+                migrated_text = json.dumps(self._stored_recipe(document, database_version), indent=2)
+                if not dry_run:
+                    _write_atomic(entry.path, migrated_text)
+                report['migrated'] += 1
+                report['bytes_before'] += len(text.encode())
+                report['bytes_after'] += len(migrated_text.encode())
+        return report
+
+    def recipe_index(self) -> RecipeIndex:
+        """Index of recipes_dir, persisted under cache_dir"""
+        index = getattr(self, '_recipe_index', None)
+        if index is None or index.recipes_dir != self.recipes_dir:
+            index_path = os.path.join(self.cache_dir, RECIPE_INDEX_FILE)
+            if os.path.abspath(self.cache_dir) == os.path.abspath(self.recipes_dir):
+                index_path = os.path.join(os.path.dirname(os.path.abspath(self.recipes_dir)), RECIPE_INDEX_FILE)
+            index = self._recipe_index = RecipeIndex(self.recipes_dir, index_path)
+        return index
+
     def list_recipes(self):
         """List all saved recipes"""
         try:
             if not os.path.exists(self.recipes_dir):
                 return []
-            return sorted([f for f in os.listdir(self.recipes_dir) if f.endswith('.json')])
+            return list(self.recipe_index().names())
         except:
             return []
 
-    def generate_pdf_worksheet(self, formulation: Dict):
+    def find_recipes(self, load: bool = False, **filters) -> List[Dict]:
+        """Saved recipes matching the filters, answered from the recipe index.
+
+        Filters take a summary column (see RECIPE_SUMMARY_COLUMNS) and either a
+        value or an inclusive (low, high) range with None for an open end.
+        created_date also accepts a prefix such as '2024-05' for a month.
+        Example: find_recipes(ester_key='testosterone_cypionate',
+        oil_key='mct_oil', concentration=(200, None)). Each match is a summary
+        dict; with load=True only the matching files are opened and their
+        JSON is added under 'formulation'.
+        """
+        index = self.recipe_index()
+        rows = index.find(**filters)
+        columns = index.columns
+        matches = [{column: columns[column][i] for column in RECIPE_SUMMARY_COLUMNS} for i in rows]
+        if load:
+            for match in matches:
+                match['formulation'] = self.load_recipe(os.path.join(self.recipes_dir, match['filename']))
+        return matches
+
+    def search_recipes_menu(self):
+        """Prompt for filters and return the chosen recipe, None, or 'QUIT'"""
+        print("\n=== SEARCH RECIPES ===")
+        print("Leave a field blank to ignore it.")
+        filters = {}
+        for prompt, column, input_type in (("Ester key (e.g. testosterone_cypionate): ", 'ester_key', str),
+                                           ("Carrier oil key (e.g. mct_oil): ", 'oil_key', str),
+                                           ("Minimum concentration (mg/mL): ", 'concentration_min', float),
+                                           ("Maximum concentration (mg/mL): ", 'concentration_max', float),
+                                           ("Created (YYYY, YYYY-MM or YYYY-MM-DD): ", 'created_date', str)):
+            value = self.get_input_with_navigation(prompt, input_type, '')
+            if value in ['QUIT', 'BACK']:
+                return None if value == 'BACK' else value
+            if value != '':
+                filters[column] = value
+        low, high = filters.pop('concentration_min', None), filters.pop('concentration_max', None)
+        if low is not None or high is not None:
+            filters['concentration'] = (low, high)
+
+        matches = self.find_recipes(**filters)
+        if not matches:
+            print("\nNo matching recipes.")
+            return None
+        print(f"\n{len(matches)} matching recipe(s):")
+        for i, match in enumerate(matches, 1):
+            print(f"{i}. {match['filename'].replace('.json', '')} ({match['ester_key'] or '?'}, "
+                  f"{match['concentration']}mg/mL, {match['oil_key'] or 'no oil'}, {(match['created_date'] or '')[:10]})")
+
+        choice = self.get_input_with_navigation(f"Select recipe [1-{len(matches)}]: ", int)
+        if choice == 'QUIT':
+            return choice
+        if choice == 'BACK' or choice < 1 or choice > len(matches):
+            return None
+        return self.load_recipe(os.path.join(self.recipes_dir, matches[choice - 1]['filename']))
+
+    def recipe_summaries(self) -> Dict[str, List]:
+        """RECIPE_SUMMARY_COLUMNS of every saved recipe as parallel lists sorted by file name"""
+        try:
+            return self.recipe_index().refresh()
+        except OSError:
+            return RecipeIndex._empty()
+
+    def open_recipe_store(self, path: Optional[str] = None, import_existing: bool = False) -> RecipeStore:
+        """Open the SQLite recipe store (default ~/.compoundmemommy/recipes.sqlite3).
+
+        With import_existing the JSON recipes directory is imported first.
+        """
+        store = RecipeStore(path or os.path.join(self.cache_dir, RECIPE_DB_FILE), self)
+        if import_existing:
+            store.import_json_directory(self.recipes_dir)
+        return store
+
+    def expected_level_curves(self, config: Dict, duration_days: float = 84.0) -> Optional[Dict]:
+        """Curves for each common dose at the typical interval, None without PK data"""
+        ester_key = config.get('ester_key')
+        ester = self.esters.get(ester_key, {})
+        interval = _typical_interval_days(ester)
+        if not NUMPY_AVAILABLE or not ester.get('half_life_days') or not interval or not ester.get('common_doses'):
+            return None
+        doses = ester['common_doses']
+        result = self.simulate_serum_levels([ester_key] * len(doses), doses, interval, duration_days=duration_days)
+        result['labels'] = [f"{dose}mg every {interval:g} days" for dose in doses]
+        result['title'] = f"Expected levels: {ester['name']}"
+        return result
+
+    def plot_level_curves(self, curves: Dict, band: Optional[Tuple[float, float]] = None):
+        """Render simulate_* output (time_days + levels) on the shared plotter; returns the figure"""
+        return get_level_plotter().render(curves['time_days'], curves['levels'], labels=curves.get('labels'),
+                                          title=curves.get('title', "Expected levels"), band=band)
+
+    def generate_pdf_worksheet(self, formulation: Dict, expected_levels=None):
+        """Write the compounding worksheet PDF.
+
+        expected_levels adds an "expected levels" page: pass simulate_* output
+        (time_days + levels, optional labels/title) or True to plot the
+        ester's common doses at its typical interval when PK data exists.
+        """
         try:
             if not PDF_AVAILABLE:
                 raise ValidationError("PDF generation requires matplotlib. Install with: pip install matplotlib")
@@ -577,7 +2821,7 @@ class CompoundMeMommyCalculator:
                 # CENTERED: Solubility assessment
                 ax.text(0.5, y_pos, "SOLUBILITY ASSESSMENT:", ha='center', fontsize=12, weight='bold')
                 y_pos -= line_height
-                ax.text(0.5, y_pos, f"Status: {calc['solubility_status']}", ha='center', fontsize=10)
+                ax.text(0.5, y_pos, f"Status: {self._solubility_presentation(config, calc)[1]}", ha='center', fontsize=10)
                 y_pos -= line_height * 2
 
                 # CENTERED: Visual solubility analysis
@@ -639,8 +2883,16 @@ class CompoundMeMommyCalculator:
                 y_pos -= line_height
                 ax.text(0.5, y_pos, f"Polysorbate 80: {calc.get('polysorbate_80_g', 0):.3f}g", ha='center', fontsize=10)
 
+            if expected_levels is True:
+                expected_levels = self.expected_level_curves(config)
+
             plt.tight_layout()
-            plt.savefig(filepath, bbox_inches='tight', dpi=300)
+            if expected_levels:
+                with PdfPages(filepath) as pdf:
+                    pdf.savefig(fig, bbox_inches='tight', dpi=300)
+                    pdf.savefig(self.plot_level_curves(expected_levels))
+            else:
+                plt.savefig(filepath, bbox_inches='tight', dpi=300)
             plt.close()
 
             self.current_pdf_path = filepath
@@ -723,6 +2975,49 @@ class CompoundMeMommyCalculator:
                 dosages.append({'volume_ml': volume, 'dose_mg': dose_mg, 'description': f"{dose_mg:.1f}mg in {volume}mL"})
         return dosages[:8]
 
+    def easy_draw_table(self, concentrations, syringes: Optional[List[str]] = None, vial_size: float = 10.0,
+                        dead_space_ml: float = SYRINGE_DEAD_SPACE_ML, round_step_mg: float = 1.0,
+                        dose_range: Tuple[float, float] = (1.0, 500.0)) -> Dict:
+        """Full dose matrix for many concentrations against every syringe graduation.
+
+        Columns are the graduation marks of the chosen SYRINGE_GRADUATIONS
+        (volume_ml, with the syringe key per column). dose_mg is
+        concentrations x marks; doses_per_vial counts whole draws per vial
+        after dead space. round_count is the number of distinct multiples of
+        round_step_mg within dose_range that land exactly on some mark, and
+        best_concentration the concentration with the most of them.
+        """
+        _require_numpy("Easy-draw tables")
+        syringes = list(SYRINGE_GRADUATIONS) if syringes is None else syringes
+        unknown = [key for key in syringes if key not in SYRINGE_GRADUATIONS]
+        if unknown:
+            raise ValidationError(f"Unknown syringe graduation: {', '.join(unknown)}")
+        concentrations = np.atleast_1d(np.asarray(concentrations, dtype=float))
+        if np.any(concentrations <= 0) or vial_size <= 0 or dead_space_ml < 0 or round_step_mg <= 0:
+            raise ValidationError("Concentrations, vial size and round step must be positive")
+
+        marks = [np.round(np.arange(1, int(round(spec['capacity_ml'] / spec['step_ml'])) + 1) * spec['step_ml'], 6)
+                 for spec in (SYRINGE_GRADUATIONS[key] for key in syringes)]
+        volume_ml = np.concatenate(marks)
+        syringe = np.repeat(np.array(syringes), [len(m) for m in marks])
+
+        dose_mg = concentrations[:, None] * volume_ml[None, :]
+        in_range = (dose_mg >= dose_range[0]) & (dose_mg <= dose_range[1])
+        steps = dose_mg / round_step_mg
+        nearest = np.rint(steps)
+        is_round = in_range & (np.abs(steps - nearest) < 1e-6)
+
+        # Distinct round doses per concentration, regardless of which syringe reaches them
+        rows, cols = np.nonzero(is_round)
+        reached = np.zeros((len(concentrations), int(dose_range[1] / round_step_mg) + 1), dtype=bool)
+        reached[rows, nearest[rows, cols].astype(np.intp)] = True
+        round_count = reached.sum(axis=1)
+
+        return {'concentration': concentrations, 'volume_ml': volume_ml, 'syringe': syringe, 'dose_mg': dose_mg,
+                'in_range': in_range, 'is_round': is_round,
+                'doses_per_vial': np.floor(vial_size / (volume_ml + dead_space_ml) + 1e-9).astype(np.int64),
+                'round_count': round_count, 'best_concentration': float(concentrations[np.argmax(round_count)])}
+
     def explore_solubility_options(self, ester: Dict, concentration: float) -> Dict:
         results = {}
         print("\n=== SOLUBILITY EXPLORATION ===")
@@ -733,12 +3028,12 @@ class CompoundMeMommyCalculator:
             if oil_key == 'custom':
                 continue
             try:
-                max_solubility, explanation = self.calculate_dynamic_solubility_limit(ester, oil_key, 0.0, concentration)
+                max_solubility = self.solubility_limit(ester, oil_key, 0.0)
                 status = self.assess_solubility_status(concentration, max_solubility)
                 results[oil_key] = {'oil_name': oil_data['name'], 'max_solubility_no_bb': max_solubility, 'status_no_bb': status}
                 print(f"{oil_data['name']:15} (No BB): {max_solubility:.0f}mg/mL max - {status}")
 
-                max_with_bb, _ = self.calculate_dynamic_solubility_limit(ester, oil_key, 15.0, concentration)
+                max_with_bb = self.solubility_limit(ester, oil_key, 15.0)
                 status_bb = self.assess_solubility_status(concentration, max_with_bb)
                 results[oil_key]['max_solubility_with_bb'] = max_with_bb
                 results[oil_key]['status_with_bb'] = status_bb
@@ -783,13 +3078,14 @@ class CompoundMeMommyCalculator:
             print("1. New Injectable Formulation")
             print("2. New Transdermal Spray")
             print("3. Load Saved Recipe")
-            print("4. View/Manage PDFs" + (" (Available)" if PDF_AVAILABLE else " (Unavailable)"))
-            print("5. Help & Settings")
-            print("6. Quit")
+            print("4. Search Recipes")
+            print("5. View/Manage PDFs" + (" (Available)" if PDF_AVAILABLE else " (Unavailable)"))
+            print("6. Help & Settings")
+            print("7. Quit")
 
-            choice = self.get_input_with_navigation("Select option [1-6]: ", str)
+            choice = self.get_input_with_navigation("Select option [1-7]: ", str)
 
-            if choice == 'QUIT' or choice == '6':
+            if choice == 'QUIT' or choice == '7':
                 return 'QUIT'
             elif choice == '1':
                 return 'NEW_INJECTABLE'
@@ -797,15 +3093,17 @@ class CompoundMeMommyCalculator:
                 return 'NEW_SPRAY'
             elif choice == '3':
                 return 'LOAD_RECIPE'
-            elif choice == '4' and PDF_AVAILABLE:
+            elif choice == '4':
+                return 'SEARCH_RECIPES'
+            elif choice == '5' and PDF_AVAILABLE:
                 return 'MANAGE_PDFS'
-            elif choice == '5':
+            elif choice == '6':
                 self.display_help()
             else:
-                if choice == '4' and not PDF_AVAILABLE:
+                if choice == '5' and not PDF_AVAILABLE:
                     print("[ERROR] PDF features require matplotlib.")
                 else:
-                    print("[ERROR] Please enter 1-6")
+                    print("[ERROR] Please enter 1-7")
 
     def reprint_results_menu(self, formulation_type='injectable'):
         """Helper method to reprint results menu clearly"""
@@ -841,17 +3139,17 @@ class CompoundMeMommyCalculator:
         print()
 
         try:
-            max_no_bb, explanation_no_bb = self.calculate_dynamic_solubility_limit(ester, oil_key, 0.0, concentration)
+            max_no_bb = self.solubility_limit(ester, oil_key, 0.0)
             status_no_bb = self.assess_solubility_status(concentration, max_no_bb)
             print(f"Without Benzyl Benzoate: {max_no_bb:.0f}mg/mL max - {status_no_bb}")
 
-            max_with_bb, explanation_with_bb = self.calculate_dynamic_solubility_limit(ester, oil_key, 15.0, concentration)
+            max_with_bb = self.solubility_limit(ester, oil_key, 15.0)
             status_with_bb = self.assess_solubility_status(concentration, max_with_bb)
             print(f"With 15% Benzyl Benzoate: {max_with_bb:.0f}mg/mL max - {status_with_bb}")
 
             print()
             print("Scientific Analysis:")
-            print(explanation_no_bb)
+            print(self.format_solubility_explanation(ester, oil_key, 0.0, concentration))
 
         except Exception as e:
             print(f"Error in solubility analysis: {e}")
@@ -872,10 +3170,16 @@ class CompoundMeMommyCalculator:
             if loss_modifier in ['QUIT', 'BACK']:
                 return loss_modifier
 
+            sprays_per_day = self.get_input_with_navigation("Sprays per day for exposure estimate (0 to skip, default 0): ", int, 0, 0, 20)
+            if sprays_per_day in ['QUIT', 'BACK']:
+                return sprays_per_day
+
             self.config_state.update({
                 'total_volume': volume, 'loss_modifier': loss_modifier,
                 'ester_key': 'estradiol_spray', 'ester': self.esters['estradiol_spray']
             })
+            if sprays_per_day > 0:
+                self.config_state['spray_regimen'] = {'sprays_per_day': sprays_per_day, 'ml_per_actuation': SPRAY_ACTUATION_ML}
 
         else:  # Injectable
             print("\n=== INJECTABLE FORMULATION ===")
@@ -1028,14 +3332,20 @@ class CompoundMeMommyCalculator:
                     print("\nProceeding with 0% benzyl alcohol - USE IMMEDIATELY ONLY")
                     ba_percent = 0.0
 
-        max_solubility, explanation = self.calculate_dynamic_solubility_limit(ester, oil_key, 0.0, concentration)
+        max_solubility = self.solubility_limit(ester, oil_key, 0.0)
         status = self.assess_solubility_status(concentration, max_solubility)
 
         print(f"\nCurrent solubility status: {status}")
-        print(explanation)
+        print(self.format_solubility_explanation(ester, oil_key, 0.0, concentration))
 
         if status in ['Marginal', 'High Risk']:
-            bb_default = 15.0
+            bb_needed = self.minimum_bb_percent(ester, oil_key, concentration, "Good")
+            if bb_needed is None:
+                print(f"Good solubility is not reachable within {BB_PERCENT_MIN:g}-{BB_PERCENT_MAX:g}% benzyl benzoate")
+                bb_default = BB_PERCENT_MAX
+            else:
+                print(f"Minimum benzyl benzoate for Good solubility: {bb_needed:g}%")
+                bb_default = bb_needed
         else:
             bb_default = 0.0
 
@@ -1044,7 +3354,7 @@ class CompoundMeMommyCalculator:
             return ba_percent, use_bb
 
         if use_bb.startswith('y'):
-            bb_percent = self.get_input_with_navigation(f"Benzyl benzoate percentage (5-25%, default {bb_default}): ", float, bb_default, 5.0, 25.0)
+            bb_percent = self.get_input_with_navigation(f"Benzyl benzoate percentage (5-25%, default {bb_default}): ", float, bb_default, BB_PERCENT_MIN, BB_PERCENT_MAX)
             if bb_percent in ['QUIT', 'BACK']:
                 return ba_percent, bb_percent
         else:
@@ -1096,7 +3406,12 @@ class CompoundMeMommyCalculator:
                 return 'NEW_FORMULATION'
             elif choice == '3' and PDF_AVAILABLE:
                 try:
-                    pdf_path = self.generate_pdf_worksheet(formulation)
+                    expected_levels = False
+                    if formulation_type == 'injectable':
+                        include_levels = self.get_input_with_navigation(
+                            "Add expected levels page? (y/n): ", str, 'n')
+                        expected_levels = include_levels.startswith('y')
+                    pdf_path = self.generate_pdf_worksheet(formulation, expected_levels=expected_levels)
                     print(f"\nPDF generated: {os.path.basename(pdf_path)}")
 
                     view_pdf = self.get_input_with_navigation("View PDF now? (y/n): ", str, 'y')
@@ -1152,6 +3467,15 @@ class CompoundMeMommyCalculator:
         print(f"{'Polysorbate 80':30} {calc.get('polysorbate_80_g', 0):12.3f} {calc.get('polysorbate_80_ml', 0):12.2f}")
         print("-" * 70)
 
+        if 'daily_absorbed_mg' in calc:
+            print()
+            print("EXPECTED EXPOSURE:")
+            print("-" * 50)
+            print(f"Daily spray volume: {calc['daily_spray_volume_ml']:.2f}mL")
+            print(f"Estradiol applied: {calc['daily_applied_mg']:.2f}mg/day")
+            print(f"Estradiol absorbed: {calc['daily_absorbed_mg']:.2f}mg/day")
+            print(f"Bottle lasts: {calc['bottle_duration_days']:.0f} days")
+
     def _display_injectable_results(self, formulation: Dict):
         config = formulation['config']
         calc = formulation['calculations']
@@ -1181,13 +3505,34 @@ class CompoundMeMommyCalculator:
         print(f"{oil_name:25} {calc['oil_volume_ml']:12.2f} {'mL':12}")
         print("-" * 55)
 
+        solubility_explanation, solubility_status, solubility_ascii = self._solubility_presentation(config, calc)
         print("\nSOLUBILITY ASSESSMENT:")
         print("-" * 50)
-        print(calc['solubility_explanation'])
-        print(f"Safety Status: {calc['solubility_status']}")
+        print(solubility_explanation)
+        print(f"Safety Status: {solubility_status}")
 
-        if calc.get('solubility_ascii'):
-            print(calc['solubility_ascii'])
+        if solubility_ascii:
+            print(solubility_ascii)
+
+    def _solubility_presentation(self, config: Dict, calc: Dict) -> Tuple[str, str, str]:
+        """Explanation, status label and ASCII bar, rendered now if the result is lean"""
+        concentration = config.get('concentration', 0)
+        estimated_max = calc.get('estimated_max_solubility', 1000.0)
+
+        if 'solubility_explanation' in calc:
+            explanation = calc['solubility_explanation']
+        else:
+            explanation = self.format_solubility_explanation(
+                config.get('ester', {}), config.get('oil_key', 'sesame_oil'), config.get('bb_percent', 0.0), concentration)
+        if 'solubility_status' in calc:
+            status = calc['solubility_status']
+        else:
+            status = SOLUBILITY_STATUS_LABELS[calc.get('solubility_status_code', SOLUBILITY_STATUS_UNKNOWN)]
+        if 'solubility_ascii' in calc:
+            ascii_bar = calc['solubility_ascii']
+        else:
+            ascii_bar = self.generate_solubility_ascii(concentration, estimated_max)
+        return explanation, status, ascii_bar
 
     def run(self):
         try:
@@ -1228,15 +3573,22 @@ class CompoundMeMommyCalculator:
                             break
                     elif action == 'LOAD_RECIPE':
                         try:
-                            recipes = self.list_recipes()
+                            summaries = self.recipe_summaries()
+                            recipes = summaries['filename']
                             if not recipes:
                                 print("\nNo saved recipes found.")
                                 continue
 
                             print("\nSaved recipes:")
-                            for i, filename in enumerate(recipes, 1):
+                            for i, (filename, ester_key, concentration, total_volume) in enumerate(zip(
+                                    recipes, summaries['ester_key'], summaries['concentration'], summaries['total_volume']), 1):
                                 recipe_name = filename.replace('.json', '')
-                                print(f"{i}. {recipe_name}")
+                                details = [ester_key or '?']
+                                if isinstance(concentration, (int, float)):
+                                    details.append(f"{concentration:g}mg/mL")
+                                if isinstance(total_volume, (int, float)):
+                                    details.append(f"{total_volume:g}mL")
+                                print(f"{i}. {recipe_name} ({', '.join(details)})")
 
                             choice = self.get_input_with_navigation(f"Select recipe [1-{len(recipes)}]: ", int)
                             if choice in ['QUIT', 'BACK'] or choice < 1 or choice > len(recipes):
@@ -1251,6 +3603,16 @@ class CompoundMeMommyCalculator:
                         except Exception as e:
                             print(f"\nLoad error: {e}")
                             input("Press Enter to continue...")
+                    elif action == 'SEARCH_RECIPES':
+                        try:
+                            formulation = self.search_recipes_menu()
+                            if formulation == 'QUIT':
+                                break
+                            if formulation is not None and self.display_results(formulation) == 'QUIT':
+                                break
+                        except Exception as e:
+                            print(f"\nSearch error: {e}")
+                            input("Press Enter to continue...")
                     elif action == 'MANAGE_PDFS':
                         print("\n=== PDF MANAGEMENT ===")
                         print("1. List PDFs")
@@ -1304,7 +3666,35 @@ class CompoundMeMommyCalculator:
         finally:
             print("\ncum back next time, cat hair free since 2025")
 
+def run_command(argv: List[str]) -> int:
+    """Non-interactive maintenance commands: cmm dedupe [--dry-run], cmm migrate [--dir DIR] [--dry-run]"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='cmm', description="CompoundMeMommy maintenance commands")
+    commands = parser.add_subparsers(dest='command', required=True)
+    dedupe = commands.add_parser('dedupe', help="Store identical recipes once and replace copies with aliases")
+    dedupe.add_argument('--dry-run', action='store_true', help="Report the savings without writing anything")
+    migrate = commands.add_parser('migrate', help="Rewrite v1 recipes as v2 (ester/oil keys instead of copies)")
+    migrate.add_argument('--dir', help="Recipe directory (default: the saved recipes directory)")
+    migrate.add_argument('--dry-run', action='store_true', help="Report what would change without writing anything")
+    args = parser.parse_args(argv)
+
+    calculator = CompoundMeMommyCalculator()
+    if args.command == 'dedupe':
+        report = calculator.dedupe_recipes(dry_run=args.dry_run)
+        print(f"{'Would convert' if args.dry_run else 'Converted'} {report['converted']} of {report['recipes']} "
+              f"recipes ({report['blobs_created']} new blobs)")
+        print(f"Space: {report['bytes_before']} -> {report['bytes_after']} bytes "
+              f"({report['bytes_saved']} bytes saved)")
+    elif args.command == 'migrate':
+        report = calculator.migrate_recipes(args.dir, dry_run=args.dry_run)
+        print(f"{'Would migrate' if args.dry_run else 'Migrated'} {report['migrated']} of {report['files']} "
+              f"recipe files to format v{RECIPE_FORMAT_VERSION} ({report['errors']} unreadable)")
+        print(f"Migrated files: {report['bytes_before']} -> {report['bytes_after']} bytes")
+    return 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
     try:
         calculator = CompoundMeMommyCalculator()
         calculator.run()
@@ -29,9 +29,9 @@ else
 fi
 
 if [[ -n "$VIRTUAL_ENV" ]] || [[ $EUID -eq 0 ]]; then
-    ${PIP_CMD} install matplotlib pytest
+    ${PIP_CMD} install numpy matplotlib pytest
 else
-    ${PIP_CMD} install --user matplotlib pytest
+    ${PIP_CMD} install --user numpy matplotlib pytest
 fi
 
 echo "Installing CompoundMeMommy v1.2.4 (Comprehensive Corrections)..."
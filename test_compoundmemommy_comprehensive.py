@@ -18,7 +18,13 @@ import json
 from typing import Dict, Any
 
 sys.path.insert(0, os.path.dirname(__file__))
-from compoundmemommy_calculator import CompoundMeMommyCalculator, ValidationError
+from compoundmemommy_calculator import CompoundMeMommyCalculator, ValidationError, NUMPY_AVAILABLE, PDF_AVAILABLE
+import compoundmemommy_calculator as cmm
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+requires_numpy = pytest.mark.skipif(not NUMPY_AVAILABLE, reason="numpy not installed")
 
 # PHARMACEUTICAL REFERENCE DATA (verified from literature)
 PHARMACEUTICAL_DATA = {
@@ -362,6 +368,35 @@ class TestSprayFormulation:
         expected_total = 120.0 - calc.get('estradiol_volume_displaced_ml', 0)
         assert abs(total_component_vol - expected_total) < 0.1
 
+    def test_spray_regimen_exposure_fields(self):
+        """A spray regimen adds expected exposure to the results and JSON"""
+        config = {
+            'formulation_type': 'spray',
+            'ester_key': 'estradiol_spray',
+            'ester': self.calculator.esters['estradiol_spray'],
+            'total_volume': 120.0,
+            'loss_modifier': 0.0
+        }
+        plain = self.calculator.calculate_spray_formulation(config)['spray_calculations']
+        assert 'daily_absorbed_mg' not in plain and 'daily_absorbed_mg' not in json.loads(json.dumps(plain))
+
+        config['spray_regimen'] = {'sprays_per_day': 2, 'ml_per_actuation': 0.1}
+        calc = json.loads(json.dumps(self.calculator.calculate_spray_formulation(config)))['spray_calculations']
+        assert calc['daily_spray_volume_ml'] == pytest.approx(0.2)
+        assert calc['daily_applied_mg'] == pytest.approx(0.2 * 58.33)
+        assert calc['daily_absorbed_mg'] == pytest.approx(0.2 * 58.33 * 0.12)
+        assert calc['bottle_duration_days'] == pytest.approx(600.0)
+
+    @requires_numpy
+    def test_vectorized_exposure_matches_recipe(self):
+        """Many regimens at once agree with the per-recipe fields"""
+        exposure = self.calculator.calculate_spray_exposure(np.arange(1, 5), [[0.1], [0.14]])
+        assert exposure['daily_absorbed_mg'].shape == (2, 4)
+        assert exposure['daily_absorbed_mg'][0, 1] == pytest.approx(0.2 * 58.33 * 0.12)
+        assert exposure['bottle_duration_days'][1, 0] == pytest.approx(120.0 / 0.14)
+        with pytest.raises(ValidationError):
+            self.calculator.calculate_spray_exposure(0)
+
 class TestSolubilityCalculations:
     """Test solubility analysis calculations"""
 
@@ -434,6 +469,1213 @@ class TestRegressionTests:
         finally:
             os.unlink(temp_path)
 
+@requires_numpy
+class TestBatchFormulation:
+    """Test the vectorized batch API against the scalar calculation"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def test_batch_matches_scalar(self):
+        """Every batch row should equal calculate_formulation for the same config"""
+        rows = [
+            (40.0, 10.0, 10.0, 2.0, 0.0, 'estradiol_valerate', 'sesame_oil'),
+            (30.0, 20.0, 5.0, 2.0, 10.0, 'estradiol_valerate', 'mct_oil'),
+            (250.0, 10.0, 20.0, 3.0, 12.0, 'testosterone_cypionate', 'castor_oil'),
+            (200.0, 10.0, 10.0, 2.0, 0.0, 'testosterone_enanthate', 'olive_oil'),
+            (70.0, 5.0, 0.0, 1.0, 25.0, 'estradiol_undecylate', 'grapeseed_oil'),
+        ]
+        columns = list(zip(*rows))
+        batch = self.calculator.calculate_formulation_batch(*columns)
+        assert not batch['error_mask'].any()
+
+        for i, (conc, vol, loss, ba, bb, ester_key, oil_key) in enumerate(rows):
+            calc = self.calculator.calculate_formulation({
+                'ester_key': ester_key, 'ester': self.calculator.esters[ester_key],
+                'oil_key': oil_key, 'oil': self.calculator.carrier_oils[oil_key],
+                'concentration': conc, 'total_volume': vol, 'loss_modifier': loss,
+                'ba_percent': ba, 'bb_percent': bb
+            })['calculations']
+            for field in ('adjusted_volume_ml', 'api_mass_g', 'api_volume_displaced_ml', 'ba_volume_ml', 'ba_mass_g',
+                          'bb_volume_ml', 'bb_mass_g', 'oil_volume_ml', 'oil_mass_g', 'estimated_max_solubility'):
+                assert batch[field][i] == pytest.approx(calc[field], rel=1e-12), field
+            status = cmm.SOLUBILITY_STATUS_LABELS[batch['solubility_status_code'][i]]
+            assert status == calc['solubility_status']
+
+    def test_batch_error_mask(self):
+        """Invalid rows are flagged instead of raising"""
+        batch = self.calculator.calculate_formulation_batch(
+            [40.0, 1000.0, 40.0, -5.0], [10.0, 1.0, 10.0, 10.0], 10.0, [2.0, 5.0, 2.0, 2.0], [0.0, 25.0, 0.0, 0.0],
+            ['estradiol_valerate', 'estradiol_valerate', 'not_an_ester', 'estradiol_valerate'], 'sesame_oil')
+
+        assert batch['error_mask'].tolist() == [False, True, True, True]
+        assert batch['error_code'].tolist() == [cmm.BATCH_OK, cmm.BATCH_NEGATIVE_OIL_VOLUME,
+                                                cmm.BATCH_UNKNOWN_KEY, cmm.BATCH_INVALID_INPUT]
+
+@requires_numpy
+class TestCompiledDatabase:
+    """Test the struct-of-arrays ester/oil database"""
+
+    def test_database_per_instance_and_read_only(self):
+        """Each calculator owns its tables; the compiled view is read-only and shared by value"""
+        first, second = CompoundMeMommyCalculator(), CompoundMeMommyCalculator()
+        assert first.esters is not second.esters
+        assert first.database is first.database and first.database == second.database
+
+        with pytest.raises(ValueError):
+            first.database.density[0] = 2.0
+
+        first.esters['estradiol_valerate']['density'] = 2.0
+        first.invalidate_caches()
+        i = first.database.ester_index['estradiol_valerate']
+        assert first.database.density[i] == 2.0 and second.database.density[i] == 1.102
+        assert cmm.ESTER_DATABASE['estradiol_valerate']['density'] == 1.102
+        assert first.database != second.database
+
+    def test_arrays_match_ester_tables(self):
+        """Every compiled column matches the source dictionaries"""
+        calculator = CompoundMeMommyCalculator()
+        db = calculator.database
+        for ester_key, ref_data in PHARMACEUTICAL_DATA.items():
+            i = db.ester_index[ester_key]
+            assert db.molecular_weight[i] == ref_data['mw']
+            assert db.density[i] == ref_data['density']
+            for oil_key in CARRIER_OILS:
+                j = db.oil_index[oil_key]
+                assert db.base_solubility[i, j] == calculator.esters[ester_key]['base_solubility'][oil_key]
+                assert db.oil_density[j] == CARRIER_OILS[oil_key]
+        assert not db.has_solubility[db.ester_index['estradiol_spray']]
+
+    def test_copied_ester_uses_dict_path(self):
+        """Copies of ester entries (e.g. loaded recipes) give identical results"""
+        calculator = CompoundMeMommyCalculator()
+        ester = calculator.esters['testosterone_enanthate']
+        copy = json.loads(json.dumps(ester))
+        assert calculator.database.find_ester(copy) is None
+        assert (calculator.calculate_dynamic_solubility_limit(ester, 'mct_oil', 10.0, 200.0) ==
+                calculator.calculate_dynamic_solubility_limit(copy, 'mct_oil', 10.0, 200.0))
+
+class TestSolubilityCache:
+    """Test memoization of the solubility limit"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.calculator.invalidate_solubility_cache()
+
+    def test_repeated_lookups_hit_cache(self):
+        """Repeated (ester, oil, BB%) lookups are served from the cache"""
+        ester = self.calculator.esters['estradiol_enanthate']
+        first = self.calculator.solubility_limit(ester, 'castor_oil', 15.0)
+        second = self.calculator.solubility_limit(ester, 'castor_oil', 15.0)
+
+        info = self.calculator.solubility_cache_info()
+        assert first == second
+        assert (info.hits, info.misses) == (1, 1)
+
+    def test_invalidation_picks_up_table_changes(self):
+        """Changing the ester table takes effect after invalidation"""
+        ester = self.calculator.esters['estradiol_valerate']
+        before = self.calculator.solubility_limit(ester, 'sesame_oil', 0.0)
+        original = ester['base_solubility']['sesame_oil']
+        try:
+            ester['base_solubility']['sesame_oil'] = original * 2
+            self.calculator.invalidate_solubility_cache()
+            assert self.calculator.solubility_limit(ester, 'sesame_oil', 0.0) == before * 2
+        finally:
+            ester['base_solubility']['sesame_oil'] = original
+            self.calculator.invalidate_solubility_cache()
+
+    def test_explanation_rendered_separately(self):
+        """The cached number agrees with the rendered explanation"""
+        ester = self.calculator.esters['testosterone_cypionate']
+        max_sol, explanation = self.calculator.calculate_dynamic_solubility_limit(ester, 'mct_oil', 10.0, 250.0)
+        assert max_sol == self.calculator.solubility_limit(ester, 'mct_oil', 10.0)
+        assert explanation == self.calculator.format_solubility_explanation(ester, 'mct_oil', 10.0, 250.0)
+        assert "Database 250mg/mL -> Oil 1.10x -> BB 1.25x" in explanation
+
+@requires_numpy
+class TestSolubilityGrid:
+    """Test the precomputed solubility grid"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.grid = self.calculator.solubility_grid()
+
+    def test_grid_points_match_scalar(self):
+        """Every grid point equals calculate_dynamic_solubility_limit exactly"""
+        db = self.calculator.database
+        for i, ester_key in enumerate(db.ester_keys):
+            ester = self.calculator.esters[ester_key]
+            for j, oil_key in enumerate(db.oil_keys):
+                expected = [self.calculator.calculate_dynamic_solubility_limit(ester, oil_key, bb, 0.0)[0]
+                            for bb in self.grid.bb_values]
+                assert self.grid.table[i, j].tolist() == expected
+                assert self.grid.max_solubility(i, j, self.grid.bb_values).tolist() == expected
+
+    def test_interpolation_and_status(self):
+        """Off-grid lookups interpolate and status codes agree with the scalar assessment"""
+        db = self.calculator.database
+        i, j = db.ester_index['testosterone_enanthate'], db.oil_index['sesame_oil']
+        ester = self.calculator.esters['testosterone_enanthate']
+        bb = np.array([0.05, 7.33, 12.5, 29.99])
+        expected = [self.calculator.solubility_limit(ester, 'sesame_oil', b) for b in bb[1:]]
+        assert self.grid.max_solubility(i, j, bb)[1:] == pytest.approx(expected, rel=1e-12)
+
+        concentrations = np.array([150.0, 250.0, 300.0, 400.0])
+        codes = self.grid.status_code(i, j, 10.0, concentrations)
+        max_sol = self.calculator.solubility_limit(ester, 'sesame_oil', 10.0)
+        assert [cmm.SOLUBILITY_STATUS_LABELS[c] for c in codes] == [
+            self.calculator.assess_solubility_status(c, max_sol) for c in concentrations]
+
+    def test_unknown_index_is_nan(self):
+        """An index of -1 does not wrap around to the last ester or oil"""
+        values = self.grid.max_solubility([0, -1, 0], [0, 0, -1], 10.0)
+        assert not np.isnan(values[0]) and np.isnan(values[1:]).all()
+        assert self.grid.status_code(-1, 0, 10.0, 100.0) == cmm.SOLUBILITY_STATUS_UNKNOWN
+
+class TestLeanResults:
+    """Test the headless lean result mode"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.config = {
+            'formulation_type': 'injectable',
+            'ester_key': 'testosterone_cypionate',
+            'ester': self.calculator.esters['testosterone_cypionate'],
+            'total_volume': 10.0,
+            'loss_modifier': 10.0,
+            'concentration': 250.0,
+            'oil_key': 'sesame_oil',
+            'oil': self.calculator.carrier_oils['sesame_oil'],
+            'ba_percent': 2.0,
+            'bb_percent': 5.0
+        }
+
+    def test_lean_matches_full_numbers(self):
+        """Lean results carry the same numbers and a compact status code"""
+        full = self.calculator.calculate_formulation(self.config)['calculations']
+        lean = self.calculator.calculate_formulation(self.config, lean=True)
+
+        assert 'solubility_ascii' not in lean and 'solubility_explanation' not in lean
+        for field, value in lean.items():
+            if field != 'solubility_status_code':
+                assert value == full[field]
+        assert cmm.SOLUBILITY_STATUS_LABELS[lean['solubility_status_code']] == full['solubility_status']
+
+    def test_presentation_rendered_on_demand(self):
+        """The display layer renders the same strings for lean results"""
+        full = self.calculator.calculate_formulation(self.config)['calculations']
+        lean = self.calculator.calculate_formulation(self.config, lean=True)
+
+        assert self.calculator._solubility_presentation(self.config, lean) == (
+            full['solubility_explanation'], full['solubility_status'], full['solubility_ascii'])
+
+class TestLazyFormulationResult:
+    """Test the lazily computed formulation result object"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.config = {
+            'formulation_type': 'injectable',
+            'ester_key': 'estradiol_enanthate',
+            'ester': self.calculator.esters['estradiol_enanthate'],
+            'total_volume': 10.0,
+            'loss_modifier': 10.0,
+            'concentration': 60.0,
+            'oil_key': 'castor_oil',
+            'oil': self.calculator.carrier_oils['castor_oil'],
+            'ba_percent': 2.0,
+            'bb_percent': 10.0
+        }
+
+    def test_derived_fields_computed_on_access(self):
+        """Presentation fields are not built until read"""
+        calc = self.calculator.calculate_formulation(self.config)['calculations']
+        assert not dict.__contains__(calc, 'solubility_ascii')
+        assert 'solubility_ascii' in calc
+        assert calc['solubility_ascii'] is calc['solubility_ascii']
+        assert dict.__contains__(calc, 'solubility_ascii')
+
+    def test_serializes_to_legacy_shape(self):
+        """JSON output has the same keys, order and values as the eager result dict"""
+        result = self.calculator.calculate_formulation(self.config)
+        lean = self.calculator.calculate_formulation(self.config, lean=True)
+        explanation, status, ascii_bar = self.calculator._solubility_presentation(self.config, lean)
+
+        data = json.loads(json.dumps(result))
+        assert list(data) == ['config', 'calculations', 'metadata']
+        assert list(data['calculations']) == list(cmm.InjectableCalculations.FIELDS)
+        expected = {k: v for k, v in lean.items() if k != 'solubility_status_code'}
+        expected.update(solubility_explanation=explanation, solubility_status=status, solubility_ascii=ascii_bar)
+        assert data['calculations'] == expected
+        assert json.dumps(result, indent=2) == json.dumps(result.to_dict(), indent=2)
+
+    def test_spray_serializes_to_legacy_shape(self):
+        """Spray calculations keep their key order with component volumes before masses"""
+        result = self.calculator.calculate_spray_formulation({
+            'formulation_type': 'spray', 'ester_key': 'estradiol_spray',
+            'ester': self.calculator.esters['estradiol_spray'], 'total_volume': 120.0, 'loss_modifier': 0.0})
+        keys = list(json.loads(json.dumps(result))['spray_calculations'])
+        components = list(self.calculator.esters['estradiol_spray']['spray_components'])
+        assert keys == (list(cmm.SprayCalculations.FIELDS) + [f"{c}_ml" for c in components] +
+                        [f"{c}_g" for c in components])
+
+class TestMinimumBenzylBenzoate:
+    """Test the analytic minimum benzyl benzoate solver"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def _rank(self, ester, oil_key, bb, concentration):
+        max_sol = self.calculator.solubility_limit(ester, oil_key, bb)
+        return cmm.SOLUBILITY_STATUS_LABELS.index(self.calculator.assess_solubility_status(concentration, max_sol))
+
+    @pytest.mark.parametrize("target", ["Excellent", "Good"])
+    def test_solution_is_minimal(self, target):
+        """The returned BB% reaches the target and one step less does not"""
+        target_rank = cmm.SOLUBILITY_STATUS_LABELS.index(target)
+        ester = self.calculator.esters['testosterone_cypionate']
+        for concentration in range(150, 420, 7):
+            bb = self.calculator.minimum_bb_percent(ester, 'sesame_oil', concentration, target)
+            if bb is None:
+                assert self._rank(ester, 'sesame_oil', cmm.BB_PERCENT_MAX, concentration) > target_rank
+                continue
+            assert self._rank(ester, 'sesame_oil', bb, concentration) <= target_rank
+            if bb > cmm.BB_PERCENT_MIN:
+                assert self._rank(ester, 'sesame_oil', bb - 0.1, concentration) > target_rank
+            elif bb == 0.0:
+                assert self._rank(ester, 'sesame_oil', 0.0, concentration) <= target_rank
+
+    @requires_numpy
+    def test_batch_matches_scalar(self):
+        """The vectorized solver agrees with the scalar one, NaN for unreachable targets"""
+        concentrations = np.linspace(20, 120, 101)
+        for ester_key in ('estradiol_valerate', 'estradiol_undecylate'):
+            batch = self.calculator.minimum_bb_percent_batch(ester_key, 'olive_oil', concentrations, "Good")
+            for concentration, bb in zip(concentrations, batch):
+                expected = self.calculator.minimum_bb_percent(
+                    self.calculator.esters[ester_key], 'olive_oil', concentration, "Good")
+                assert (np.isnan(bb) and expected is None) or bb == expected
+
+    def test_invalid_target(self):
+        """Only achievable statuses are accepted"""
+        with pytest.raises(ValidationError):
+            self.calculator.minimum_bb_percent(self.calculator.esters['estradiol_valerate'], 'sesame_oil', 50, "High Risk")
+
+@requires_numpy
+class TestFormulationSweep:
+    """Test the streaming design-space sweep"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.axes = ([40.0, 1000.0], ['estradiol_valerate', 'testosterone_cypionate'], ['sesame_oil', 'mct_oil'],
+                     [2.0, 4.0, 6.0], [0.0, 25.0, 35.0])
+
+    def test_records_cover_product_with_flags(self):
+        """Records enumerate every combination and flag failures instead of raising"""
+        records = list(self.calculator.sweep(*self.axes))
+        assert len(records) == 2 * 2 * 2 * 3 * 3
+
+        for record in records:
+            verdict = self.calculator.validate_ingredient_compatibility(
+                record['ester_key'], record['oil_key'], record['bb_percent'], record['ba_percent'])
+            assert record['compatible'] == verdict['valid']
+            assert record['compatibility_warning'] == (verdict['valid'] and bool(verdict['warnings']))
+            config = {'ester_key': record['ester_key'], 'ester': self.calculator.esters[record['ester_key']],
+                      'oil_key': record['oil_key'], 'oil': self.calculator.carrier_oils[record['oil_key']],
+                      'concentration': record['concentration'], 'total_volume': 10.0, 'loss_modifier': 10.0,
+                      'ba_percent': record['ba_percent'], 'bb_percent': record['bb_percent']}
+            if record['negative_oil_volume']:
+                with pytest.raises(ValidationError, match="Negative oil volume"):
+                    self.calculator.calculate_formulation(config)
+            else:
+                calc = self.calculator.calculate_formulation(config)['calculations']
+                assert record['oil_volume_ml'] == pytest.approx(calc['oil_volume_ml'])
+                assert record['solubility_status'] == calc['solubility_status']
+
+    def test_chunks_and_writers(self, tmp_path):
+        """Chunked output matches records and streams to CSV and JSONL"""
+        records = list(self.calculator.sweep(*self.axes))
+        chunks = list(self.calculator.sweep(*self.axes, chunk_size=10))
+        assert [len(chunk['concentration']) for chunk in chunks] == [10, 10, 10, 10, 10, 10, 10, 2]
+        assert list(cmm._sweep_rows(chunks)) == records
+
+        csv_path, jsonl_path = str(tmp_path / "sweep.csv"), str(tmp_path / "sweep.jsonl")
+        assert cmm.write_sweep(self.calculator.sweep(*self.axes, chunk_size=7), csv_path) == len(records)
+        assert cmm.write_sweep(self.calculator.sweep(*self.axes), jsonl_path) == len(records)
+        with open(jsonl_path) as f:
+            assert [json.loads(line) for line in f] == records
+        with open(csv_path) as f:
+            assert f.readline().strip().split(',') == list(cmm.SWEEP_FIELDS)
+
+@requires_numpy
+class TestParallelSweep:
+    """Test the process-pool sweep executor"""
+
+    def test_parallel_matches_serial_order(self):
+        """Chunks come back in sweep order with the same values as the serial sweep"""
+        calculator = CompoundMeMommyCalculator()
+        axes = (np.arange(20.0, 420.0, 20.0), ['estradiol_valerate', 'testosterone_decanoate'], ['sesame_oil', 'castor_oil'],
+                [1.0, 2.0, 6.0], [0.0, 10.0, 20.0])
+        serial = list(calculator.sweep(*axes, chunk_size=50))
+        parallel = list(calculator.parallel_sweep(*axes, workers=2, chunk_size=50))
+
+        assert len(parallel) == len(serial)
+        for expected, actual in zip(serial, parallel):
+            assert list(actual) == list(expected)
+            for field in expected:
+                assert np.array_equal(expected[field], actual[field]), field
+
+@requires_numpy
+class TestMonteCarlo:
+    """Test Monte Carlo uncertainty propagation"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.config = {
+            'formulation_type': 'injectable',
+            'ester_key': 'testosterone_enanthate',
+            'ester': self.calculator.esters['testosterone_enanthate'],
+            'total_volume': 10.0,
+            'loss_modifier': 10.0,
+            'concentration': 250.0,
+            'oil_key': 'mct_oil',
+            'oil': self.calculator.carrier_oils['mct_oil'],
+            'ba_percent': 2.0,
+            'bb_percent': 10.0
+        }
+
+    def test_zero_tolerance_reproduces_nominal(self):
+        """Without perturbation every sample equals the planned formulation"""
+        zero = {key: 0.0 for key in cmm.MONTE_CARLO_TOLERANCES}
+        report = self.calculator.monte_carlo_formulation(self.config, n_samples=1000, seed=1, tolerances=zero)
+        calc = self.calculator.calculate_formulation(self.config)['calculations']
+
+        assert report['achieved_concentration']['mean'] == pytest.approx(250.0, rel=1e-12)
+        assert report['solubility_ratio']['p95'] == pytest.approx(250.0 / calc['estimated_max_solubility'], rel=1e-9)
+        assert report['status_probabilities'][calc['solubility_status']] == 1.0
+
+    def test_seeded_distribution(self):
+        """Seeded runs are reproducible and centred on the nominal concentration"""
+        first = self.calculator.monte_carlo_formulation(self.config, n_samples=1_000_000, seed=42)
+        second = self.calculator.monte_carlo_formulation(self.config, n_samples=1_000_000, seed=42)
+        assert first == second
+
+        achieved = first['achieved_concentration']
+        assert achieved['p5'] < 250.0 < achieved['p95']
+        assert achieved['mean'] == pytest.approx(250.0, rel=1e-3)
+        assert sum(first['status_probabilities'].values()) == pytest.approx(1.0)
+
+    def test_unknown_tolerance_rejected(self):
+        with pytest.raises(ValidationError, match="Unknown tolerance"):
+            self.calculator.monte_carlo_formulation(self.config, n_samples=10, tolerances={'syringe': 0.1})
+
+@requires_numpy
+class TestPharmacokinetics:
+    """Test the depot pharmacokinetic curve engine"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def test_matches_explicit_superposition(self):
+        """Closed-form schedule equals summing single-dose responses"""
+        result = self.calculator.simulate_serum_levels('estradiol_valerate', 5.0, 7.0, duration_days=60, step_hours=6)
+        ester = self.calculator.esters['estradiol_valerate']
+        ka, ke = cmm._pk_rate_constants(ester['half_life_days'], cmm.PK_ELIMINATION_HALF_LIFE_DAYS)
+        t = result['time_days']
+        expected = sum(5.0 * cmm._unit_response(t - start, ka, ke, ester['ester_efficiency'])
+                       for start in np.arange(0, 61, 7.0))
+        assert np.allclose(result['levels'][0], expected, rtol=1e-9)
+
+    def test_steady_state_matches_simulation(self):
+        """Late-schedule curve reaches the analytic peak, trough and average"""
+        result = self.calculator.simulate_serum_levels(
+            ['estradiol_valerate', 'testosterone_cypionate'], [5.0, 100.0], 7.0, step_hours=0.25)
+        last_week = result['levels'][:, -7 * 96 - 1:]
+        steady = result['steady_state']
+        assert np.allclose(last_week.max(axis=1), steady['peak'], rtol=1e-3)
+        assert np.allclose(last_week.min(axis=1), steady['trough'], rtol=1e-6)
+        assert steady['average'][0] == pytest.approx(5.0 * 0.7640 / 7.0)
+
+    def test_finite_dose_count_washes_out(self):
+        """After the last of n_doses levels decay toward zero"""
+        result = self.calculator.simulate_serum_levels('testosterone_enanthate', 100.0, 7.0, duration_days=120, n_doses=4)
+        assert result['levels'][0, -1] < 1e-3 * result['levels'][0].max()
+
+    def test_default_interval_and_validation(self):
+        """Typical interval is the default; sprays cannot be simulated"""
+        default = self.calculator.simulate_serum_levels('estradiol_cypionate', 5.0, duration_days=30)
+        explicit = self.calculator.simulate_serum_levels('estradiol_cypionate', 5.0, 14.0, duration_days=30)
+        assert np.array_equal(default['levels'], explicit['levels'])
+        with pytest.raises(ValidationError):
+            self.calculator.simulate_serum_levels('estradiol_spray', 1.0, 1.0)
+
+@requires_numpy
+class TestDoseLogSimulation:
+    """Test FFT convolution of irregular dose logs"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def naive_levels(self, time_days, day, dose_mg, ester_key):
+        ester = self.calculator.esters[ester_key]
+        ka, ke = cmm._pk_rate_constants(ester['half_life_days'], cmm.PK_ELIMINATION_HALF_LIFE_DAYS)
+        return sum(dose * cmm._unit_response(time_days - start, ka, ke, ester['ester_efficiency'])
+                   for start, dose in zip(day, dose_mg))
+
+    def test_matches_naive_superposition(self):
+        """Irregular log matches per-dose superposition within tolerance"""
+        rng = np.random.default_rng(7)
+        day = np.cumsum(rng.uniform(4.0, 10.0, 40))
+        dose_mg = rng.uniform(3.0, 6.0, 40)
+        result = self.calculator.simulate_dose_log({'day': day, 'dose_mg': dose_mg}, 'estradiol_valerate')
+        naive = self.naive_levels(result['time_days'], day, dose_mg, 'estradiol_valerate')
+        assert np.max(np.abs(result['levels'] - naive)) < 0.02 * naive.max()
+
+        on_grid = {'day': np.round(day), 'dose_mg': dose_mg}
+        result = self.calculator.simulate_dose_log(on_grid, 'estradiol_valerate')
+        naive = self.naive_levels(result['time_days'], on_grid['day'], dose_mg, 'estradiol_valerate')
+        assert np.allclose(result['levels'], naive, atol=1e-9 * naive.max())
+
+    def test_csv_log_with_dates_and_ester_switch(self, tmp_path):
+        """Dates become days since the first dose and each ester is convolved separately"""
+        path = str(tmp_path / 'log.csv')
+        with open(path, 'w') as f:
+            f.write("date,dose_mg,ester_key\n2024-01-01,5,estradiol_valerate\n"
+                    "2024-01-08,5,estradiol_valerate\n2024-01-15,4,estradiol_cypionate\n")
+        log = self.calculator.load_dose_log(path)
+        assert log['day'].tolist() == [0.0, 7.0, 14.0]
+
+        result = self.calculator.simulate_dose_log(path, duration_days=60)
+        naive = (self.naive_levels(result['time_days'], [0.0, 7.0], [5.0, 5.0], 'estradiol_valerate') +
+                 self.naive_levels(result['time_days'], [14.0], [4.0], 'estradiol_cypionate'))
+        assert np.allclose(result['levels'], naive, atol=1e-9 * naive.max())
+
+    def test_invalid_log_rejected(self, tmp_path):
+        path = str(tmp_path / 'bad.csv')
+        with open(path, 'w') as f:
+            f.write("when,amount\n1,5\n")
+        with pytest.raises(ValidationError, match="dose_mg"):
+            self.calculator.load_dose_log(path)
+        with pytest.raises(ValidationError, match="ester_key"):
+            self.calculator.simulate_dose_log({'day': [0.0], 'dose_mg': [5.0]})
+
+@requires_numpy
+class TestSteadyStateTable:
+    """Test the persisted steady-state table"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def test_table_persisted_and_matches_analytic(self, tmp_path):
+        """Table is written under cache_dir and agrees with the analytic solution"""
+        self.calculator.cache_dir = str(tmp_path)
+        table = self.calculator.steady_state_table()
+        assert os.path.exists(tmp_path / cmm.STEADY_STATE_CACHE_FILE)
+        assert table['peak_per_mg'].shape == (len(table['ester_keys']), cmm.STEADY_STATE_MAX_INTERVAL_DAYS)
+        assert 'estradiol_spray' not in table['ester_keys']
+
+        lookup = self.calculator.steady_state_lookup(['estradiol_valerate', 'testosterone_cypionate'], [7, 10.5], [5.0, 100.0])
+        analytic = self.calculator.steady_state_levels(['estradiol_valerate', 'testosterone_cypionate'], [5.0, 100.0], [7, 10.5])
+        for field in ('peak', 'trough', 'average'):
+            assert np.allclose(lookup[field], analytic[field], rtol=1e-12)
+
+    def test_rebuilt_when_ester_data_changes(self, tmp_path):
+        """Editing the ester table regenerates the table and the cached file without explicit invalidation"""
+        self.calculator.cache_dir = str(tmp_path)
+        original = self.calculator.steady_state_table()['peak_per_mg'].copy()
+        self.calculator.esters['estradiol_valerate']['half_life_days'] = 5.0
+        rebuilt = self.calculator.steady_state_table()
+        with np.load(tmp_path / cmm.STEADY_STATE_CACHE_FILE) as cached:
+            assert str(cached['ester_hash']) == cmm.ester_table_hash(self.calculator.esters) != cmm.ester_table_hash()
+        assert not np.allclose(rebuilt['peak_per_mg'], original)
+
+@requires_numpy
+class TestScheduleOptimizer:
+    """Test the dose x interval x ester schedule optimizer"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def test_candidates_within_window_and_ranked(self, tmp_path):
+        """Every candidate stays in the window and scores are ascending"""
+        self.calculator.cache_dir = str(tmp_path)
+        candidates = self.calculator.optimize_injection_schedule(
+            0.3, 0.9, 40.0, ester_keys=['estradiol_valerate', 'estradiol_cypionate'], max_results=20)
+        assert candidates
+        scores = [c['score'] for c in candidates]
+        assert scores == sorted(scores)
+        for candidate in candidates:
+            assert candidate['trough'] >= 0.3 and candidate['peak'] <= 0.9
+            assert candidate['dose_mg'] in self.calculator.esters[candidate['ester_key']]['common_doses']
+            assert candidate['volume_ml'] == pytest.approx(candidate['dose_mg'] / 40.0)
+            if candidate['easy_draw'] is not None:
+                assert candidate['easy_draw'] in self.calculator.calculate_easy_draw_dosages(40.0)
+                assert candidate['easy_draw']['dose_mg'] == pytest.approx(candidate['dose_mg'])
+        assert any(c['easy_draw'] is not None for c in candidates)
+        assert any(c['easy_draw'] is None for c in candidates)
+
+        best = candidates[0]
+        steady = self.calculator.steady_state_levels(best['ester_key'], best['dose_mg'], best['interval_days'])
+        assert best['peak'] == pytest.approx(float(steady['peak']))
+
+    def test_continuous_dose_range(self, tmp_path):
+        """A continuous dose range and fractional intervals are searched too"""
+        self.calculator.cache_dir = str(tmp_path)
+        candidates = self.calculator.optimize_injection_schedule(
+            0.3, 0.9, {'estradiol_valerate': 40.0}, ester_keys=['estradiol_valerate'],
+            doses_mg=np.arange(1.0, 10.0, 0.5), intervals_days=np.arange(2.0, 8.0, 0.5))
+        assert candidates and all(c['trough'] >= 0.3 and c['peak'] <= 0.9 for c in candidates)
+
+    def test_invalid_window_rejected(self):
+        with pytest.raises(ValidationError):
+            self.calculator.optimize_injection_schedule(1.0, 0.5, 40.0)
+        with pytest.raises(ValidationError):
+            self.calculator.optimize_injection_schedule(0.3, 0.9, 40.0, ester_keys=['no_such_ester'])
+
+@requires_numpy
+class TestSupplyPlanner:
+    """Test batch supply-duration planning"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.config = {
+            'formulation_type': 'injectable',
+            'ester_key': 'estradiol_valerate',
+            'ester': self.calculator.esters['estradiol_valerate'],
+            'total_volume': 20.0,
+            'num_vials': 2,
+            'vial_size': 10.0,
+            'loss_modifier': 10.0,
+            'concentration': 40.0,
+            'oil_key': 'mct_oil',
+            'oil': self.calculator.carrier_oils['mct_oil'],
+            'ba_percent': 2.0,
+            'bb_percent': 10.0
+        }
+
+    def test_doses_and_duration(self):
+        """Dead space per draw reduces whole doses per vial"""
+        formulation = self.calculator.calculate_formulation(self.config)
+        plan = self.calculator.plan_batch_supply(formulation, [4.0, 5.0], 7.0, dead_space_ml=0.1,
+                                                 lead_time_days=14.0, start_date='2026-01-01')
+        # 4mg = 0.1mL + 0.1mL dead space -> 50 draws per 10mL vial
+        assert plan['doses_per_vial'].tolist() == [50, 44]
+        assert plan['total_doses'].tolist() == [100, 88]
+        assert plan['batch_duration_days'][0] == 700.0
+        assert plan['compound_next_day'][0] == 686.0
+        assert plan['runout_date'][0] == '2027-12-02'
+
+    def test_roster_and_csv(self, tmp_path):
+        """A roster of formulations plans in one call and writes a CSV table"""
+        small = dict(self.config, num_vials=1, vial_size=5.0)
+        plan = self.calculator.plan_batch_supply([self.config, small], [5.0, 5.0], [7.0, 14.0],
+                                                 patient_ids=['a', 'b'])
+        assert plan['total_doses'].tolist() == [102, 25]
+        assert plan['batch_duration_days'].tolist() == [714.0, 350.0]
+
+        path = str(tmp_path / 'plan.csv')
+        assert cmm.write_supply_plan(plan, path) == 2
+        with open(path) as f:
+            header = f.readline().strip().split(',')
+            assert tuple(header) == cmm.SUPPLY_PLAN_FIELDS
+            assert f.readline().startswith('a,2,10.0,40.0,5.0,7.0')
+
+    def test_invalid_schedule_rejected(self):
+        with pytest.raises(ValidationError):
+            self.calculator.plan_batch_supply(self.config, 0.0, 7.0)
+
+@requires_numpy
+class TestResponseCurveCache:
+    """Test the unit response curve LRU cache"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.calculator.configure_response_cache()
+
+    def teardown_method(self):
+        self.calculator.configure_response_cache()
+
+    def test_hits_and_read_only(self):
+        """Repeated requests hit the cache and return read-only arrays"""
+        first = self.calculator.unit_response_curve('estradiol_valerate', 1.0, 90.0)
+        second = self.calculator.unit_response_curve('estradiol_valerate', 1.0, 90.0)
+        assert first is second
+        assert not first.flags.writeable
+        stats = self.calculator.response_cache_info()
+        assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+        assert stats['current_bytes'] == first.nbytes
+
+    def test_lru_eviction_under_budget(self):
+        """Least recently used curves are evicted to stay within the byte budget"""
+        curve_bytes = self.calculator.unit_response_curve('estradiol_valerate', 1.0, 90.0).nbytes
+        self.calculator.configure_response_cache(max_bytes=2 * curve_bytes)
+        for key in ('estradiol_valerate', 'estradiol_cypionate', 'estradiol_valerate', 'estradiol_enanthate'):
+            self.calculator.unit_response_curve(key, 1.0, 90.0)
+        stats = self.calculator.response_cache_info()
+        assert stats['evictions'] == 1 and stats['entries'] == 2
+        assert stats['current_bytes'] <= stats['max_bytes']
+
+        # Cypionate was least recently used, valerate survives
+        self.calculator.unit_response_curve('estradiol_valerate', 1.0, 90.0)
+        assert self.calculator.response_cache_info()['hits'] == 2
+
+    def test_dose_logs_share_bucketed_curves(self):
+        """Logs of different lengths reuse one cached curve per ester"""
+        for weeks in (10, 11, 12):
+            log = {'day': 7.0 * np.arange(weeks), 'dose_mg': np.full(weeks, 5.0)}
+            result = self.calculator.simulate_dose_log(log, 'estradiol_valerate')
+            assert result['time_days'][-1] == pytest.approx(7.0 * (weeks - 1) + 3 * 3.5, abs=1 / 24)
+        stats = self.calculator.response_cache_info()
+        assert (stats['misses'], stats['hits'], stats['entries']) == (1, 2, 1)
+
+    def test_spill_reloads_memory_mapped(self, tmp_path):
+        """Evicted curves come back from the .npy spill as memory maps"""
+        self.calculator.configure_response_cache(max_bytes=0, spill_dir=str(tmp_path))
+        computed = self.calculator.unit_response_curve('testosterone_cypionate', 2.0, 60.0)
+        reloaded = self.calculator.unit_response_curve('testosterone_cypionate', 2.0, 60.0)
+        assert isinstance(reloaded, np.memmap) and not reloaded.flags.writeable
+        assert np.array_equal(computed, reloaded)
+        assert self.calculator.response_cache_info()['spill_hits'] == 1
+        assert len(list(tmp_path.glob('*.npy'))) == 1
+
+@requires_numpy
+class TestEsterSwitch:
+    """Test the ester switch transition simulator"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def test_curve_is_sum_of_both_schedules(self):
+        """Before the switch the curve is the old steady state; afterwards both depots add up"""
+        result = self.calculator.simulate_ester_switch(
+            'estradiol_valerate', 5.0, 7.0, 'estradiol_cypionate', 5.0, 7.0, 28.0, duration_days=120)
+        steady = result['steady_state']
+        assert result['old_levels'][:28 * 24].max() == pytest.approx(steady['peak'][0], rel=1e-3)
+        assert np.all(result['new_levels'][0, :28 * 24] == 0)
+
+        # Same regimen as an explicit dose log with a long run-in standing in for the infinite past
+        log = {'day': np.array([7.0 * n for n in range(104)] + [728.0 + 7 * n for n in range(14)]),
+               'dose_mg': np.full(118, 5.0),
+               'ester_key': ['estradiol_valerate'] * 104 + ['estradiol_cypionate'] * 14}
+        reference = self.calculator.simulate_dose_log(log, duration_days=820.0)['levels'][700 * 24:]
+        assert np.allclose(result['levels'][0], reference[:len(result['time_days'])], atol=1e-6)
+
+    def test_offset_sweep(self):
+        """Sweeping offsets gives one curve per offset and a zero-penalty best offset"""
+        offsets = np.arange(-6.0, 8.0, 0.5)
+        result = self.calculator.simulate_ester_switch(
+            'estradiol_valerate', 5.0, 7.0, 'estradiol_cypionate', 5.0, 7.0, 28.0, offsets_days=offsets)
+        assert result['levels'].shape == (len(offsets), len(result['time_days']))
+        best = list(offsets).index(result['best_offset_days'])
+        assert result['undershoot'][best] + result['overshoot'][best] == pytest.approx(0, abs=1e-9)
+        # Among transitions inside the band the one closest to the target averages wins
+        in_band = result['undershoot'] + result['overshoot'] < 1e-9
+        assert in_band.sum() > 1 and result['deviation'][best] == result['deviation'][in_band].min()
+        # Delaying the new ester a full week leaves a dip below both troughs
+        assert result['undershoot'][-1] > 0
+
+    def test_ties_pick_offset_nearest_switch_day(self):
+        """Offsets whose new doses all fall after the simulated window score the same"""
+        result = self.calculator.simulate_ester_switch(
+            'estradiol_valerate', 5.0, 7.0, 'estradiol_cypionate', 5.0, 7.0, 28.0, offsets_days=[5.0, 3.0, 4.0],
+            duration_days=30.0)
+        assert len(set(result['deviation'].tolist())) == 1
+        assert result['best_offset_days'] == 3.0
+
+    def test_invalid_switch_rejected(self):
+        with pytest.raises(ValidationError):
+            self.calculator.simulate_ester_switch('estradiol_valerate', 5, 7, 'estradiol_spray', 1, 1, 14)
+
+@requires_numpy
+class TestLevelCurvePlotting:
+    """Test decimated multi-curve level plots"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def test_min_max_decimation_keeps_envelope(self):
+        """Each curve keeps its extremes with two points per bucket"""
+        curves = self.calculator.simulate_serum_levels(['estradiol_valerate'] * 3, [3.0, 5.0, 7.0], 7.0)
+        times, values = cmm.decimate_min_max(curves['time_days'], curves['levels'], 500)
+        assert values.shape[1] == len(times) <= 1000
+        assert np.array_equal(values.max(axis=1), curves['levels'].max(axis=1))
+        assert np.array_equal(values.min(axis=1), curves['levels'].min(axis=1))
+        assert np.all(np.diff(times) >= 0)
+
+    @pytest.mark.skipif(not PDF_AVAILABLE, reason="matplotlib not installed")
+    def test_plotter_reuses_figure(self):
+        """Renders share one figure and draw every curve through one LineCollection"""
+        curves = self.calculator.simulate_serum_levels(['estradiol_valerate'] * 40, np.linspace(2, 8, 40), 7.0)
+        first = self.calculator.plot_level_curves(curves, band=(0.3, 0.9))
+        second = self.calculator.plot_level_curves(curves)
+        plotter = cmm.get_level_plotter()
+        assert first is second is plotter.figure
+        assert len(plotter.ax.collections) == 1
+        assert len(plotter.collection.get_segments()) == 40
+        assert len(plotter.collection.get_segments()[0]) <= 2 * plotter.width_px
+
+    @pytest.mark.skipif(not PDF_AVAILABLE, reason="matplotlib not installed")
+    def test_pdf_expected_levels_page(self, tmp_path):
+        """The worksheet gains an expected levels page on request"""
+        self.calculator.pdfs_dir = str(tmp_path)
+        formulation = self.calculator.calculate_formulation({
+            'formulation_type': 'injectable', 'ester_key': 'estradiol_valerate',
+            'ester': self.calculator.esters['estradiol_valerate'], 'total_volume': 10.0, 'loss_modifier': 10.0,
+            'concentration': 40.0, 'oil_key': 'mct_oil', 'oil': self.calculator.carrier_oils['mct_oil'],
+            'ba_percent': 2.0, 'bb_percent': 10.0})
+        with open(self.calculator.generate_pdf_worksheet(formulation), 'rb') as f:
+            assert b'/Count 1' in f.read()
+        with open(self.calculator.generate_pdf_worksheet(formulation, expected_levels=True), 'rb') as f:
+            assert b'/Count 2' in f.read()
+
+    @pytest.mark.skipif(not PDF_AVAILABLE, reason="matplotlib not installed")
+    def test_results_menu_levels_page_is_opt_in(self, monkeypatch):
+        """The results menu only adds the levels page when the user asks for it"""
+        formulation = self.calculator.calculate_formulation({
+            'formulation_type': 'injectable', 'ester_key': 'estradiol_valerate',
+            'ester': self.calculator.esters['estradiol_valerate'], 'total_volume': 10.0, 'loss_modifier': 10.0,
+            'concentration': 40.0, 'oil_key': 'mct_oil', 'oil': self.calculator.carrier_oils['mct_oil'],
+            'ba_percent': 2.0, 'bb_percent': 10.0})
+        requested = []
+        monkeypatch.setattr(self.calculator, 'generate_pdf_worksheet',
+                            lambda f, expected_levels=None: requested.append(expected_levels) or 'worksheet.pdf')
+        answers = iter(['3', '', 'n', '3', 'y', 'n', '1'])
+        monkeypatch.setattr('builtins.input', lambda prompt='': next(answers))
+        assert self.calculator.display_results(formulation) == 'MAIN_MENU'
+        assert requested == [False, True]
+
+@requires_numpy
+class TestEasyDrawTable:
+    """Test the vectorized easy-draw dose table"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def test_dose_matrix_and_doses_per_vial(self):
+        """Every concentration is paired with every graduation mark"""
+        table = self.calculator.easy_draw_table([20.0, 40.0], syringes=['1ml', '3ml'], vial_size=10.0, dead_space_ml=0.1)
+        assert table['dose_mg'].shape == (2, 100 + 30)
+        assert table['volume_ml'][0] == 0.01 and table['volume_ml'][-1] == 3.0
+        assert set(table['syringe']) == {'1ml', '3ml'}
+        assert table['dose_mg'][1, 9] == pytest.approx(4.0)  # 0.1mL at 40mg/mL
+        assert table['doses_per_vial'][9] == 50  # 0.1mL + 0.1mL dead space
+
+    def test_best_round_concentration(self):
+        """Round-number counts rank candidate concentrations"""
+        table = self.calculator.easy_draw_table([33.0, 40.0], syringes=['1ml'], round_step_mg=0.5, dose_range=(1.0, 10.0))
+        # 40mg/mL hits 2, 4, 6, 8, 10 mg on 0.05mL marks; 33mg/mL never lands on a half milligram in range
+        assert table['round_count'].tolist() == [0, 5]
+        assert table['best_concentration'] == 40.0
+
+        many = self.calculator.easy_draw_table(np.arange(10.0, 510.0, 1.0))
+        assert many['round_count'].shape == (500,)
+        assert many['round_count'][int(many['best_concentration']) - 10] == many['round_count'].max()
+
+    def test_unknown_syringe_rejected(self):
+        with pytest.raises(ValidationError, match="Unknown syringe"):
+            self.calculator.easy_draw_table([40.0], syringes=['5ml'])
+
+class TestRecipeStore:
+    """Test the SQLite recipe store"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def formulation(self, ester_key: str, concentration: float, bb_percent: float = 10.0) -> Dict:
+        return self.calculator.calculate_formulation({
+            'formulation_type': 'injectable', 'ester_key': ester_key, 'ester': self.calculator.esters[ester_key],
+            'total_volume': 10.0, 'loss_modifier': 10.0, 'concentration': concentration, 'oil_key': 'mct_oil',
+            'oil': self.calculator.carrier_oils['mct_oil'], 'ba_percent': 2.0, 'bb_percent': bb_percent})
+
+    def test_save_load_and_range_query(self, tmp_path):
+        """Recipes round-trip and filter by indexed columns and ranges"""
+        with self.calculator.open_recipe_store(str(tmp_path / 'recipes.sqlite3')) as store:
+            for concentration in (100.0, 150.0, 200.0, 250.0):
+                store.save(f"tc_{concentration:.0f}", self.formulation('testosterone_cypionate', concentration))
+            store.save("ev_40", self.formulation('estradiol_valerate', 40.0))
+
+            assert store.load("tc_200")['config']['concentration'] == 200.0
+            rows = store.query(ester_key='testosterone_cypionate', concentration=(150, 250), order_by='concentration')
+            assert [row['name'] for row in rows] == ['tc_150', 'tc_200', 'tc_250']
+            assert store.count(concentration=(None, 100)) == 2
+
+            store.save("tc_200", self.formulation('testosterone_cypionate', 200.0, bb_percent=20.0))
+            assert store.count() == 5
+            assert store.query(bb_percent=20.0)[0]['name'] == 'tc_200'
+            with pytest.raises(ValidationError, match="Unknown recipe column"):
+                store.query(api_mass_g=(0, 1))
+
+    def test_paging_and_json_import(self, tmp_path):
+        """The JSON directory imports in one pass and lists page by page"""
+        recipes_dir = tmp_path / 'recipes'
+        recipes_dir.mkdir()
+        for i in range(25):
+            with open(recipes_dir / f"recipe_{i:02d}.json", 'w') as f:
+                json.dump(self.formulation('estradiol_valerate', 20.0 + i), f)
+        (recipes_dir / 'broken.json').write_text('{not json')
+        self.calculator.recipes_dir = str(recipes_dir)
+
+        with self.calculator.open_recipe_store(str(tmp_path / 'recipes.sqlite3'), import_existing=True) as store:
+            assert store.count() == 25
+            pages = [store.list_page(page, page_size=10) for page in range(3)]
+            assert [len(page) for page in pages] == [10, 10, 5]
+            assert pages[1][0]['name'] == 'recipe_10'
+            assert store.import_json_directory(str(recipes_dir), overwrite=False) == 0
+
+    def test_store_and_directory_agree(self, tmp_path):
+        """The store keeps v2 documents and recalculates them against changed tables like load_recipe"""
+        recipes_dir = tmp_path / 'recipes'
+        recipes_dir.mkdir()
+        self.calculator.cache_dir, self.calculator.recipes_dir = str(tmp_path), str(recipes_dir)
+        formulation = json.loads(json.dumps(self.formulation('testosterone_cypionate', 200.0)))
+        path = self.calculator.save_recipe(formulation, 'tc200')
+
+        with self.calculator.open_recipe_store(str(tmp_path / 'recipes.sqlite3')) as store:
+            store.save('tc200', formulation)
+            data = json.loads(store.connection.execute("SELECT data FROM recipes").fetchone()[0])
+            assert data['recipe_format'] == cmm.RECIPE_FORMAT_VERSION and 'ester' not in data['config']
+            assert store.load('tc200') == self.calculator.load_recipe(path) == formulation
+
+            self.calculator.esters['testosterone_cypionate']['density'] = 2.0
+            self.calculator.invalidate_caches()
+            from_store, from_file = store.load('tc200'), self.calculator.load_recipe(path)
+            assert from_store == from_file
+            assert from_store['config']['ester']['density'] == 2.0
+            assert from_store['calculations']['api_volume_displaced_ml'] == pytest.approx(
+                formulation['calculations']['api_mass_g'] / 2.0)
+
+class TestRecipeIndex:
+    """Test the incremental recipe directory index"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def formulation(self, concentration: float) -> Dict:
+        return self.calculator.calculate_formulation({
+            'formulation_type': 'injectable', 'ester_key': 'estradiol_valerate',
+            'ester': self.calculator.esters['estradiol_valerate'], 'total_volume': 10.0, 'loss_modifier': 10.0,
+            'concentration': concentration, 'oil_key': 'mct_oil', 'oil': self.calculator.carrier_oils['mct_oil'],
+            'ba_percent': 2.0, 'bb_percent': 10.0})
+
+    def settle(self, path):
+        """Backdate the directory mtime so the index may trust it"""
+        past = os.stat(path).st_mtime_ns - 10 * 10**9
+        os.utime(path, ns=(past, past))
+
+    def test_summaries_persist_across_instances(self, tmp_path):
+        """A second calculator reads summaries from the index without parsing recipes"""
+        recipes_dir = tmp_path / 'recipes'
+        recipes_dir.mkdir()
+        self.calculator.cache_dir, self.calculator.recipes_dir = str(tmp_path), str(recipes_dir)
+        for concentration in (40.0, 20.0):
+            self.calculator.save_recipe(self.formulation(concentration), f"ev_{concentration:.0f}")
+        self.settle(recipes_dir)
+        assert self.calculator.list_recipes() == ['ev_20.json', 'ev_40.json']
+        assert os.path.exists(tmp_path / cmm.RECIPE_INDEX_FILE)
+
+        other = CompoundMeMommyCalculator()
+        other.cache_dir, other.recipes_dir = str(tmp_path), str(recipes_dir)
+        parsed = []
+        original_parse = cmm.RecipeIndex._parse
+        cmm.RecipeIndex._parse = lambda index, entry: parsed.append(entry.name) or original_parse(index, entry)
+        try:
+            summaries = other.recipe_summaries()
+        finally:
+            cmm.RecipeIndex._parse = original_parse
+        assert parsed == []
+        assert summaries['concentration'] == [20.0, 40.0]
+        assert summaries['ester_key'] == ['estradiol_valerate'] * 2
+
+    def test_incremental_refresh(self, tmp_path):
+        """New, removed and overwritten recipes are picked up"""
+        recipes_dir = tmp_path / 'recipes'
+        recipes_dir.mkdir()
+        self.calculator.cache_dir, self.calculator.recipes_dir = str(tmp_path), str(recipes_dir)
+        self.calculator.save_recipe(self.formulation(40.0), "ev")
+        assert self.calculator.recipe_summaries()['concentration'] == [40.0]
+
+        # Overwriting in place through save_recipe updates the index directly
+        self.calculator.save_recipe(self.formulation(30.0), "ev")
+        self.settle(recipes_dir)
+        assert self.calculator.recipe_summaries()['concentration'] == [30.0]
+
+        with open(recipes_dir / 'external.json', 'w') as f:
+            json.dump(self.formulation(50.0), f)
+        os.unlink(recipes_dir / 'ev.json')
+        summaries = self.calculator.recipe_summaries()
+        assert summaries['filename'] == ['external.json']
+        assert summaries['concentration'] == [50.0]
+
+    def test_saves_insert_in_place_and_flush_lazily(self, tmp_path):
+        """save_recipe inserts sorted rows without rewriting the index file each time"""
+        recipes_dir = tmp_path / 'recipes'
+        recipes_dir.mkdir()
+        self.calculator.cache_dir, self.calculator.recipes_dir = str(tmp_path), str(recipes_dir)
+        self.calculator.save_recipe(self.formulation(40.0), "ev_b")
+        self.settle(recipes_dir)
+        self.calculator.list_recipes()
+        index_file = tmp_path / cmm.RECIPE_INDEX_FILE
+
+        writes = []
+        original_save = cmm.RecipeIndex._save
+        cmm.RecipeIndex._save = lambda index: writes.append(1) or original_save(index)
+        try:
+            for name, concentration in (("ev_c", 30.0), ("ev_a", 20.0), ("ev_b", 50.0)):
+                self.calculator.save_recipe(self.formulation(concentration), name)
+            index = self.calculator.recipe_index()
+            assert writes == [] and index.dirty and not index_file.exists()
+            assert index.columns['filename'] == ['ev_a.json', 'ev_b.json', 'ev_c.json']
+            assert index.columns['concentration'] == [20.0, 50.0, 30.0]
+            index.flush()
+        finally:
+            cmm.RecipeIndex._save = original_save
+        assert writes == [1] and index_file.exists()
+
+        self.settle(recipes_dir)
+        other = CompoundMeMommyCalculator()
+        other.cache_dir, other.recipes_dir = str(tmp_path), str(recipes_dir)
+        assert other.recipe_summaries()['concentration'] == [20.0, 50.0, 30.0]
+
+    def test_find_recipes_opens_only_matches(self, tmp_path):
+        """Filters run on the index; load=True reads just the matching files"""
+        recipes_dir = tmp_path / 'recipes'
+        recipes_dir.mkdir()
+        self.calculator.cache_dir, self.calculator.recipes_dir = str(tmp_path), str(recipes_dir)
+        for concentration in (150.0, 200.0, 250.0):
+            formulation = self.calculator.calculate_formulation({
+                'formulation_type': 'injectable', 'ester_key': 'testosterone_cypionate',
+                'ester': self.calculator.esters['testosterone_cypionate'], 'total_volume': 10.0,
+                'loss_modifier': 10.0, 'concentration': concentration, 'oil_key': 'mct_oil',
+                'oil': self.calculator.carrier_oils['mct_oil'], 'ba_percent': 2.0, 'bb_percent': 20.0})
+            formulation['metadata']['created_date'] = f"2024-0{int(concentration) // 50}-15T10:00:00"
+            self.calculator.save_recipe(formulation, f"tc_{concentration:.0f}")
+        self.calculator.save_recipe(self.formulation(40.0), "ev_40")
+
+        loaded = []
+        original_load = self.calculator.load_recipe
+        self.calculator.load_recipe = lambda path: loaded.append(os.path.basename(path)) or original_load(path)
+        matches = self.calculator.find_recipes(load=True, ester_key='testosterone_cypionate',
+                                               oil_key='mct_oil', concentration=(200, None))
+        assert [m['filename'] for m in matches] == ['tc_200.json', 'tc_250.json']
+        assert loaded == ['tc_200.json', 'tc_250.json']
+        assert matches[1]['formulation']['config']['concentration'] == 250.0
+
+        assert [m['filename'] for m in self.calculator.find_recipes(created_date='2024-04')] == ['tc_200.json']
+        assert len(self.calculator.find_recipes(created_date=('2024-03-01', '2024-04-15'))) == 2
+        with pytest.raises(ValidationError, match="Unknown recipe column"):
+            self.calculator.find_recipes(api_mass_g=1.0)
+
+class TestRecipeDeduplication:
+    """Test content-addressed recipe storage and the dedupe command"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+
+    def formulation(self, concentration: float = 40.0) -> Dict:
+        return self.calculator.calculate_formulation({
+            'formulation_type': 'injectable', 'ester_key': 'estradiol_valerate',
+            'ester': self.calculator.esters['estradiol_valerate'], 'total_volume': 10.0, 'loss_modifier': 10.0,
+            'concentration': concentration, 'oil_key': 'mct_oil', 'oil': self.calculator.carrier_oils['mct_oil'],
+            'ba_percent': 2.0, 'bb_percent': 10.0})
+
+    def use_dir(self, tmp_path):
+        recipes_dir = tmp_path / 'recipes'
+        recipes_dir.mkdir()
+        self.calculator.cache_dir, self.calculator.recipes_dir = str(tmp_path), str(recipes_dir)
+        return recipes_dir
+
+    def test_identical_recipes_share_one_blob(self, tmp_path):
+        """Names become aliases of one blob and load back in full"""
+        recipes_dir = self.use_dir(tmp_path)
+        first, second = self.formulation(), self.formulation()
+        second['metadata']['created_date'] = '2024-01-01T00:00:00'
+        assert cmm.recipe_content_hash(first) == cmm.recipe_content_hash(second)
+        assert cmm.recipe_content_hash(first) != cmm.recipe_content_hash(self.formulation(41.0))
+        whole = self.formulation()
+        whole['config']['concentration'] = 40
+        assert cmm.recipe_content_hash(whole) == cmm.recipe_content_hash(first)
+
+        self.calculator.save_recipe(first, 'monday')
+        path = self.calculator.save_recipe(second, 'tuesday')
+        assert len(list((recipes_dir / cmm.RECIPE_BLOB_DIR).iterdir())) == 1
+        with open(path) as f:
+            assert 'ester' not in json.load(f)['config']
+
+        loaded = self.calculator.load_recipe(path)
+        assert loaded == json.loads(json.dumps(second))
+        assert self.calculator.find_recipes(created_date='2024-01')[0]['filename'] == 'tuesday.json'
+
+    def test_recipes_differing_in_any_input_do_not_collide(self, tmp_path):
+        """Spray regimens change the calculations, so each regimen gets its own blob"""
+        recipes_dir = self.use_dir(tmp_path)
+        for name, sprays in (('one', 1), ('four', 4)):
+            formulation = self.calculator.calculate_spray_formulation({
+                'formulation_type': 'spray', 'ester_key': 'estradiol_spray',
+                'ester': self.calculator.esters['estradiol_spray'], 'total_volume': 120.0, 'loss_modifier': 0.0,
+                'spray_regimen': {'sprays_per_day': sprays}})
+            self.calculator.save_recipe(formulation, name)
+        assert len(list((recipes_dir / cmm.RECIPE_BLOB_DIR).iterdir())) == 2
+        loaded = self.calculator.load_recipe(str(recipes_dir / 'four.json'))
+        assert loaded['spray_calculations']['bottle_duration_days'] == pytest.approx(300.0)
+
+    def test_dedupe_compacts_existing_library(self, tmp_path):
+        """Full-copy files are converted in place and the savings reported"""
+        recipes_dir = self.use_dir(tmp_path)
+        document = json.loads(json.dumps(self.formulation()))
+        for name in ('a', 'b', 'c'):
+            with open(recipes_dir / f"{name}.json", 'w') as f:
+                json.dump(document, f, indent=2)
+        (recipes_dir / 'broken.json').write_text('{not json')
+
+        preview = self.calculator.dedupe_recipes(dry_run=True)
+        assert not (recipes_dir / cmm.RECIPE_BLOB_DIR).exists()
+        report = self.calculator.dedupe_recipes()
+        assert report == preview
+        assert (report['recipes'], report['converted'], report['blobs_created']) == (4, 3, 1)
+        assert report['bytes_saved'] > 0
+        assert self.calculator.load_recipe(str(recipes_dir / 'b.json')) == document
+        assert self.calculator.dedupe_recipes()['converted'] == 0
+
+    def test_dedupe_command(self, tmp_path, capsys, monkeypatch):
+        recipes_dir = self.use_dir(tmp_path)
+        with open(recipes_dir / 'a.json', 'w') as f:
+            json.dump(self.formulation(), f)
+        monkeypatch.setattr(os.path, 'expanduser', lambda path: str(tmp_path) if path == "~/.compoundmemommy" else path)
+        assert cmm.run_command(['dedupe']) == 0
+        assert "Converted 1 of 1 recipes" in capsys.readouterr().out
+
+class TestRecipeFormat:
+    """Test the v2 recipe schema and migration from v1"""
+
+    def setup_method(self):
+        self.calculator = CompoundMeMommyCalculator()
+        self.document = json.loads(json.dumps(self.calculator.calculate_formulation({
+            'formulation_type': 'injectable', 'ester_key': 'testosterone_cypionate',
+            'ester': self.calculator.esters['testosterone_cypionate'], 'total_volume': 10.0, 'loss_modifier': 10.0,
+            'concentration': 200.0, 'oil_key': 'grapeseed_oil', 'oil': self.calculator.carrier_oils['grapeseed_oil'],
+            'ba_percent': 2.0, 'bb_percent': 20.0})))
+
+    def use_dir(self, tmp_path):
+        recipes_dir = tmp_path / 'recipes'
+        recipes_dir.mkdir()
+        self.calculator.cache_dir, self.calculator.recipes_dir = str(tmp_path), str(recipes_dir)
+        return recipes_dir
+
+    def test_v1_recipe_loads_as_saved(self, tmp_path):
+        recipes_dir = self.use_dir(tmp_path)
+        with open(recipes_dir / 'old.json', 'w') as f:
+            json.dump(self.document, f)
+        assert self.calculator.load_recipe(str(recipes_dir / 'old.json')) == self.document
+
+    def test_saved_blob_references_database_keys(self, tmp_path):
+        """Blobs store keys and the database version; loading restores the entries"""
+        recipes_dir = self.use_dir(tmp_path)
+        path = self.calculator.save_recipe(self.document, 'tc200')
+        blob_path = next((recipes_dir / cmm.RECIPE_BLOB_DIR).iterdir())
+        blob = json.loads(blob_path.read_text())
+        assert blob['recipe_format'] == cmm.RECIPE_FORMAT_VERSION
+        assert blob['database_version'] == cmm.database_version_hash()
+        assert 'ester' not in blob['config'] and 'oil' not in blob['config']
+        assert self.calculator.load_recipe(path) == self.document
+
+    def test_database_change_recalculates(self, tmp_path):
+        """Recipes saved against another database version get fresh calculations"""
+        recipes_dir = self.use_dir(tmp_path)
+        path = self.calculator.save_recipe(self.document, 'tc200')
+        blob_path = next((recipes_dir / cmm.RECIPE_BLOB_DIR).iterdir())
+        blob = json.loads(blob_path.read_text())
+        blob['database_version'] = 'stale'
+        blob['calculations']['api_volume_displaced_ml'] = 0.0
+        blob_path.write_text(json.dumps(blob))
+
+        loaded = self.calculator.load_recipe(path)
+        assert loaded['calculations']['api_volume_displaced_ml'] == pytest.approx(
+            self.document['calculations']['api_volume_displaced_ml'])
+
+    def test_modified_embedded_entry_is_recalculated(self, tmp_path):
+        """v1 recipes calculated with other ester data are migrated and saved as stale, then recalculated"""
+        recipes_dir = self.use_dir(tmp_path)
+        config = dict(self.document['config'], ester=dict(self.document['config']['ester'], density=2.0))
+        stale = json.loads(json.dumps(self.calculator.calculate_formulation(config)))
+        assert stale['calculations']['api_volume_displaced_ml'] != pytest.approx(
+            self.document['calculations']['api_volume_displaced_ml'])
+        with open(recipes_dir / 'old.json', 'w') as f:
+            json.dump(stale, f)
+        self.calculator.migrate_recipes()
+        self.calculator.save_recipe(stale, 'saved')
+        blob_path = next((recipes_dir / cmm.RECIPE_BLOB_DIR).iterdir())
+
+        for document in (json.loads((recipes_dir / 'old.json').read_text()), json.loads(blob_path.read_text())):
+            assert 'ester' not in document['config']
+            assert document['database_version'] == cmm.RECIPE_UNVERIFIED_DATABASE_VERSION
+        for name in ('old', 'saved'):
+            loaded = self.calculator.load_recipe(str(recipes_dir / f"{name}.json"))
+            assert loaded['config']['ester'] == self.document['config']['ester']
+            assert loaded['calculations']['api_volume_displaced_ml'] == pytest.approx(
+                self.document['calculations']['api_volume_displaced_ml'])
+
+    def test_migrate_lists_before_rewriting(self, tmp_path, monkeypatch):
+        """No file is replaced while a directory scan is still open"""
+        recipes_dir = self.use_dir(tmp_path)
+        for name in ('a', 'b', 'c'):
+            with open(recipes_dir / f"{name}.json", 'w') as f:
+                json.dump(self.document, f)
+        open_scans = []
+        real_scandir, real_write = os.scandir, cmm._write_atomic
+
+        class TrackedScan:
+            def __init__(self, path):
+                self.scan = real_scandir(path)
+                open_scans.append(self)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                self.scan.close()
+                open_scans.remove(self)
+
+            def __iter__(self):
+                return iter(self.scan)
+
+        def write(path, text):
+            assert not open_scans
+            real_write(path, text)
+
+        monkeypatch.setattr(cmm.os, 'scandir', TrackedScan)
+        monkeypatch.setattr(cmm, '_write_atomic', write)
+        assert self.calculator.migrate_recipes()['migrated'] == 3
+
+    def test_unknown_ester_key_rejected(self, tmp_path):
+        recipes_dir = self.use_dir(tmp_path)
+        document = cmm._normalize_recipe(self.document, cmm.database_version_hash())
+        document['config']['ester_key'] = 'no_such_ester'
+        (recipes_dir / 'bad.json').write_text(json.dumps(document))
+        with pytest.raises(ValidationError):
+            self.calculator.load_recipe(str(recipes_dir / 'bad.json'))
+
+    def test_migrate_rewrites_v1_files(self, tmp_path, capsys, monkeypatch):
+        recipes_dir = self.use_dir(tmp_path)
+        for name in ('a', 'b'):
+            with open(recipes_dir / f"{name}.json", 'w') as f:
+                json.dump(self.document, f, indent=2)
+        self.calculator.save_recipe(self.document, 'c')
+        (recipes_dir / 'broken.json').write_text('{not json')
+
+        preview = self.calculator.migrate_recipes(dry_run=True)
+        assert 'recipe_format' not in json.loads((recipes_dir / 'a.json').read_text())
+        report = self.calculator.migrate_recipes()
+        assert report == preview
+        assert (report['files'], report['migrated'], report['errors']) == (5, 2, 1)
+        assert report['bytes_after'] < report['bytes_before']
+        assert json.loads((recipes_dir / 'a.json').read_text())['recipe_format'] == cmm.RECIPE_FORMAT_VERSION
+        assert self.calculator.load_recipe(str(recipes_dir / 'a.json')) == self.document
+
+        monkeypatch.setattr(os.path, 'expanduser', lambda path: str(tmp_path) if path == "~/.compoundmemommy" else path)
+        assert cmm.run_command(['migrate']) == 0
+        assert "Migrated 0 of 5 recipe files" in capsys.readouterr().out
+
 if __name__ == '__main__':
     # Run with verbose output
     pytest.main(['-v', '--tb=short', __file__])